@@ -0,0 +1,162 @@
+"""
+Benchmarks RequestCount.tabulate_requests over a synthetic table of requests.
+
+With --baseline, each case is also timed with baseline_tabulate_requests, the
+implementation that RequestCount.tabulate_requests replaced, to measure the
+speedup. The baseline counts each user once overall rather than once per
+bucket when distinct_users is True, so its results differ in those cases, but
+it reads the same rows.
+
+The requests are written to a temporary SQLite database, so the database in
+the Django settings is never touched. Run from the repository root:
+
+    python -m analytics.benchmark --rows 10000000
+    python -m analytics.benchmark --rows 200000 --baseline
+
+The synthetic requests are spread evenly over the last year, with a mix of
+paths, user agents, and logged-in students.
+"""
+
+import argparse
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fireroad.settings")
+
+from django.conf import settings
+
+PATHS = ["/courses/all", "/courses/lookup/6.009", "/courses/search/intro", "/courses/dept/6",
+         "/requirements/progress/major6-3", "/requirements/list_reqs", "/sync/roads",
+         "/sync/schedules", "/user_info", "/verify", "/recommend/get"]
+
+USER_AGENTS = [
+    "FireRoad/1.5 CFNetwork/978.0.7 Darwin/18.7.0",
+    "okhttp/3.10.0",
+    "Mozilla/5.0 (Linux; Android 9; Pixel 3) AppleWebKit/537.36 Chrome/76.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 12_4 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_6) AppleWebKit/605.1.15 Version/12.1.2 Safari/605.1.15"
+]
+
+# Number of rows to insert in each statement
+INSERT_BATCH_SIZE = 50000
+
+def populate(connection, num_rows, num_students, seed=0):
+    """Inserts num_rows synthetic requests over the last year."""
+    from analytics.models import RequestCount
+
+    rand = random.Random(seed)
+    end = datetime.datetime.utcnow()
+    start = end - datetime.timedelta(days=365)
+    step = (end - start).total_seconds() / num_rows
+    students = [("student{}".format(i), str(rand.randint(1, 12))) for i in range(num_students)]
+    sql = "INSERT INTO {} (timestamp, path, user_agent, is_authenticated, student_unique_id, student_semester) VALUES (%s, %s, %s, %s, %s, %s)".format(RequestCount._meta.db_table)
+
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA journal_mode = OFF")
+        for batch_start in range(0, num_rows, INSERT_BATCH_SIZE):
+            rows = []
+            for i in range(batch_start, min(batch_start + INSERT_BATCH_SIZE, num_rows)):
+                timestamp = start + datetime.timedelta(seconds=i * step)
+                student = rand.choice(students) if rand.random() < 0.6 else (None, None)
+                rows.append((timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"), rand.choice(PATHS), rand.choice(USER_AGENTS),
+                             student[0] is not None, student[0], student[1]))
+            cursor.executemany(sql, rows)
+
+def baseline_tabulate_requests(early_time, interval=None, attribute_func=None, distinct_users=False):
+    """The implementation of RequestCount.tabulate_requests before the bucket
+    index was computed arithmetically: it loads every RequestCount in full and
+    scans the buckets for each one."""
+    from django.utils import timezone
+    from analytics.models import RequestCount
+
+    now = timezone.now()
+    buckets = []
+    if interval:
+        curr = early_time
+        while curr < now:
+            buckets.append((curr, {}))
+            curr += interval
+    else:
+        buckets.append((early_time, {}))
+
+    seen_users = set()
+    for request in RequestCount.objects.filter(timestamp__gte=early_time).iterator():
+        if distinct_users and (not request.student_unique_id or request.student_unique_id in seen_users):
+            continue
+        seen_users.add(request.student_unique_id)
+        for time, bucket in buckets:
+            if request.timestamp >= time and (not interval or request.timestamp < time + interval):
+                value = attribute_func(request) if attribute_func else None
+                bucket[value] = bucket.get(value, 0) + 1
+                break
+
+    if not interval:
+        return buckets[0][1]
+    return buckets
+
+def time_call(func, *args):
+    """Returns a tuple (result, seconds elapsed) for calling func with the
+    given arguments."""
+    begin = time.time()
+    result = func(*args)
+    return result, time.time() - begin
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the tabulation of request counts.")
+    parser.add_argument("--rows", type=int, default=10000000, help="number of synthetic requests")
+    parser.add_argument("--students", type=int, default=20000, help="number of distinct students")
+    parser.add_argument("--baseline", action="store_true",
+                        help="also time the previous implementation (slow on large tables)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    settings.DATABASES["default"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(directory, "benchmark.sqlite3"),
+    }
+
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.db import connection
+    from django.utils import timezone
+    from analytics.models import RequestCount
+    from analytics.rollups import translate_user_agent_string
+
+    try:
+        call_command("migrate", run_syncdb=True, verbosity=0)
+        begin = time.time()
+        populate(connection, args.rows, args.students)
+        print("Inserted {:,} requests in {:.1f}s".format(args.rows, time.time() - begin))
+
+        now = timezone.now()
+        cases = [
+            ("day by hour", now - datetime.timedelta(days=1), datetime.timedelta(hours=1), None, False),
+            ("month by day", now - datetime.timedelta(weeks=4), datetime.timedelta(days=1), None, False),
+            ("year by week", now - datetime.timedelta(weeks=52), datetime.timedelta(weeks=1), None, False),
+            ("year of paths", now - datetime.timedelta(weeks=52), None, lambda request: request.path, False),
+            ("year of user agents by week", now - datetime.timedelta(weeks=52), datetime.timedelta(weeks=1),
+             lambda request: translate_user_agent_string(request.user_agent), False),
+            ("year of distinct users by week", now - datetime.timedelta(weeks=52), datetime.timedelta(weeks=1), None, True),
+            ("year of distinct users", now - datetime.timedelta(weeks=52), None, None, True),
+        ]
+        for name, early_time, interval, attribute_func, distinct_users in cases:
+            arguments = (early_time, interval, attribute_func, distinct_users)
+            result, elapsed = time_call(RequestCount.tabulate_requests, *arguments)
+            buckets = result if interval else [(early_time, result)]
+            total = sum(sum(bucket.values()) for _, bucket in buckets)
+            line = "{:<32} {:>8.2f}s  {:>4} buckets  total {:,}".format(name, elapsed, len(buckets), total)
+            if args.baseline:
+                _, baseline_elapsed = time_call(baseline_tabulate_requests, *arguments)
+                line += "  baseline {:.2f}s ({:.1f}x)".format(baseline_elapsed, baseline_elapsed / max(elapsed, 1e-6))
+            print(line)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
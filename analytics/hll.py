@@ -0,0 +1,91 @@
+"""
+HyperLogLog sketches, which estimate the number of distinct values added to
+them in a fixed amount of memory.
+
+A sketch has 2 ** precision one-byte registers. Each value is hashed to 64
+bits: the first precision bits choose a register, and the register keeps the
+largest position of the first 1 bit seen in the rest of the hash. Two sketches
+of the same precision are merged by taking the maximum of each register, so
+the distinct users of a day can be estimated by merging the sketches of its
+hours. The standard error of the estimate is about 1.04 / sqrt(2 ** precision).
+"""
+
+import hashlib
+import math
+import struct
+import zlib
+
+# 2048 registers, for a standard error of about 2.3%
+DEFAULT_PRECISION = 11
+
+HASH_BITS = 64
+
+# Powers of two used by the estimate
+INVERSE_POWERS = [2.0 ** -i for i in range(HASH_BITS + 1)]
+
+class HyperLogLog(object):
+    """A HyperLogLog sketch.
+
+    registers: a bytearray containing the 2 ** precision registers.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            registers = bytearray(self.size)
+        elif len(registers) != self.size:
+            raise ValueError("Expected {} registers, got {}".format(self.size, len(registers)))
+        self.registers = registers
+
+    def add(self, value):
+        """Adds the given string to the sketch."""
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        hashed = struct.unpack(">Q", hashlib.sha1(value).digest()[:8])[0]
+        index = hashed >> (HASH_BITS - self.precision)
+        rest = hashed & ((1 << (HASH_BITS - self.precision)) - 1)
+        rank = HASH_BITS - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Updates this sketch to count every value added to the other sketch,
+        which must have the same precision."""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with precisions {} and {}".format(self.precision, other.precision))
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    @staticmethod
+    def union(sketches, precision=DEFAULT_PRECISION):
+        """Returns a new sketch that counts every value added to any of the
+        given sketches, which must have the given precision. This is much
+        faster than merging the sketches one at a time."""
+        registers = [sketch.registers for sketch in sketches]
+        if any(sketch.precision != precision for sketch in sketches):
+            raise ValueError("Cannot merge sketches with different precisions")
+        if len(registers) == 0:
+            return HyperLogLog(precision)
+        elif len(registers) == 1:
+            return HyperLogLog(precision, bytearray(registers[0]))
+        return HyperLogLog(precision, bytearray(map(max, *registers)))
+
+    def count(self):
+        """Returns the estimated number of distinct values in the sketch."""
+        alpha = 0.7213 / (1.0 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(INVERSE_POWERS[r] for r in self.registers)
+        zeros = self.registers.count(b"\0")
+        if estimate <= 2.5 * self.size and zeros > 0:
+            # Linear counting is more accurate for small cardinalities
+            estimate = self.size * math.log(float(self.size) / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        """Returns a compact binary representation of the sketch. Sketches of
+        few values compress well, since most of their registers are zero."""
+        return zlib.compress(bytes(self.registers))
+
+    @staticmethod
+    def from_bytes(data, precision=DEFAULT_PRECISION):
+        """Returns the sketch with the given binary representation."""
+        return HyperLogLog(precision, bytearray(zlib.decompress(bytes(data))))
@@ -0,0 +1,38 @@
+"""
+Recomputes the hourly and daily request rollups from the RequestCount table.
+
+Run this once after deploying the rollups, so that the analytics views include
+the requests logged before the rollups existed:
+
+    python manage.py rebuild_rollups
+
+Each day is rebuilt in its own transaction, so the command can run while the
+server is logging requests.
+"""
+
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from analytics.rollups import rebuild_rollups
+
+class Command(BaseCommand):
+    help = "Recomputes the request rollups from the logged requests, one day at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None,
+                            help="only rebuild the last DAYS days (default: every day with logged requests)")
+
+    def handle(self, *args, **options):
+        early_time = None
+        if options["days"] is not None:
+            if options["days"] <= 0:
+                raise CommandError("--days must be positive")
+            early_time = timezone.now() - datetime.timedelta(days=options["days"] - 1)
+
+        total = 0
+        for day, count in rebuild_rollups(early_time):
+            self.stdout.write("{}: {} requests".format(day.strftime("%Y-%m-%d"), count))
+            total += count
+        self.stdout.write("Rebuilt rollups from {} requests".format(total))
@@ -1,11 +1,20 @@
 from django.db import models
 from django.utils import timezone
+from collections import namedtuple
+import math
+from .hll import HyperLogLog
+
+# The fields of each request passed to the attribute_func of
+# RequestCount.tabulate_requests
+REQUEST_ROW_FIELDS = ("timestamp", "path", "user_agent", "is_authenticated", "student_unique_id", "student_semester")
+
+RequestRow = namedtuple("RequestRow", REQUEST_ROW_FIELDS)
 
 class RequestCount(models.Model):
     """Keeps track of a single request."""
 
     path = models.CharField(max_length=50, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
     user_agent = models.CharField(max_length=150, null=True)
     is_authenticated = models.BooleanField(default=False)
     student_unique_id = models.CharField(max_length=50, null=True)
@@ -24,15 +33,23 @@ class RequestCount(models.Model):
         """Retrieves request counts from the given time to present,
         bucketed by the given interval.
 
+        The analytics views read the rollups instead (see
+        analytics.rollups.tabulate_rollups), so this is only used for ad-hoc
+        queries over the raw requests, such as attributes that are not
+        rolled up.
+
         Args:
             early_time: A timezone.datetime object indicating the minimum time
                 to retrieve requests for.
             interval: A timezone.timedelta object indicating the period of time
                 spanned by each returned bucket. If None, counts all requests
                 together and returns a single dictionary.
-            attribute_func: A function taking a RequestCount and returning a
+            attribute_func: A function taking a RequestRow (a named tuple with
+                the REQUEST_ROW_FIELDS of a RequestCount) and returning a
                 value to tabulate for each bucket.
-            distinct_users: If True, count only one request per unique user.
+            distinct_users: If True, estimate the number of distinct users
+                with each value in each bucket, instead of the number of
+                requests. Requests without a student are not counted.
 
         Returns:
             A list of tuples (time, dict), where time is a timezone.datetime
@@ -41,26 +58,63 @@ class RequestCount(models.Model):
             counts in the bucket.
         """
         now = timezone.now()
-        buckets = []
         if interval:
-            curr = early_time
-            while curr < now:
-                buckets.append((curr, {}))
-                curr += interval
+            interval_seconds = interval.total_seconds()
+            num_buckets = max(int(math.ceil((now - early_time).total_seconds() / interval_seconds)), 0)
         else:
-            buckets.append((early_time, {}))
-
-        seen_users = set()
-        for request in RequestCount.objects.filter(timestamp__gte=early_time).iterator():
-            if distinct_users and (not request.student_unique_id or request.student_unique_id in seen_users):
-                continue
-            seen_users.add(request.student_unique_id)
-            for time, bucket in buckets:
-                if request.timestamp >= time and (not interval or request.timestamp < time + interval):
-                    value = attribute_func(request) if attribute_func else None
-                    bucket[value] = bucket.get(value, 0) + 1
-                    break
+            num_buckets = 1
+        buckets = [{} for _ in range(num_buckets)]
+
+        requests = RequestCount.objects.filter(timestamp__gte=early_time)
+        if distinct_users:
+            requests = requests.filter(student_unique_id__gt="")
+        # Only the timestamp and student are needed without an attribute_func
+        fields = REQUEST_ROW_FIELDS if attribute_func else REQUEST_ROW_FIELDS[:1] + ("student_unique_id",)
+        user_index = fields.index("student_unique_id")
+        for row in requests.values_list(*fields).iterator():
+            if interval:
+                index = int((row[0] - early_time).total_seconds() // interval_seconds)
+                if index >= num_buckets:
+                    continue
+            else:
+                index = 0
+            value = attribute_func(RequestRow._make(row)) if attribute_func else None
+            bucket = buckets[index]
+            if distinct_users:
+                sketch = bucket.get(value)
+                if sketch is None:
+                    sketch = bucket[value] = HyperLogLog()
+                sketch.add(row[user_index])
+            else:
+                bucket[value] = bucket.get(value, 0) + 1
+
+        if distinct_users:
+            for bucket in buckets:
+                for value, sketch in bucket.items():
+                    bucket[value] = sketch.count()
 
         if not interval:
-            return buckets[0][1]
-        return buckets
+            return buckets[0]
+        return [(early_time + interval * i, bucket) for i, bucket in enumerate(buckets)]
+
+class RequestRollup(models.Model):
+    """Keeps track of the requests in one hour or one day that have the same
+    value for one dimension (such as the request path or user agent type).
+    See analytics.rollups for the available dimensions."""
+
+    HOUR = "hour"
+    DAY = "day"
+
+    period = models.CharField(max_length=4)
+    start = models.DateTimeField()
+    dimension = models.CharField(max_length=20)
+    value = models.CharField(max_length=50, default="")
+    count = models.IntegerField(default=0)
+    # A compressed HyperLogLog sketch of the students who made the requests
+    users = models.BinaryField(null=True)
+
+    class Meta:
+        unique_together = ("period", "dimension", "start", "value")
+
+    def __str__(self):
+        return "{} {}={} at {}: {}".format(self.period, self.dimension, self.value, self.start, self.count)
@@ -5,9 +5,32 @@ NOTE: The data that is collected contains potential user-identifying
 information (namely, the user's unique ID and current semester). This info will
 not leave the FireRoad server unless it is aggregated such that users are no
 longer identifiable.
+
+To keep analytics off the response path, the middleware only records a few
+fields of each request in an in-process queue. A background thread writes the
+queued requests to the database in batches, when a batch is full or when its
+oldest request has waited FLUSH_INTERVAL seconds, and updates the hourly and
+daily rollups (see analytics.rollups) with them. If the queue fills up
+because the database cannot keep up, new requests are dropped (and counted)
+rather than slowing down the server. When the process exits, the thread is
+stopped after it writes every queued request.
 """
 
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from Queue import Queue, Empty, Full
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from common.models import Student
 from .models import *
+from .rollups import update_rollups
 
 EXCLUDE_PATH_PREFIXES = [
     "/favicon.ico",
@@ -24,6 +47,169 @@ EXCLUDE_USER_AGENTS = [
     "spider"
 ]
 
+# Maximum number of requests waiting to be written
+MAX_QUEUE_SIZE = 10000
+
+# Maximum number of requests written in a single query
+BATCH_SIZE = 500
+
+# Maximum number of seconds a request waits before its batch is written
+FLUSH_INTERVAL = 5.0
+
+# Maximum number of seconds to wait for the background thread to finish
+# writing when the process exits
+CLOSE_TIMEOUT = 10.0
+
+# Placed in the queue to stop the background thread
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+# A request waiting to be written. user_id is the primary key of the logged-in
+# user, or None.
+RequestRecord = namedtuple("RequestRecord", ["timestamp", "path", "user_agent", "is_authenticated", "user_id"])
+
+class RequestLog(object):
+    """A bounded queue of RequestRecords that are written to the database as
+    RequestCount objects in batches.
+
+    If settings.ANALYTICS_BACKGROUND_WRITER is True, a background thread is
+    started to write the records when the first one is added. Otherwise, the
+    records are only written by calls to flush(). close() is called when the
+    process exits.
+
+    written, dropped, failed: the number of records that have been written,
+        discarded because the queue was full, and discarded because they
+        could not be written, respectively.
+    """
+
+    def __init__(self, max_size=MAX_QUEUE_SIZE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.queue = Queue(max_size)
+        self._thread = None
+        self._pid = None
+        self._thread_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def push(self, record):
+        """Adds the given RequestRecord to the queue without blocking, or
+        drops it if the queue is full."""
+        if getattr(settings, "ANALYTICS_BACKGROUND_WRITER", True):
+            self._start_thread()
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Writes every record in the queue on the calling thread."""
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.batch_size:
+                    record = self.queue.get_nowait()
+                    if record is not _STOP:
+                        batch.append(record)
+            except Empty:
+                pass
+            if len(batch) == 0:
+                return
+            self._write(batch)
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """Stops the background thread once it has written the records that
+        are in the queue (including the batch it is waiting to fill), then
+        writes any records that remain on the calling thread."""
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            try:
+                self.queue.put(_STOP, timeout=timeout)
+                thread.join(timeout)
+            except Full:
+                pass
+        self.flush()
+
+    def _start_thread(self):
+        # Worker processes forked from the server process do not inherit its
+        # threads, so each process starts its own writer
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # The records in the parent's queue belong to the parent
+                self.queue = Queue(self.max_size)
+            else:
+                atexit.register(self.close)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="RequestLogWriter")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch, stop = self._next_batch()
+            if len(batch) > 0:
+                close_old_connections()
+                self._write(batch)
+            if stop:
+                return
+
+    def _next_batch(self):
+        """Waits for a record, then returns a tuple (records, stop) once the
+        batch is full, flush_interval seconds have passed, or close() has
+        asked the thread to stop, in which case stop is True."""
+        batch = []
+        record = self.queue.get()
+        deadline = time.time() + self.flush_interval
+        while record is not _STOP:
+            batch.append(record)
+            remaining = deadline - time.time()
+            if len(batch) >= self.batch_size or remaining <= 0:
+                return batch, False
+            try:
+                record = self.queue.get(timeout=remaining)
+            except Empty:
+                return batch, False
+        return batch, True
+
+    def _write(self, batch):
+        """Saves RequestCount objects for the given list of records, looking
+        up the students of every logged-in user in one query, and adds them
+        to the rollups."""
+        with self._write_lock:
+            try:
+                user_ids = set(record.user_id for record in batch if record.user_id is not None)
+                students = {}
+                if len(user_ids) > 0:
+                    for user_id, unique_id, semester in Student.objects.filter(user_id__in=user_ids).values_list("user_id", "unique_id", "current_semester"):
+                        students[user_id] = (unique_id, semester)
+
+                tallies = []
+                for record in batch:
+                    unique_id, semester = students.get(record.user_id, (None, None))
+                    tallies.append(RequestCount(timestamp=record.timestamp,
+                                                path=record.path,
+                                                user_agent=record.user_agent,
+                                                is_authenticated=record.is_authenticated,
+                                                student_unique_id=unique_id,
+                                                student_semester=semester))
+                with transaction.atomic():
+                    RequestCount.objects.bulk_create(tallies)
+                    update_rollups(tallies)
+                self.written += len(batch)
+            except Exception:
+                logger.exception("Could not write {} request counts".format(len(batch)))
+                self.failed += len(batch)
+
+request_log = RequestLog()
+
 class RequestCounterMiddleware(object):
     """A middleware that saves a RequestCount object each time a page is requested."""
 
@@ -37,19 +223,10 @@ class RequestCounterMiddleware(object):
         if any(element in user_agent.lower() for element in EXCLUDE_USER_AGENTS):
             return response
 
-        tally = RequestCount.objects.create()
-        tally.path = request.path
-        if len(user_agent) > 150:
-            user_agent = user_agent[:150]
-        tally.user_agent = user_agent
+        is_authenticated = False
+        user_id = None
         if hasattr(request, "user") and request.user and request.user.is_authenticated():
-            tally.is_authenticated = True
-            try:
-                student = request.user.student
-            except:
-                pass
-            else:
-                tally.student_unique_id = student.unique_id
-                tally.student_semester = student.current_semester
-        tally.save()
+            is_authenticated = True
+            user_id = request.user.pk
+        request_log.push(RequestRecord(timezone.now(), request.path[:50], user_agent[:150], is_authenticated, user_id))
         return response
@@ -0,0 +1,233 @@
+"""
+Hourly and daily rollups of the RequestCount table.
+
+Each RequestRollup aggregates the requests in one hour or one day (in UTC)
+that have the same value for one of the DIMENSIONS: it stores the number of
+requests and a HyperLogLog sketch of the distinct students who made them. The
+request log updates the rollups in the same transaction as it writes each
+batch of RequestCounts, so the analytics views only need to read a few rows
+per bucket instead of every request.
+"""
+
+import datetime
+import math
+import operator
+
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import RequestCount, RequestRollup
+from .hll import HyperLogLog
+
+USER_AGENT_TYPES = [
+    "Desktop",
+    "iOS",
+    "Android",
+    "Mobile Safari",
+    "Android Browser"
+]
+
+def translate_user_agent_string(user_agent):
+    """Returns the most likely user agent type for the given user agent string."""
+    if not user_agent:
+        return None
+    if "CFNetwork" in user_agent:
+        return "iOS"
+    elif "okhttp" in user_agent:
+        return "Android"
+    elif "Android" in user_agent:
+        return "Android Browser"
+    elif "Mobile" in user_agent and "Safari" in user_agent:
+        return "Mobile Safari"
+    else:
+        return "Desktop"
+
+# Functions returning the value of each dimension for a RequestCount
+DIMENSIONS = {
+    "total": lambda tally: "",
+    "authenticated": lambda tally: "1" if tally.is_authenticated else "0",
+    "user_agent": lambda tally: translate_user_agent_string(tally.user_agent) or "",
+    "semester": lambda tally: tally.student_semester or "",
+    "path": lambda tally: tally.path or ""
+}
+
+PERIOD_LENGTHS = {
+    RequestRollup.HOUR: datetime.timedelta(hours=1),
+    RequestRollup.DAY: datetime.timedelta(days=1)
+}
+
+# Number of RequestCounts to add to the rollups at a time when rebuilding
+REBUILD_BATCH_SIZE = 5000
+
+def period_start(time, period):
+    """Returns the start of the hour or day (in UTC) containing the given
+    time."""
+    time = time.astimezone(timezone.utc)
+    if period == RequestRollup.DAY:
+        return time.replace(hour=0, minute=0, second=0, microsecond=0)
+    return time.replace(minute=0, second=0, microsecond=0)
+
+def update_rollups(tallies):
+    """Adds the given list of newly saved RequestCounts to the rollups."""
+    deltas = {}
+    for tally in tallies:
+        for period in PERIOD_LENGTHS:
+            start = period_start(tally.timestamp, period)
+            for dimension, value_func in DIMENSIONS.items():
+                key = (period, dimension, start, value_func(tally)[:50])
+                delta = deltas.get(key)
+                if delta is None:
+                    delta = deltas[key] = [0, None]
+                delta[0] += 1
+                if tally.student_unique_id:
+                    if delta[1] is None:
+                        delta[1] = HyperLogLog()
+                    delta[1].add(tally.student_unique_id)
+    if len(deltas) == 0:
+        return
+
+    # If another process creates one of the same rollups first, the second
+    # attempt will find and update it
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                _apply_deltas(deltas)
+            return
+        except IntegrityError:
+            if attempt > 0:
+                raise
+
+def _apply_deltas(deltas):
+    """Adds the counts and sketches in the given dictionary of rollup keys to
+    [count, HyperLogLog or None] to the corresponding rollups. Only the
+    rollups with those keys are locked."""
+    values = {}
+    for period, dimension, start, value in deltas:
+        values.setdefault((period, dimension, start), []).append(value)
+    query = reduce(operator.or_, (Q(period=period, dimension=dimension, start=start, value__in=dimension_values)
+                                  for (period, dimension, start), dimension_values in values.items()))
+    rollups = {(rollup.period, rollup.dimension, rollup.start, rollup.value): rollup
+               for rollup in RequestRollup.objects.select_for_update().filter(query)}
+
+    new_rollups = []
+    for key, (count, users) in deltas.items():
+        rollup = rollups.get(key)
+        if rollup is None:
+            period, dimension, start, value = key
+            new_rollups.append(RequestRollup(period=period, dimension=dimension, start=start, value=value,
+                                             count=count, users=users.to_bytes() if users else None))
+            continue
+        rollup.count += count
+        if users is not None:
+            if rollup.users is not None:
+                users.merge(HyperLogLog.from_bytes(rollup.users))
+            rollup.users = users.to_bytes()
+        rollup.save(update_fields=["count", "users"])
+    RequestRollup.objects.bulk_create(new_rollups)
+
+def rebuild_rollups(early_time=None, late_time=None):
+    """Recomputes the rollups from the RequestCounts in each day from the
+    one containing early_time through the one containing late_time (or from
+    the first RequestCount through the present if they are None), for example
+    to include requests that were logged before the rollups existed.
+
+    Each day is rebuilt in its own transaction, so the request log is never
+    blocked for long. Requests that are written while their day is being
+    rebuilt may not be counted.
+
+    Returns a list of tuples (day, number of requests) for the rebuilt days."""
+    if early_time is None:
+        early_time = RequestCount.objects.order_by("timestamp").values_list("timestamp", flat=True).first()
+        if early_time is None:
+            RequestRollup.objects.all().delete()
+            return []
+        # Rollups before the first request have no requests left to count
+        RequestRollup.objects.filter(start__lt=period_start(early_time, RequestRollup.DAY)).delete()
+    if late_time is None:
+        late_time = timezone.now()
+
+    results = []
+    day = period_start(early_time, RequestRollup.DAY)
+    while day <= late_time:
+        results.append((day, rebuild_day(day)))
+        day += PERIOD_LENGTHS[RequestRollup.DAY]
+    return results
+
+def rebuild_day(day):
+    """Recomputes the hourly and daily rollups for the day (in UTC) starting
+    at the given time in one transaction, and returns the number of requests
+    in the day."""
+    next_day = day + PERIOD_LENGTHS[RequestRollup.DAY]
+    tallies = RequestCount.objects.filter(timestamp__gte=day, timestamp__lt=next_day)
+    count = 0
+    with transaction.atomic():
+        RequestRollup.objects.filter(start__gte=day, start__lt=next_day).delete()
+        batch = []
+        for tally in tallies.iterator():
+            batch.append(tally)
+            if len(batch) == REBUILD_BATCH_SIZE:
+                update_rollups(batch)
+                count += len(batch)
+                batch = []
+        update_rollups(batch)
+        count += len(batch)
+    return count
+
+def tabulate_rollups(early_time, interval=None, dimension="total", distinct_users=False):
+    """Retrieves request counts from the given time to present from the
+    rollups, in the same format as RequestCount.tabulate_requests.
+
+    Args:
+        early_time: A timezone.datetime object indicating the minimum time
+            to retrieve requests for. Daily rollups are used if early_time
+            and interval are whole days, and hourly rollups otherwise, so
+            early_time should be at the start of an hour.
+        interval: A timezone.timedelta object indicating the period of time
+            spanned by each returned bucket. If None, counts all requests
+            together and returns a single dictionary.
+        dimension: The key in DIMENSIONS of the values to tabulate for each
+            bucket.
+        distinct_users: If True, estimate the number of distinct students who
+            made the requests with each value in each bucket.
+
+    Returns:
+        A list of tuples (time, dict), where time is a timezone.datetime
+        object indicating the start time of the bucket, and dict is a
+        dictionary mapping values of the dimension to their counts in the
+        bucket.
+    """
+    now = timezone.now()
+    day_seconds = PERIOD_LENGTHS[RequestRollup.DAY].total_seconds()
+    if (period_start(early_time, RequestRollup.DAY) == early_time and
+        (not interval or interval.total_seconds() % day_seconds == 0)):
+        period = RequestRollup.DAY
+    else:
+        period = RequestRollup.HOUR
+
+    if interval:
+        interval_seconds = interval.total_seconds()
+        num_buckets = max(int(math.ceil((now - early_time).total_seconds() / interval_seconds)), 0)
+    else:
+        num_buckets = 1
+    buckets = [{} for _ in range(num_buckets)]
+
+    rollups = RequestRollup.objects.filter(period=period, dimension=dimension, start__gte=early_time, start__lt=now)
+    for start, value, count, users in rollups.values_list("start", "value", "count", "users").iterator():
+        index = int((start - early_time).total_seconds() // interval_seconds) if interval else 0
+        if index >= num_buckets:
+            continue
+        bucket = buckets[index]
+        if not distinct_users:
+            bucket[value] = bucket.get(value, 0) + count
+        elif users is not None:
+            bucket.setdefault(value, []).append(HyperLogLog.from_bytes(users))
+
+    if distinct_users:
+        for bucket in buckets:
+            for value, sketches in bucket.items():
+                bucket[value] = HyperLogLog.union(sketches).count()
+
+    if not interval:
+        return buckets[0]
+    return [(early_time + interval * i, bucket) for i, bucket in enumerate(buckets)]
@@ -0,0 +1,145 @@
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+from django.http import HttpResponse
+from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.utils import timezone
+from common.models import Student
+from .models import RequestCount, RequestRollup
+from .request_counter import RequestCounterMiddleware, RequestLog, RequestRecord, request_log
+from .rollups import tabulate_rollups, translate_user_agent_string
+from .hll import HyperLogLog
+from StringIO import StringIO
+import datetime
+import json
+import threading
+
+
+@override_settings(ANALYTICS_BACKGROUND_WRITER=False)
+class RequestCounterTest(TestCase):
+    """Tests the batched writing of request counts."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        request_log.flush()
+        RequestCount.objects.all().delete()
+
+    def test_middleware(self):
+        user = User.objects.create_user(username="testuser", password="password")
+        Student.objects.create(user=user, academic_id="test@mit.edu", current_semester="3", unique_id="abc")
+        middleware = RequestCounterMiddleware()
+        for path, request_user in [("/courses/all", user), ("/courses/dept/6", AnonymousUser()), ("/admin/", user)]:
+            request = self.factory.get(path, HTTP_USER_AGENT="FireRoad")
+            request.user = request_user
+            middleware.process_response(request, HttpResponse())
+
+        # Nothing is written until the queue is flushed
+        self.assertEqual(RequestCount.objects.count(), 0)
+        request_log.flush()
+        tallies = RequestCount.objects.order_by("timestamp")
+        self.assertEqual([tally.path for tally in tallies], ["/courses/all", "/courses/dept/6"])
+        self.assertEqual(tallies[0].student_unique_id, "abc")
+        self.assertEqual(tallies[0].student_semester, "3")
+        self.assertFalse(tallies[1].is_authenticated)
+
+    def test_batches(self):
+        log = RequestLog(max_size=5, batch_size=2)
+        timestamp = timezone.now() - datetime.timedelta(days=1)
+        for i in range(7):
+            log.push(RequestRecord(timestamp, "/path/{}".format(i), "FireRoad", False, None))
+        self.assertEqual(log.dropped, 2)
+        log.flush()
+        self.assertEqual(log.written, 5)
+        self.assertEqual(RequestCount.objects.filter(timestamp=timestamp).count(), 5)
+
+
+class RecordingRequestLog(RequestLog):
+    """A RequestLog that keeps the batches it would write."""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingRequestLog, self).__init__(*args, **kwargs)
+        self.batches = []
+
+    def _write(self, batch):
+        self.batches.append((threading.current_thread().name, [record.path for record in batch]))
+
+
+class RequestLogThreadTest(TestCase):
+    """Tests the background thread that writes request counts."""
+
+    @override_settings(ANALYTICS_BACKGROUND_WRITER=True)
+    def test_close_writes_pending_batch(self):
+        log = RecordingRequestLog(batch_size=10, flush_interval=60)
+        for i in range(3):
+            log.push(RequestRecord(timezone.now(), "/path/{}".format(i), "FireRoad", False, None))
+        # The thread is waiting to fill its batch, so it writes the records
+        # when it is stopped
+        log.close()
+        self.assertFalse(log._thread.is_alive())
+        self.assertEqual(log.batches, [("RequestLogWriter", ["/path/0", "/path/1", "/path/2"])])
+
+
+@override_settings(ANALYTICS_BACKGROUND_WRITER=False)
+class RequestRollupTest(TestCase):
+    """Tests the distinct user sketches and the request rollups."""
+
+    def setUp(self):
+        request_log.flush()
+        RequestCount.objects.all().delete()
+        RequestRollup.objects.all().delete()
+
+    def test_hyperloglog(self):
+        sketches = []
+        for i in range(4):
+            sketch = HyperLogLog()
+            for j in range(i * 2000, (i + 2) * 2000):
+                sketch.add("user{}".format(j))
+            sketches.append(HyperLogLog.from_bytes(sketch.to_bytes()))
+        self.assertAlmostEqual(sketches[0].count(), 4000, delta=200)
+        self.assertAlmostEqual(HyperLogLog.union(sketches).count(), 10000, delta=500)
+        sketches[0].merge(sketches[1])
+        self.assertAlmostEqual(sketches[0].count(), 6000, delta=300)
+
+    def test_rollups(self):
+        users = []
+        for i in range(3):
+            user = User.objects.create_user(username="user{}".format(i), password="password")
+            Student.objects.create(user=user, academic_id="user{}@mit.edu".format(i), current_semester=str(i + 1), unique_id="id{}".format(i))
+            users.append(user)
+
+        now = timezone.now()
+        early_time = (now - datetime.timedelta(days=3)).replace(hour=0, minute=0, second=0, microsecond=0)
+        log = RequestLog(batch_size=7)
+        for i in range(60):
+            user = users[i % 4] if i % 4 < 3 else None
+            timestamp = now - datetime.timedelta(hours=i)
+            log.push(RequestRecord(timestamp, "/path/{}".format(i % 2), "okhttp" if i % 3 == 0 else "CFNetwork",
+                                   user is not None, user.pk if user else None))
+        log.flush()
+
+        for start, interval in [(early_time, datetime.timedelta(days=1)), (now.replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=30), datetime.timedelta(hours=6))]:
+            expected = RequestCount.tabulate_requests(start, interval, lambda tally: tally.path)
+            self.assertEqual(tabulate_rollups(start, interval, "path"), expected)
+        self.assertEqual(tabulate_rollups(early_time, None, "semester", distinct_users=True), {"1": 1, "2": 1, "3": 1})
+        self.assertEqual(tabulate_rollups(early_time, None)[""], RequestCount.objects.filter(timestamp__gte=early_time).count())
+
+        # The raw requests and the rollups have identical sketches
+        before = tabulate_rollups(early_time, datetime.timedelta(days=1), "user_agent", distinct_users=True)
+        self.assertEqual(RequestCount.tabulate_requests(early_time, datetime.timedelta(days=1), lambda tally: translate_user_agent_string(tally.user_agent), distinct_users=True), before)
+
+        # Rebuilding the rollups from the raw requests gives the same result
+        RequestRollup.objects.filter(period=RequestRollup.HOUR).delete()
+        output = StringIO()
+        call_command("rebuild_rollups", stdout=output)
+        self.assertIn("Rebuilt rollups from 60 requests", output.getvalue())
+        self.assertEqual(tabulate_rollups(early_time, datetime.timedelta(days=1), "user_agent", distinct_users=True), before)
+        for start, interval in [(early_time, datetime.timedelta(days=1)), (now.replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=30), datetime.timedelta(hours=6))]:
+            self.assertEqual(tabulate_rollups(start, interval, "path"), RequestCount.tabulate_requests(start, interval, lambda tally: tally.path))
+        call_command("rebuild_rollups", days=1, stdout=output)
+        self.assertEqual(tabulate_rollups(early_time, datetime.timedelta(days=1), "user_agent", distinct_users=True), before)
+
+        User.objects.create_user(username="staff", password="password", is_staff=True)
+        self.client.login(username="staff", password="password")
+        data = json.loads(self.client.get("/analytics/user_semesters/week").content)
+        self.assertEqual(data["data"][1:4], [1, 1, 1])
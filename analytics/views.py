@@ -2,6 +2,7 @@ from django.shortcuts import render
 from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound
 from django.core.exceptions import ObjectDoesNotExist
 from .models import RequestCount
+from .rollups import tabulate_rollups, translate_user_agent_string, USER_AGENT_TYPES
 from sync.models import Road, Schedule
 from django.utils import timezone
 from django.contrib.admin.views.decorators import staff_member_required
@@ -40,8 +41,10 @@ def get_time_bounds(time_frame):
         format = "%b %d, %Y"
     elif time_frame == "all-time":
         try:
-            early_time = RequestCount.objects.order_by("timestamp").first().timestamp
-            early_time = early_time.replace(minute=0)
+            first_request = RequestCount.objects.order_by("timestamp").first()
+            if first_request is None:
+                raise ObjectDoesNotExist
+            early_time = first_request.timestamp.replace(minute=0)
             # Try multiple intervals to see what's best
             last_result = None
             test_intervals = [
@@ -57,6 +60,9 @@ def get_time_bounds(time_frame):
                     break
             early_time, delta, format = last_result
             format = "%b %d, %Y"
+            if delta >= timezone.timedelta(days=1):
+                # Start at midnight so that the daily rollups can be used
+                early_time = early_time.replace(hour=0)
         except ObjectDoesNotExist:
             early_time = timezone.now() - timezone.timedelta(hours=24)
             early_time = early_time.replace(hour=0, minute=0)
@@ -67,6 +73,8 @@ def get_time_bounds(time_frame):
         early_time = early_time.replace(minute=0)
         delta = timezone.timedelta(hours=1)
         format = "%I %p"
+    # Buckets start on the hour to line up with the request rollups
+    early_time = early_time.replace(second=0, microsecond=0)
     return early_time, delta, format
 
 def format_date(date, format):
@@ -82,40 +90,17 @@ def total_requests(request, time_frame=None):
     requests over time."""
     timezone.activate(DISPLAY_TIME_ZONE)
     early_time, delta, format = get_time_bounds(time_frame)
-    data = RequestCount.tabulate_requests(early_time, delta, lambda _: 1)
-    labels, counts = itertools.izip(*((format_date(t, format), item.get(1, 0)) for t, item in data))
+    data = tabulate_rollups(early_time, delta)
+    labels, counts = itertools.izip(*((format_date(t, format), item.get("", 0)) for t, item in data))
     return HttpResponse(json.dumps({"labels": labels, "data": counts, "total": "{:,}".format(sum(counts))}), content_type="application/json")
 
-USER_AGENT_TYPES = [
-    "Desktop",
-    "iOS",
-    "Android",
-    "Mobile Safari",
-    "Android Browser"
-]
-
-def translate_user_agent_string(user_agent):
-    """Returns the most likely user agent type for the given user agent string."""
-    if not user_agent:
-        return None
-    if "CFNetwork" in user_agent:
-        return "iOS"
-    elif "okhttp" in user_agent:
-        return "Android"
-    elif "Android" in user_agent:
-        return "Android Browser"
-    elif "Mobile" in user_agent and "Safari" in user_agent:
-        return "Mobile Safari"
-    else:
-        return "Desktop"
-
 @staff_member_required
 def user_agents(request, time_frame=None):
     """Returns data for the Chart.js chart containing the various user agents
     observed over time."""
     timezone.activate(DISPLAY_TIME_ZONE)
     early_time, delta, format = get_time_bounds(time_frame)
-    data = RequestCount.tabulate_requests(early_time, delta, lambda request: translate_user_agent_string(request.user_agent), distinct_users=True)
+    data = tabulate_rollups(early_time, delta, "user_agent", distinct_users=True)
     labels = [format_date(t, format) for t, _ in data]
     datasets = {agent: [item.get(agent, 0) for _, item in data] for agent in USER_AGENT_TYPES}
     return HttpResponse(json.dumps({"labels": labels, "data": datasets}), content_type="application/json")
@@ -125,10 +110,10 @@ def logged_in_users(request, time_frame=None):
     """Returns data for the Chart.js chart representing logged-in users over time."""
     timezone.activate(DISPLAY_TIME_ZONE)
     early_time, delta, format = get_time_bounds(time_frame)
-    data = RequestCount.tabulate_requests(early_time, delta, lambda _: 1, distinct_users=True)
-    total_data = RequestCount.tabulate_requests(early_time, None, lambda _: 1, distinct_users=True)
-    labels, counts = itertools.izip(*((format_date(t, format), item.get(1, 0)) for t, item in data))
-    return HttpResponse(json.dumps({"labels": labels, "data": counts, "total": "{:,}".format(total_data.get(1, 0))}), content_type="application/json")
+    data = tabulate_rollups(early_time, delta, distinct_users=True)
+    total_data = tabulate_rollups(early_time, None, distinct_users=True)
+    labels, counts = itertools.izip(*((format_date(t, format), item.get("", 0)) for t, item in data))
+    return HttpResponse(json.dumps({"labels": labels, "data": counts, "total": "{:,}".format(total_data.get("", 0))}), content_type="application/json")
 
 SEMESTERS = [
     "None",
@@ -149,14 +134,11 @@ SEMESTERS = [
     "5th Year Spring",
 ]
 
-def get_semester_number(request):
-    """Returns a tuple with the user's ID and the semester number for the given
-    request, or None if no semester is logged."""
-    if not request.is_authenticated:
-        return None
-
+def get_semester_number(semester):
+    """Returns the semester number for the given semester value of a request,
+    or None if no semester is logged."""
     try:
-        return int(request.student_semester)
+        return int(semester)
     except:
         return None
 
@@ -166,11 +148,12 @@ def user_semesters(request, time_frame=None):
     logged-in users fall."""
     timezone.activate(DISPLAY_TIME_ZONE)
     early_time, _, format = get_time_bounds(time_frame)
-    data = RequestCount.tabulate_requests(early_time, None, get_semester_number, distinct_users=True)
+    data = tabulate_rollups(early_time, None, "semester", distinct_users=True)
     labels = SEMESTERS
 
     semester_buckets = [0 for _ in SEMESTERS]
-    for semester, count in data.items():
+    for value, count in data.items():
+        semester = get_semester_number(value)
         if not semester or semester < 0 or semester >= len(semester_buckets):
             continue
         semester_buckets[semester] += count
@@ -181,8 +164,8 @@ def request_paths(request, time_frame=None):
     """Returns data for the Chart.js chart showing counts for various request paths."""
     timezone.activate(DISPLAY_TIME_ZONE)
     early_time, _, format = get_time_bounds(time_frame)
-    data = RequestCount.tabulate_requests(early_time, None, lambda request: request.path)
-    labels = set(data.keys()) - set([None])
+    data = tabulate_rollups(early_time, None, "path")
+    labels = set(data.keys()) - set([""])
     counts = {label: data.get(label, 0) for label in labels}
     labels, counts = itertools.izip(*sorted(counts.items(), key=lambda x: x[1], reverse=True))
     if len(labels) > 15:
@@ -0,0 +1,119 @@
+"""
+Bitmap index of course attributes over a catalog snapshot.
+
+Each course in the snapshot is identified by its ordinal, its position in the
+snapshot's sorted list of subject IDs. For every filterable attribute value
+(each GIR, each HASS category, CI-H and CI-HW, each term offered, and each
+level) the index stores a bitmap with the bit for each matching course's
+ordinal set, so that any combination of filters is a few bitwise ANDs.
+Bitmaps are Python integers.
+
+The index also holds the weekly time bitmask of each lecture option of every
+course (see catalog.schedule), computed once from the snapshot's decoded
+schedules, to filter out courses that conflict with a student's schedule.
+"""
+
+from catalog_parse.utils.catalog_constants import CatalogConstants
+from .schedule import lecture_masks
+
+# The lowercase GIR codes that can be filtered on, e.g. "phy1"
+GIR_VALUES = sorted(code.lower() for code in CatalogConstants.gir_requirements.values())
+
+# The lowercase HASS categories that can be filtered on
+HASS_VALUES = ["a", "s", "h", "e"]
+
+class AttributeIndex(object):
+    """Bitmaps over the courses in a CatalogSnapshot.
+
+    size: the number of courses (and bits) in the index.
+    all_bits: a bitmap with every course's bit set.
+    bitmaps: dictionary of (attribute name, value) tuples to bitmaps.
+    lecture_masks: dictionary of subject IDs to a tuple of the time bitmasks
+        of each scheduled lecture option of the course. Courses without
+        scheduled lectures are omitted.
+    """
+
+    def __init__(self, snapshot):
+        self.size = len(snapshot.subject_ids)
+        self.all_bits = (1 << self.size) - 1
+
+        bitmaps = {}
+        self.lecture_masks = {}
+        self._scheduled = []
+        def add(key, ordinal):
+            bitmaps[key] = bitmaps.get(key, 0) | (1 << ordinal)
+
+        for ordinal, subject_id in enumerate(snapshot.subject_ids):
+            course = snapshot.courses[subject_id]
+            if course.offered_fall: add(("offered", "fall"), ordinal)
+            if course.offered_spring: add(("offered", "spring"), ordinal)
+            if course.offered_IAP: add(("offered", "iap"), ordinal)
+            if course.offered_summer: add(("offered", "summer"), ordinal)
+
+            if course.level == "U": add(("level", "undergrad"), ordinal)
+            elif course.level == "G": add(("level", "grad"), ordinal)
+
+            if course.communication_requirement == CatalogConstants.ciH_abbreviation:
+                add(("ci", "cih"), ordinal)
+            elif course.communication_requirement == CatalogConstants.ciHW_abbreviation:
+                add(("ci", "cihw"), ordinal)
+            elif not course.communication_requirement:
+                add(("ci", "not-ci"), ordinal)
+
+            hasses = [hass.strip().upper() for hass in course.get_hass_attributes()]
+            if any(len(hass) > 0 for hass in hasses):
+                add(("hass", "any"), ordinal)
+            for hass in HASS_VALUES:
+                if "HASS-" + hass.upper() in hasses:
+                    add(("hass", hass), ordinal)
+
+            if course.gir_attribute:
+                add(("gir", "any"), ordinal)
+                gir = course.gir_attribute.replace("GIR:", "").lower()
+                if gir in GIR_VALUES:
+                    add(("gir", gir), ordinal)
+
+            masks = lecture_masks(snapshot.schedules.get(subject_id, []))
+            if len(masks) > 0:
+                self.lecture_masks[subject_id] = masks
+                self._scheduled.append((ordinal, masks))
+
+        self.bitmaps = bitmaps
+
+    def bitmap(self, name, value):
+        """Returns the bitmap of courses with the given attribute value."""
+        return self.bitmaps.get((name, value), 0)
+
+    def ordinals(self, bitmap):
+        """Returns the ordinals of the bits set in the given bitmap, in
+        increasing order."""
+        bits = bin(bitmap)[:1:-1]
+        return [i for i, bit in enumerate(bits) if bit == "1"]
+
+    def count(self, bitmap):
+        """Returns the number of courses in the given bitmap."""
+        return bin(bitmap).count("1")
+
+    def busy_mask(self, subject_id, option=None):
+        """Returns the time bitmask of the lectures of the given course. If
+        option is None, returns the times at which every lecture option meets
+        (the times the student is busy whichever option they choose);
+        otherwise returns the times of the lecture option with that index.
+        Courses without scheduled lectures have a mask of zero. Raises a
+        ValueError if the option does not exist."""
+        masks = self.lecture_masks.get(subject_id, ())
+        if option is not None:
+            if option < 0 or option >= len(masks):
+                raise ValueError
+            return masks[option]
+        return reduce(lambda a, b: a & b, masks) if len(masks) > 0 else 0
+
+    def conflict_free_bitmap(self, busy):
+        """Returns the bitmap of courses that have a lecture option that does
+        not overlap the given time bitmask. Courses without scheduled lectures
+        are always included."""
+        result = self.all_bits
+        for ordinal, masks in self._scheduled:
+            if all(mask & busy for mask in masks):
+                result &= ~(1 << ordinal)
+        return result
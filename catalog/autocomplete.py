@@ -0,0 +1,167 @@
+"""
+In-memory autocomplete index over a catalog snapshot.
+
+The index is a compressed prefix trie (radix tree) whose keys are the
+lowercase subject IDs, joint subject IDs and title words of every course.
+Each node stores the ordinals of the best-ranked courses anywhere beneath it
+under each ranking, so a one-word query costs one walk down the trie
+regardless of how many courses match the prefix.
+"""
+
+import heapq
+import re
+
+from .search_index import tokenize, split_ids
+
+# Maximum number of suggestions that can be requested for a query
+MAX_SUGGESTIONS = 20
+
+# The rankings for suggestions, and the Course field that each ranking sorts
+# by (in decreasing order)
+RANKINGS = {
+    "enrollment": "enrollment_number",
+    "rating": "rating"
+}
+
+QUERY_TERM_REGEX = re.compile(r"[^a-z0-9.]")
+
+class TrieNode(object):
+    """A node in the compressed prefix trie.
+
+    edges: dictionary of the first character of each outgoing edge label to a
+        tuple (label, child node).
+    ordinals: the ordinals of the courses with a key ending at this node.
+    top: dictionary of ranking names to a tuple of the ordinals of the
+        MAX_SUGGESTIONS best courses with a key beginning with this node's
+        prefix, best first.
+    """
+
+    __slots__ = ("edges", "ordinals", "top")
+
+    def __init__(self):
+        self.edges = {}
+        self.ordinals = set()
+        self.top = None
+
+def common_prefix_length(a, b):
+    """Returns the length of the longest common prefix of two strings."""
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
+
+class AutocompleteIndex(object):
+    """Autocomplete index over the courses in a CatalogSnapshot. Courses are
+    identified by their ordinals in the snapshot.
+
+    ranks: dictionary of ranking names to lists mapping each ordinal to the
+        course's position under that ranking (0 is best). Ties are broken by
+        subject ID.
+    """
+
+    def __init__(self, snapshot):
+        self.root = TrieNode()
+        courses = [snapshot.courses[subject_id] for subject_id in snapshot.subject_ids]
+        for ordinal, course in enumerate(courses):
+            keys = set([course.subject_id.lower()])
+            keys.update(subject_id.lower() for subject_id in split_ids(course.joint_subjects))
+            keys.update(tokenize(course.title))
+            for key in keys:
+                self._insert(key, ordinal)
+
+        self.ranks = {}
+        for ranking, field in RANKINGS.items():
+            order = sorted(range(len(courses)), key=lambda i: (-(getattr(courses[i], field) or 0.0), i))
+            ranks = [0] * len(courses)
+            for rank, ordinal in enumerate(order):
+                ranks[ordinal] = rank
+            self.ranks[ranking] = ranks
+        self._finalize(self.root)
+
+    def _insert(self, key, ordinal):
+        node = self.root
+        while len(key) > 0:
+            edge = node.edges.get(key[0])
+            if edge is None:
+                child = TrieNode()
+                node.edges[key[0]] = (key, child)
+                node = child
+                break
+            label, child = edge
+            length = common_prefix_length(label, key)
+            if length < len(label):
+                # Split the edge where the key diverges from it
+                middle = TrieNode()
+                middle.edges[label[length]] = (label[length:], child)
+                node.edges[key[0]] = (label[:length], middle)
+                child = middle
+            node = child
+            key = key[length:]
+        node.ordinals.add(ordinal)
+
+    def _finalize(self, node):
+        """Computes the best courses beneath the given node under each
+        ranking, and freezes the node's ordinals."""
+        candidates = set(node.ordinals)
+        for label, child in node.edges.values():
+            self._finalize(child)
+            for top in child.top.values():
+                candidates.update(top)
+        node.ordinals = tuple(sorted(node.ordinals))
+        node.top = {ranking: tuple(heapq.nsmallest(MAX_SUGGESTIONS, candidates, key=ranks.__getitem__))
+                    for ranking, ranks in self.ranks.items()}
+
+    def find(self, prefix):
+        """Returns the node beneath which every key beginning with the given
+        prefix is found, or None if no key begins with it."""
+        node = self.root
+        while len(prefix) > 0:
+            edge = node.edges.get(prefix[0])
+            if edge is None:
+                return None
+            label, child = edge
+            if label.startswith(prefix):
+                return child
+            if not prefix.startswith(label):
+                return None
+            prefix = prefix[len(label):]
+            node = child
+        return node
+
+    @staticmethod
+    def subtree_ordinals(node):
+        """Returns the set of ordinals of every course with a key at or beneath
+        the given node."""
+        result = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            result.update(node.ordinals)
+            stack.extend(child for label, child in node.edges.values())
+        return result
+
+    def suggest(self, query, ranking="enrollment", limit=10):
+        """Returns the ordinals of at most limit courses that match the query,
+        best first under the given ranking. Every word of the query must be a
+        prefix of the subject ID, a joint subject ID or a title word of the
+        course. Raises a KeyError if the ranking is invalid."""
+        ranks = self.ranks[ranking]
+        terms = [QUERY_TERM_REGEX.sub("", term) for term in query.lower().split()]
+        terms = [term for term in terms if len(term) > 0]
+        if len(terms) == 0:
+            return []
+
+        nodes = [self.find(term) for term in set(terms)]
+        if any(node is None for node in nodes):
+            return []
+        if len(nodes) == 1:
+            return list(nodes[0].top[ranking][:limit])
+
+        # Intersect the courses matching each term, starting with the
+        # narrowest prefix
+        ordinal_sets = sorted((self.subtree_ordinals(node) for node in nodes), key=len)
+        matches = ordinal_sets[0]
+        for ordinals in ordinal_sets[1:]:
+            matches = matches & ordinals
+        return heapq.nsmallest(limit, matches, key=ranks.__getitem__)
@@ -2,8 +2,13 @@ from __future__ import unicode_literals
 from django.core.exceptions import ObjectDoesNotExist
 
 from django.db import models
+from django.db.models.signals import post_save
 from common.models import Student
 from catalog_parse.utils.catalog_constants import *
+from .schedule import decode_schedule, slot_rows, SLOT_FIELDS
+
+# Placeholder for the saved schedule of a course whose schedule was not loaded
+_UNKNOWN_SCHEDULE = object()
 
 class Attribute:
     """
@@ -187,6 +192,31 @@ CSV_HEADERS = {
 
 FIELD_TO_CSV = {field_name: csv_header for csv_header, (field_name, _) in CSV_HEADERS.items()}
 
+class CatalogGeneration(models.Model):
+    """Records each reload of the public catalog by update_db.update_catalog
+    and each edit to a public course, so that running server processes can
+    tell when their in-memory catalog snapshot is out of date."""
+    semester = models.CharField(max_length=15, default="")
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "Catalog generation {} for {} at {}".format(self.pk, self.semester, self.timestamp)
+
+    @staticmethod
+    def current():
+        """Returns the ID of the most recent catalog generation, or 0 if the
+        catalog has never been reloaded."""
+        latest = CatalogGeneration.objects.order_by("-pk").values_list("pk", flat=True).first()
+        return latest if latest is not None else 0
+
+    @staticmethod
+    def record(semester=None):
+        """Records a new catalog generation for the given semester, or for the
+        semester of the current generation if semester is None."""
+        if semester is None:
+            semester = CatalogGeneration.objects.order_by("-pk").values_list("semester", flat=True).first() or ""
+        return CatalogGeneration.objects.create(semester=semester)
+
 # Create your models here.
 class Course(models.Model):
     subject_id = models.CharField(db_index=True, max_length=20, null=True)
@@ -208,12 +238,37 @@ class Course(models.Model):
     def public_courses(cls):
         return Course.objects.filter(public=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Course, cls).from_db(db, field_names, values)
+        # Remember the loaded schedule, so that the schedule slots are only
+        # rewritten when it changes (see _sync_schedule_slots)
+        instance._saved_schedule = instance.__dict__.get("schedule", _UNKNOWN_SCHEDULE)
+        # Remember whether the course was public, so that retracting it from
+        # the catalog updates the snapshot (see catalog.snapshot)
+        instance._saved_public = instance.__dict__.get("public")
+        return instance
+
     @classmethod
     def make_generic(cls, subject_id, unique_id):
         """Creates a generic course that satisfies the requirements separated by
         spaces in the given subject ID, e.g. "CI-H HASS-A". Returns a Course whose
         subject ID has unique ID appended. Raises a ValueError if one or more
         generic attributes are invalid."""
+        generic_attribute = cls.generic_attribute(subject_id)
+        generic_course = generic_attribute.course
+        if generic_attribute.needs_unique_id:
+            generic_course.id += str(unique_id)
+        return generic_course
+
+    @classmethod
+    def generic_attribute(cls, subject_id):
+        """Returns the combined Attribute for a generic course that satisfies
+        the requirements separated by spaces in the given subject ID. The
+        attribute's course does not have a unique ID appended; if the
+        attribute's needs_unique_id is True, one should be added to each copy
+        of the course. Raises a ValueError if one or more generic attributes
+        are invalid."""
 
         is_generic_course = False
         if "." not in subject_id:
@@ -240,8 +295,7 @@ class Course(models.Model):
 
         #add all matching attributes to generic course
         if is_generic_course:
-            generic_course = Attribute.combine(matching_attributes, unique_id).course
-            return generic_course
+            return Attribute.combine(matching_attributes, "")
         else:
             raise ValueError
 
@@ -257,7 +311,17 @@ class Course(models.Model):
     joint_subjects = models.TextField(default="", null=True)
     meets_with_subjects = models.TextField(default="", null=True)
 
-    def _get_courses(self, val):
+    def _get_courses(self, val, relationship, snapshot=None):
+        """Returns the catalog courses listed in the given comma-separated
+        string. If a CatalogSnapshot is given, the courses are looked up in it
+        (using the precomputed list in the given relationship dictionary if
+        this course is in the snapshot) instead of the database."""
+        if snapshot is not None:
+            from .snapshot import CourseRelationships
+            if snapshot.courses.get(self.subject_id) is self:
+                return list(getattr(snapshot.relationships, relationship)[self.subject_id])
+            return list(CourseRelationships.resolve(val, snapshot.courses))
+
         if val is None: return []
         comps = val.split(",")
         result = []
@@ -269,12 +333,12 @@ class Course(models.Model):
                 continue
         return result
 
-    def get_equivalent_subjects(self):
-        return self._get_courses(self.equivalent_subjects)
-    def get_joint_subjects(self):
-        return self._get_courses(self.joint_subjects)
-    def get_meets_with_subjects(self):
-        return self._get_courses(self.meets_with_subjects)
+    def get_equivalent_subjects(self, snapshot=None):
+        return self._get_courses(self.equivalent_subjects, "equivalent", snapshot)
+    def get_joint_subjects(self, snapshot=None):
+        return self._get_courses(self.joint_subjects, "joint", snapshot)
+    def get_meets_with_subjects(self, snapshot=None):
+        return self._get_courses(self.meets_with_subjects, "meets_with", snapshot)
 
 
     prerequisites = models.TextField(null=True)
@@ -416,11 +480,14 @@ class Course(models.Model):
         return data
 
 
-    def satisfies(self, requirement, all_courses=None):
+    def satisfies(self, requirement, all_courses=None, snapshot=None):
         """
         If `allCourses` is not nil, it may be a list of course objects that can
         potentially satisfy the requirement. If a combination of courses
         satisfies the requirement, this method will return true.
+
+        If `snapshot` is not None, the children of this course's parent are
+        looked up in the CatalogSnapshot instead of the database.
         """
 
         req = requirement.replace("GIR:","")
@@ -444,12 +511,61 @@ class Course(models.Model):
 
         # For example: 6.0001 and 6.0002 together satsify the 6.00 requirement
         if all_courses is not None and self.parent is not None and req == self.parent:
-            try:
-                parent_course = Course.public_courses().get(subject_id=self.parent)
+            if snapshot is not None:
+                parent_children = snapshot.relationships.children.get(self.parent)
                 ids = set(c.subject_id for c in all_courses)
-                if parent_course.children is not None and all((child in ids) for child in parent_course.children.split(",")):
+                if parent_children is not None and all((child in ids) for child in parent_children):
                     return True
-            except:
-                pass
+            else:
+                try:
+                    parent_course = Course.public_courses().get(subject_id=self.parent)
+                    ids = set(c.subject_id for c in all_courses)
+                    if parent_course.children is not None and all((child in ids) for child in parent_course.children.split(",")):
+                        return True
+                except:
+                    pass
 
         return False
+
+class ScheduleSlot(models.Model):
+    """One meeting time of a course, decoded from Course.schedule when the
+    catalog is imported (see catalog.schedule). Each option of each section
+    of the schedule has one slot per set of meeting times, or a single slot
+    with no days if its time is to be announced.
+
+    days: bitmask of the days of the week, with bit 0 for Monday
+    start, end: the 30-minute slots of the day at which the meeting starts
+        and ends (exclusive)
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="schedule_slots")
+    section_index = models.IntegerField(default=0)
+    section_type = models.CharField(max_length=20)
+    option_index = models.IntegerField(default=0)
+    location = models.CharField(max_length=50, null=True)
+    days = models.IntegerField(default=0)
+    start = models.IntegerField(default=0)
+    end = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "{} {} {}: days {} from slot {} to {}".format(self.course_id, self.section_type, self.option_index,
+                                                           self.days, self.start, self.end)
+
+    @staticmethod
+    def update_for_course(course):
+        """Replaces the schedule slots for the given saved course with the ones
+        decoded from its schedule string."""
+        ScheduleSlot.objects.filter(course=course).delete()
+        ScheduleSlot.objects.bulk_create([ScheduleSlot(course=course, **dict(zip(SLOT_FIELDS, row)))
+                                          for row in slot_rows(decode_schedule(course.schedule))])
+        course._saved_schedule = course.schedule
+
+def _sync_schedule_slots(sender, instance, created, raw=False, **kwargs):
+    """Rewrites the schedule slots of a public course whenever it is saved with
+    a different schedule string than it was loaded with. (Changes made with
+    QuerySet.update are not detected.)"""
+    if raw or not instance.public:
+        return
+    if created or getattr(instance, "_saved_schedule", _UNKNOWN_SCHEDULE) != instance.schedule:
+        ScheduleSlot.update_for_course(instance)
+
+post_save.connect(_sync_schedule_slots, sender=Course, dispatch_uid="catalog_schedule_slots_save")
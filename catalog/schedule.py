@@ -0,0 +1,187 @@
+"""
+Decoding of the schedule strings stored in Course.schedule.
+
+Schedules are stored in the format produced by
+catalog_parse.utils.parse_schedule, for example:
+
+    Lecture,10-250/MWF/0/10;Recitation,34-301/M/0/11,34-302/M/1/7 PM
+
+Each semicolon-separated section has a type followed by its options (the
+alternative meeting times a student can choose between). Each option is a
+location followed by one or more (days, evening flag, time) triples.
+
+A week is divided into 30-minute slots, and the times an option meets can be
+represented as a bitmask over the slots of the week (a Python integer), so
+that two options overlap exactly when their masks share a bit.
+
+When the catalog is imported, each decoded schedule is also stored as rows of
+the ScheduleSlot model (see slot_rows and sections_from_slots), so that the
+server does not need to parse the strings again.
+"""
+
+from collections import namedtuple
+
+# The characters used for each day of the week, in order
+DAYS = "MTWRFS"
+
+# Number of 30-minute slots in a day
+SLOTS_PER_DAY = 48
+
+# Number of 30-minute slots in a class with no end time given
+DEFAULT_DURATION = 2
+
+LECTURE_SECTION = "Lecture"
+
+TBA = "TBA"
+
+# days is a bitmask over DAYS (bit 0 is Monday), and start and end are slots
+# of the day (end is exclusive)
+ScheduleTime = namedtuple("ScheduleTime", ["days", "start", "end"])
+
+# times is empty if the option's time is to be announced
+ScheduleOption = namedtuple("ScheduleOption", ["location", "times"])
+
+ScheduleSection = namedtuple("ScheduleSection", ["section_type", "options"])
+
+def parse_hour(value, is_evening):
+    """Returns the number of minutes after midnight of the given time of day,
+    such as "10", "9.30" or "7 PM". Times without AM or PM before 8 are in the
+    afternoon, unless is_evening is True, in which case every time before
+    noon is moved to the afternoon. Raises a ValueError if the time is
+    invalid."""
+    value = value.strip().upper()
+    is_morning = value.endswith("AM")
+    value = value.replace("AM", "").replace("PM", "").strip().replace(":", ".")
+    comps = value.split(".")
+    if len(comps) > 2:
+        raise ValueError("Invalid time {}".format(value))
+    hour = int(comps[0])
+    minute = int(comps[1]) if len(comps) > 1 else 0
+    if not is_morning and ((is_evening and hour < 12) or (not is_evening and hour < 8)):
+        hour += 12
+    if hour > 24 or minute >= 60:
+        raise ValueError("Invalid time {}".format(value))
+    return hour * 60 + minute
+
+def parse_time(days, evening_flag, value):
+    """Returns a ScheduleTime for the given components of a schedule option.
+    Raises a ValueError if any of them are invalid."""
+    day_mask = 0
+    for day in days:
+        if day not in DAYS:
+            raise ValueError("Invalid day {}".format(day))
+        day_mask |= 1 << DAYS.index(day)
+    is_evening = evening_flag == "1"
+
+    # Evening times have the PM suffix after the end of the range
+    times = value.split("-")
+    if len(times) > 2:
+        raise ValueError("Invalid time range {}".format(value))
+    start = parse_hour(times[0], is_evening) // 30
+    if len(times) == 2:
+        end = -(-parse_hour(times[1], is_evening) // 30)
+    else:
+        end = start + DEFAULT_DURATION
+    if end <= start:
+        raise ValueError("Invalid time range {}".format(value))
+    return ScheduleTime(day_mask, start, min(end, SLOTS_PER_DAY))
+
+def parse_option(value):
+    """Returns a ScheduleOption for the given option string, such as
+    "10-250/MWF/0/10". Times that cannot be parsed are skipped."""
+    if value.strip() == TBA:
+        return ScheduleOption(None, ())
+    comps = value.split("/")
+    times = []
+    for i in range(1, len(comps) - 2, 3):
+        try:
+            times.append(parse_time(*comps[i:i + 3]))
+        except ValueError:
+            continue
+    return ScheduleOption(comps[0] or None, tuple(times))
+
+def decode_schedule(schedule):
+    """Returns a list of ScheduleSections for the given schedule string (an
+    empty list if the string is None or empty)."""
+    if not schedule:
+        return []
+    sections = []
+    for section in schedule.split(";"):
+        comps = section.split(",")
+        if len(comps[0].strip()) == 0:
+            continue
+        sections.append(ScheduleSection(comps[0].strip(), tuple(parse_option(comp) for comp in comps[1:])))
+    return sections
+
+def option_mask(option):
+    """Returns the bitmask of the 30-minute slots of the week in which the
+    given ScheduleOption meets."""
+    mask = 0
+    for time in option.times:
+        slots = ((1 << (time.end - time.start)) - 1) << time.start
+        for day in range(len(DAYS)):
+            if time.days & (1 << day):
+                mask |= slots << (day * SLOTS_PER_DAY)
+    return mask
+
+def lecture_masks(sections):
+    """Returns a tuple of the bitmasks of the scheduled lecture options in
+    the given list of ScheduleSections. The tuple is empty if the course has
+    no lectures with known times."""
+    return tuple(option_mask(option) for section in sections if section.section_type == LECTURE_SECTION
+                 for option in section.options if len(option.times) > 0)
+
+# The ScheduleSlot fields corresponding to each item of a slot row
+SLOT_FIELDS = ("section_index", "section_type", "option_index", "location", "days", "start", "end")
+
+def slot_rows(sections):
+    """Yields a tuple of values for each of the SLOT_FIELDS for every time in
+    the given list of ScheduleSections. An option with no times is
+    represented by a single row with no days."""
+    for section_index, section in enumerate(sections):
+        for option_index, option in enumerate(section.options):
+            times = option.times if len(option.times) > 0 else [ScheduleTime(0, 0, 0)]
+            for time in times:
+                yield (section_index, section.section_type, option_index, option.location,
+                       time.days, time.start, time.end)
+
+def sections_from_slots(rows):
+    """Returns the list of ScheduleSections described by the given slot rows,
+    which must be ordered by section and option index, with the times of each
+    option in their original order. The inverse of slot_rows."""
+    sections = []
+    current_section = current_option = None
+    for section_index, section_type, option_index, location, days, start, end in rows:
+        if section_index != current_section:
+            sections.append(ScheduleSection(section_type, []))
+            current_section, current_option = section_index, None
+        options = sections[-1].options
+        if option_index != current_option:
+            options.append(ScheduleOption(location, []))
+            current_option = option_index
+        if days != 0:
+            options[-1].times.append(ScheduleTime(days, start, end))
+    return [ScheduleSection(section.section_type,
+                            tuple(ScheduleOption(option.location, tuple(option.times)) for option in section.options))
+            for section in sections]
+
+def format_slot(slot):
+    """Returns the time of day at the start of the given slot, such as "9:30"."""
+    return "{}:{:02d}".format(slot // 2, (slot % 2) * 30)
+
+def schedule_json_object(sections):
+    """Returns a JSON-serializable list describing the given list of
+    ScheduleSections."""
+    return [{
+        "type": section.section_type,
+        "options": [{
+            "location": option.location,
+            "times": [{
+                "days": "".join(day for i, day in enumerate(DAYS) if time.days & (1 << i)),
+                "start": format_slot(time.start),
+                "end": format_slot(time.end),
+                "start_slot": time.start,
+                "end_slot": time.end
+            } for time in option.times]
+        } for option in section.options]
+    } for section in sections]
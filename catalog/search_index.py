@@ -0,0 +1,133 @@
+"""
+In-memory search index over a catalog snapshot.
+
+Each course in the snapshot is assigned an ordinal (its position in the sorted
+list of subject IDs). The index holds an inverted index from tokens to the
+ordinals of the courses containing them, which supports prefix matching and
+relevance ranking over subject IDs, titles, descriptions and instructors.
+Filters are handled separately by the AttributeIndex.
+"""
+
+import bisect
+import math
+import re
+
+# Relative weights of matches in each field of a course
+FIELD_WEIGHTS = {
+    "subject_id": 10.0,
+    "related_id": 6.0,
+    "title": 4.0,
+    "instructors": 2.0,
+    "description": 1.0
+}
+
+# Weight applied to a token that matches a query term by prefix only
+PREFIX_MATCH_WEIGHT = 0.5
+
+TOKEN_REGEX = re.compile(r"[a-z0-9]+(?:\.[a-z0-9]+)*")
+
+def tokenize(text):
+    """Returns the lowercase tokens in the given text. Periods between
+    alphanumeric characters are kept, so subject IDs stay intact."""
+    if not text:
+        return []
+    return TOKEN_REGEX.findall(text.lower())
+
+def split_ids(value):
+    """Returns the subject IDs in a comma-separated list string."""
+    if not value:
+        return []
+    return [comp.strip() for comp in value.split(",") if len(comp.strip()) > 0]
+
+class SearchIndex(object):
+    """Search index over the courses in a CatalogSnapshot.
+
+    subject_ids: list mapping each ordinal to a subject ID.
+    postings: dictionary of tokens to dictionaries mapping ordinals to the
+        weighted number of times the token appears in that course.
+    tokens: sorted list of all tokens, used for prefix matching.
+    """
+
+    def __init__(self, snapshot):
+        self.subject_ids = list(snapshot.subject_ids)
+        self.ordinals = {subject_id: i for i, subject_id in enumerate(self.subject_ids)}
+        courses = [snapshot.courses[subject_id] for subject_id in self.subject_ids]
+
+        # Lowercase subject IDs and titles, for the substring match types
+        self.lower_ids = [subject_id.lower() for subject_id in self.subject_ids]
+        self.lower_titles = [(course.title or "").lower() for course in courses]
+
+        self.postings = {}
+        for ordinal, course in enumerate(courses):
+            fields = [
+                ("subject_id", [course.subject_id.lower()]),
+                ("related_id", [s.lower() for s in split_ids(course.joint_subjects) + split_ids(course.equivalent_subjects)]),
+                ("title", tokenize(course.title)),
+                ("instructors", tokenize(course.instructors)),
+                ("description", tokenize(course.description)),
+            ]
+            for field, tokens in fields:
+                weight = FIELD_WEIGHTS[field]
+                for token in tokens:
+                    posting = self.postings.setdefault(token, {})
+                    posting[ordinal] = posting.get(ordinal, 0.0) + weight
+        self.tokens = sorted(self.postings.keys())
+
+    def _matching_tokens(self, term):
+        """Yields (token, weight) pairs for each token equal to or beginning
+        with the given query term."""
+        start = bisect.bisect_left(self.tokens, term)
+        for token in self.tokens[start:]:
+            if not token.startswith(term):
+                break
+            yield token, (1.0 if token == term else PREFIX_MATCH_WEIGHT)
+
+    def keyword_search(self, search_term, candidates=None):
+        """Returns the ordinals of the courses that match every token in the
+        search term (by exact or prefix match), sorted by decreasing relevance.
+        If candidates is not None, it should be a set of the only ordinals to
+        consider."""
+        terms = tokenize(search_term)
+        if len(terms) == 0:
+            return []
+
+        num_courses = float(max(len(self.subject_ids), 1))
+        scores = None
+        for term in set(terms):
+            term_scores = {}
+            for token, match_weight in self._matching_tokens(term):
+                posting = self.postings[token]
+                idf = math.log(1.0 + num_courses / len(posting))
+                for ordinal, field_weight in posting.items():
+                    if candidates is not None and ordinal not in candidates:
+                        continue
+                    term_scores[ordinal] = term_scores.get(ordinal, 0.0) + match_weight * field_weight * idf
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {ordinal: score + term_scores[ordinal] for ordinal, score in scores.items() if ordinal in term_scores}
+            if len(scores) == 0:
+                return []
+
+        return sorted(scores.keys(), key=lambda ordinal: (-scores[ordinal], ordinal))
+
+    def match_search(self, search_term, match_type, candidates=None):
+        """Returns the ordinals of the courses whose subject ID or title
+        matches the search term using the given match type ("contains",
+        "matches", "starts" or "ends"), in subject ID order. If candidates is
+        not None, it should be a sorted list of the only ordinals to consider.
+        Raises a ValueError if the match type is invalid."""
+        term = search_term.lower()
+        if match_type == "contains":
+            test = lambda value: term in value
+        elif match_type == "matches":
+            test = lambda value: term == value
+        elif match_type == "starts":
+            test = lambda value: value.startswith(term)
+        elif match_type == "ends":
+            test = lambda value: value.endswith(term)
+        else:
+            raise ValueError
+
+        ordinals = candidates if candidates is not None else range(len(self.subject_ids))
+        return [i for i in ordinals if test(self.lower_ids[i]) or test(self.lower_titles[i])]
@@ -0,0 +1,292 @@
+"""
+Process-local snapshot of the public course catalog.
+
+The public catalog only changes when update_db.update_catalog runs, so instead
+of querying the database and re-serializing every course on each request, the
+catalog views read from an immutable CatalogSnapshot that holds each course's
+JSON already serialized. The snapshot is rebuilt (and swapped in atomically)
+when a new CatalogGeneration is recorded. Saving or deleting a public course
+(including one that is made private) records a new generation, so that every
+server process picks up the edit, and rebuilds the snapshot in the editing
+process right away.
+"""
+
+import bisect
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.db.models.signals import post_save, post_delete
+from common.responses import EncodedPayload, ENCODING_IDENTITY
+from .models import Course, CatalogGeneration, ScheduleSlot
+from .schedule import decode_schedule, sections_from_slots, SLOT_FIELDS
+from .search_index import SearchIndex
+from .attribute_index import AttributeIndex
+from .autocomplete import AutocompleteIndex
+
+# Number of seconds between checks for a new catalog generation
+GENERATION_CHECK_INTERVAL = 60.0
+
+# Number of courses to serialize in each chunk of a streamed JSON list
+STREAM_CHUNK_SIZE = 200
+
+def join_json_list(items):
+    """Joins a sequence of serialized JSON objects into a serialized JSON list,
+    formatted identically to json.dumps on a list."""
+    return "[" + ", ".join(items) + "]"
+
+def iter_json_list(items, chunk_size=STREAM_CHUNK_SIZE):
+    """Yields a serialized JSON list of the given serialized JSON objects in
+    chunks of at most chunk_size objects, so that the whole list never has to
+    be held in memory. The concatenated chunks are identical to the output of
+    join_json_list."""
+    prefix = "["
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield prefix + ", ".join(chunk)
+            prefix = ", "
+            chunk = []
+    if chunk:
+        yield prefix + ", ".join(chunk) + "]"
+    else:
+        yield ("[" if prefix == "[" else "") + "]"
+
+class CourseRelationships(object):
+    """The relationships between courses in a catalog snapshot, parsed once
+    from each course's comma-separated subject ID fields.
+
+    children: dictionary of subject IDs to the tuple of subject IDs in the
+        course's children field (or None if the course has no children field).
+    joint, equivalent, meets_with: dictionaries of subject IDs to tuples of
+        the related Course objects that are in the catalog.
+    """
+
+    def __init__(self, courses):
+        self.children = {}
+        self.joint = {}
+        self.equivalent = {}
+        self.meets_with = {}
+        for subject_id, course in courses.items():
+            self.children[subject_id] = tuple(course.children.split(",")) if course.children is not None else None
+            self.joint[subject_id] = self.resolve(course.joint_subjects, courses)
+            self.equivalent[subject_id] = self.resolve(course.equivalent_subjects, courses)
+            self.meets_with[subject_id] = self.resolve(course.meets_with_subjects, courses)
+
+    @staticmethod
+    def resolve(value, courses):
+        """Returns a tuple of the courses in the given dictionary of subject IDs
+        to courses that are listed in the given comma-separated string."""
+        if value is None:
+            return ()
+        return tuple(courses[comp] for comp in value.split(",") if comp in courses)
+
+# Counts the snapshots loaded in this process
+_load_count = itertools.count(1)
+
+class CatalogSnapshot(object):
+    """An immutable view of the public catalog at a given generation.
+
+    version: a string that is different for every snapshot loaded in this
+        process, for use in cache keys.
+
+    courses: dictionary of subject IDs to Course objects. These are shared by
+        all requests in the process and must not be modified.
+    subject_ids: sorted list of all subject IDs in the catalog.
+    basic_json, full_json: dictionaries of subject IDs to the serialized JSON
+        for each course, without and with the full course information.
+    schedules: dictionary of subject IDs to lists of ScheduleSections
+        describing each course's schedule, loaded from the course's
+        ScheduleSlots. Courses without a schedule are omitted.
+    full_objects: dictionary of subject IDs to the unserialized full JSON
+        dictionary for each course, used to project courses onto a subset of
+        their fields. These must not be modified either.
+
+    The list of all courses is also precomputed in each variant, along with
+    its compressed encodings and entity tags (see all_payload).
+
+    relationships: a CourseRelationships object describing the courses in
+        this snapshot.
+    search_index: a SearchIndex over the courses in this snapshot.
+    attribute_index: an AttributeIndex over the courses in this snapshot.
+    autocomplete_index: an AutocompleteIndex over the courses in this
+        snapshot.
+
+    The indexes identify courses by their ordinal, the position of the
+    course's subject ID in subject_ids.
+    """
+
+    def __init__(self, generation, courses, schedule_slots=()):
+        self.generation = generation
+        self.version = "{}.{}".format(generation, next(_load_count))
+        self.courses = {}
+        for course in courses:
+            self.courses[course.subject_id] = course
+        self.subject_ids = sorted(self.courses.keys())
+
+        # Courses that were not imported through update_db have no schedule
+        # slots, so their schedule strings are decoded instead
+        self.schedules = {}
+        for subject_id, rows in itertools.groupby(schedule_slots, key=lambda row: row[0]):
+            if subject_id in self.courses:
+                self.schedules[subject_id] = sections_from_slots(row[1:] for row in rows)
+        for subject_id, course in self.courses.items():
+            if subject_id not in self.schedules and course.schedule:
+                self.schedules[subject_id] = decode_schedule(course.schedule)
+
+        self.basic_json = {}
+        self.full_json = {}
+        self.full_objects = {}
+        for subject_id, course in self.courses.items():
+            self.basic_json[subject_id] = json.dumps(course.to_json_object(full=False))
+            self.full_objects[subject_id] = course.to_json_object(full=True)
+            self.full_json[subject_id] = json.dumps(self.full_objects[subject_id])
+
+        self._all_payloads = {
+            False: EncodedPayload(join_json_list(self.basic_json[s] for s in self.subject_ids),
+                                  "{}-basic".format(generation)),
+            True: EncodedPayload(join_json_list(self.full_json[s] for s in self.subject_ids),
+                                 "{}-full".format(generation))
+        }
+
+        self.relationships = CourseRelationships(self.courses)
+        self.search_index = SearchIndex(self)
+        self.attribute_index = AttributeIndex(self)
+        self.autocomplete_index = AutocompleteIndex(self)
+
+    @staticmethod
+    def load(generation):
+        """Builds a snapshot from the public courses and their schedule slots
+        currently in the database."""
+        schedule_slots = ScheduleSlot.objects.filter(course__public=True) \
+            .order_by("course__subject_id", "section_index", "option_index", "pk") \
+            .values_list("course__subject_id", *SLOT_FIELDS)
+        return CatalogSnapshot(generation, Course.public_courses().order_by("subject_id").iterator(),
+                               schedule_slots.iterator())
+
+    def course_json(self, subject_id, full=True):
+        """Returns the serialized JSON for the given subject ID, or None if the
+        subject is not in the catalog."""
+        return (self.full_json if full else self.basic_json).get(subject_id)
+
+    def json_list(self, subject_ids, full=False):
+        """Returns a serialized JSON list of the given subjects, skipping any
+        that are not in the catalog."""
+        source = self.full_json if full else self.basic_json
+        return join_json_list(source[s] for s in subject_ids if s in source)
+
+    def json_items(self, subject_ids, full=False, fields=None):
+        """Yields the serialized JSON for each of the given subjects that is in
+        the catalog. If fields is not None, it should be a list of field names,
+        and each course's full JSON is projected onto those fields (in the
+        given order) instead."""
+        if fields is None:
+            source = self.full_json if full else self.basic_json
+            for subject_id in subject_ids:
+                if subject_id in source:
+                    yield source[subject_id]
+        else:
+            for subject_id in subject_ids:
+                course_object = self.full_objects.get(subject_id)
+                if course_object is not None:
+                    yield json.dumps(OrderedDict((field, course_object[field]) for field in fields if field in course_object))
+
+    def iter_json_list(self, subject_ids, full=False, fields=None):
+        """Yields a serialized JSON list of the given subjects in chunks,
+        skipping any that are not in the catalog. The subject IDs may be any
+        iterable, and are only consumed as the chunks are produced."""
+        return iter_json_list(self.json_items(subject_ids, full=full, fields=fields))
+
+    def ordinal_after(self, subject_id):
+        """Returns the ordinal of the first course whose subject ID sorts after
+        the given subject ID, for paginating in subject ID order."""
+        return bisect.bisect_right(self.subject_ids, subject_id)
+
+    def all_json(self, full=False):
+        """Returns a serialized JSON list of every course in the catalog."""
+        return self._all_payloads[full].encodings[ENCODING_IDENTITY]
+
+    def all_payload(self, full=False):
+        """Returns an EncodedPayload containing the list of every course in the
+        catalog."""
+        return self._all_payloads[full]
+
+    def department_subject_ids(self, dept):
+        """Returns the sorted subject IDs that begin with the given department
+        code followed by a period."""
+        prefix = dept.upper() + "."
+        start = bisect.bisect_left(self.subject_ids, prefix)
+        result = []
+        for subject_id in self.subject_ids[start:]:
+            if not subject_id.startswith(prefix):
+                break
+            result.append(subject_id)
+        return result
+
+_lock = threading.Lock()
+_snapshot = None
+_last_check = 0.0
+_is_stale = True
+
+def get_snapshot():
+    """Returns the current catalog snapshot. The catalog generation is checked
+    at most every GENERATION_CHECK_INTERVAL seconds, and a new snapshot is built
+    if the generation has changed."""
+    global _snapshot, _last_check, _is_stale
+
+    snapshot = _snapshot
+    if snapshot is not None and not _is_stale and time.time() - _last_check < GENERATION_CHECK_INTERVAL:
+        return snapshot
+
+    with _lock:
+        if _snapshot is None or _is_stale or time.time() - _last_check >= GENERATION_CHECK_INTERVAL:
+            generation = CatalogGeneration.current()
+            if _snapshot is None or _is_stale or _snapshot.generation != generation:
+                # Clear the flag first so that saves during the load mark the
+                # new snapshot as stale too
+                _is_stale = False
+                _snapshot = CatalogSnapshot.load(generation)
+            _last_check = time.time()
+        return _snapshot
+
+def invalidate():
+    """Marks the current snapshot as stale, so that it is rebuilt on the next
+    call to get_snapshot()."""
+    global _is_stale
+    _is_stale = True
+
+# Tracks the batch_course_changes contexts entered on each thread
+_batches = threading.local()
+
+@contextmanager
+def batch_course_changes(semester=None):
+    """Within this context, saving or deleting public courses on the calling
+    thread does not record a new catalog generation for each change. Instead,
+    one generation is recorded for the given semester (see
+    CatalogGeneration.record) when the outermost context exits."""
+    _batches.depth = getattr(_batches, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        _batches.depth -= 1
+        if _batches.depth == 0:
+            CatalogGeneration.record(semester)
+            invalidate()
+
+def _course_changed(sender, instance, created=False, **kwargs):
+    # A course that was public when it was loaded must leave the catalog. If
+    # it is not known whether it was public, assume that it was unless it has
+    # just been created.
+    was_public = getattr(instance, "_saved_public", None)
+    if instance.public or was_public or (was_public is None and not created):
+        invalidate()
+        if getattr(_batches, "depth", 0) == 0:
+            CatalogGeneration.record()
+    instance._saved_public = instance.public
+
+post_save.connect(_course_changed, sender=Course, dispatch_uid="catalog_snapshot_save")
+post_delete.connect(_course_changed, sender=Course, dispatch_uid="catalog_snapshot_delete")
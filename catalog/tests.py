@@ -1,8 +1,14 @@
 from django.test import TestCase
-from .models import Course, CourseFields
+from .models import Course, CourseFields, ScheduleSlot, CatalogGeneration
 from django.test.client import RequestFactory
+from django.urls import resolve
 from . import views
+from .snapshot import get_snapshot, iter_json_list, invalidate, batch_course_changes
+from . import snapshot as snapshot_module
+from .schedule import decode_schedule, lecture_masks, ScheduleOption, ScheduleTime
 import json
+import gzip
+import io
 
 
 class CourseCatalogTest(TestCase):
@@ -84,6 +90,13 @@ class CourseCatalogTest(TestCase):
 
     ### Course model testing
 
+    def response_json(self, response):
+        """Returns the decoded JSON body of the given response, which may be
+        streamed."""
+        if response.streaming:
+            return json.loads(b"".join(response.streaming_content))
+        return json.loads(response.content)
+
     def test_json_object(self):
         course = Course.objects.get(subject_id="21M.030")
         result = course.to_json_object(full=False)
@@ -187,6 +200,25 @@ class CourseCatalogTest(TestCase):
         self.assertTrue(courses[0].satisfies("6.00", all_courses=courses))
         self.assertTrue(courses[1].satisfies("6.00", all_courses=courses))
 
+    def test_relationships_no_queries(self):
+        courses = [Course.objects.get(subject_id="6.0001"),
+                   Course.objects.get(subject_id="6.0002")]
+        music = Course.objects.get(subject_id="21M.030")
+        snapshot = get_snapshot()
+        with self.assertNumQueries(0):
+            self.assertTrue(courses[0].satisfies("6.00", all_courses=courses, snapshot=snapshot))
+            self.assertFalse(courses[0].satisfies("6.00", all_courses=courses[:1], snapshot=snapshot))
+            self.assertEqual([], music.get_joint_subjects(snapshot))
+
+    def test_snapshot_relationships(self):
+        Course.objects.create(subject_id="21M.830", title="World Music (grad)", public=True).save()
+        snapshot = get_snapshot()
+        music = snapshot.courses["21M.030"]
+        self.assertEqual(["21M.830"], [c.subject_id for c in music.get_joint_subjects(snapshot)])
+        # Without a snapshot, the courses are looked up in the database
+        self.assertEqual(["21M.830"], [c.subject_id for c in Course.objects.get(subject_id="21M.030").get_joint_subjects()])
+        self.assertEqual(("6.0001", "6.0002"), snapshot.relationships.children["6.00"])
+
     ### Catalog endpoints
 
     def test_lookup_subject(self):
@@ -196,7 +228,7 @@ class CourseCatalogTest(TestCase):
         self.assertDictContainsSubset({
             CourseFields.subject_id: u"2.001",
             CourseFields.title: u"Foo"
-        }, json.loads(response.content))
+        }, self.response_json(response))
 
     def test_lookup_subject_not_existing(self):
         request = self.factory.get("/courses/lookup/")
@@ -212,7 +244,7 @@ class CourseCatalogTest(TestCase):
         request = self.factory.get("/courses/department/")
         response = views.department(request, dept="2")
         self.assertEqual(200, response.status_code)
-        courses = json.loads(response.content)
+        courses = self.response_json(response)
         self.assertEqual({"2.001", "2.002", "2.003"},
                          {course[CourseFields.subject_id] for course in courses})
 
@@ -220,7 +252,7 @@ class CourseCatalogTest(TestCase):
         request = self.factory.get("/courses/department/")
         response = views.department(request, dept="43")
         self.assertEqual(200, response.status_code)
-        courses = json.loads(response.content)
+        courses = self.response_json(response)
         self.assertEqual([], courses)
 
     def test_department_no_dept(self):
@@ -232,7 +264,7 @@ class CourseCatalogTest(TestCase):
         request = self.factory.get("/courses/all/")
         response = views.list_all(request)
         self.assertEqual(200, response.status_code)
-        courses = json.loads(response.content)
+        courses = self.response_json(response)
         subject_ids = {course[CourseFields.subject_id] for course in courses}
         self.assertEqual({"2.001", "2.002", "2.003", "8.01", "21L.001", "21M.030", "21L.013", "6.00", "6.0001", "6.0002"}, subject_ids)
 
@@ -240,7 +272,7 @@ class CourseCatalogTest(TestCase):
         request = self.factory.get("/courses/search/")
         response = views.search(request, search_term="physics")
         self.assertEqual(200, response.status_code)
-        results = json.loads(response.content)
+        results = self.response_json(response)
         self.assertEqual(1, len(results))
         self.assertEqual("8.01", results[0][CourseFields.subject_id])
 
@@ -248,7 +280,7 @@ class CourseCatalogTest(TestCase):
         request = self.factory.get("/courses/search/", {"type": "ends"})
         response = views.search(request, search_term="2")
         self.assertEqual(200, response.status_code)
-        results = json.loads(response.content)
+        results = self.response_json(response)
         self.assertEqual(2, len(results))
         subject_ids = {course[CourseFields.subject_id] for course in results}
         self.assertEqual({"2.002", "6.0002"}, subject_ids)
@@ -257,7 +289,7 @@ class CourseCatalogTest(TestCase):
         request = self.factory.get("/courses/search/", {"gir": "rest"})
         response = views.search(request, search_term="w")
         self.assertEqual(200, response.status_code)
-        results = json.loads(response.content)
+        results = self.response_json(response)
         self.assertEqual(1, len(results))
         self.assertEqual("21M.030", results[0][CourseFields.subject_id])
 
@@ -265,7 +297,7 @@ class CourseCatalogTest(TestCase):
         request = self.factory.get("/courses/search/", {"hass": "h"})
         response = views.search(request, search_term="s")
         self.assertEqual(200, response.status_code)
-        results = json.loads(response.content)
+        results = self.response_json(response)
         self.assertEqual(1, len(results))
         self.assertEqual("21L.013", results[0][CourseFields.subject_id])
 
@@ -273,14 +305,14 @@ class CourseCatalogTest(TestCase):
         request = self.factory.get("/courses/search/", {"ci": "not-ci"})
         response = views.search(request, search_term="music")
         self.assertEqual(200, response.status_code)
-        results = json.loads(response.content)
+        results = self.response_json(response)
         self.assertEqual([], results)
 
     def test_search_offered(self):
         request = self.factory.get("/courses/search/", {"offered": "fall"})
         response = views.search(request, search_term="d")
         self.assertEqual(200, response.status_code)
-        results = json.loads(response.content)
+        results = self.response_json(response)
         self.assertEqual(1, len(results))
         self.assertEqual("21M.030", results[0][CourseFields.subject_id])
 
@@ -288,5 +320,296 @@ class CourseCatalogTest(TestCase):
         request = self.factory.get("/courses/search/", {"level": "grad"})
         response = views.search(request, search_term="anything")
         self.assertEqual(200, response.status_code)
-        results = json.loads(response.content)
+        results = self.response_json(response)
         self.assertEqual([], results)
+
+    ### Catalog snapshot
+
+    def test_snapshot_reloads_on_save(self):
+        request = self.factory.get("/courses/lookup/")
+        response = views.lookup(request, subject_id="2.004")
+        self.assertEqual(404, response.status_code)
+
+        Course.objects.create(subject_id="2.004", title="Baz", public=True).save()
+        response = views.lookup(request, subject_id="2.004")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(u"Baz", self.response_json(response)[CourseFields.title])
+
+    def test_course_edits_record_generation(self):
+        generation = CatalogGeneration.current()
+        course = Course.objects.get(subject_id="2.001")
+        course.title = "Edited"
+        course.save()
+        self.assertGreater(CatalogGeneration.current(), generation)
+
+        # Another process notices the new generation when it next checks
+        generation = get_snapshot().generation
+        Course.objects.filter(subject_id="2.001").update(title="Edited Elsewhere")
+        CatalogGeneration.record()
+        snapshot_module._last_check = 0
+        self.assertNotEqual(generation, get_snapshot().generation)
+        self.assertEqual("Edited Elsewhere", get_snapshot().courses["2.001"].title)
+
+        # Retracting a course from the catalog also records a generation
+        generation = CatalogGeneration.current()
+        course = Course.objects.get(subject_id="2.001")
+        course.public = False
+        course.save()
+        self.assertGreater(CatalogGeneration.current(), generation)
+        self.assertNotIn("2.001", get_snapshot().courses)
+        # Changes to private courses do not
+        generation = CatalogGeneration.current()
+        course.title = "Private"
+        course.save()
+        Course.objects.get(subject_id="2.001").save()
+        self.assertEqual(generation, CatalogGeneration.current())
+
+        # A batch of changes records a single generation
+        generation = CatalogGeneration.current()
+        with batch_course_changes("2020FA"):
+            for subject_id in ["2.004", "2.005"]:
+                Course.objects.create(subject_id=subject_id, title="Baz", public=True).save()
+            self.assertEqual(generation, CatalogGeneration.current())
+        self.assertEqual(1, CatalogGeneration.objects.filter(pk__gt=generation).count())
+        self.assertEqual("2020FA", CatalogGeneration.objects.get(pk=CatalogGeneration.current()).semester)
+
+    def test_snapshot_department_order(self):
+        request = self.factory.get("/courses/department/", {"full": "true"})
+        response = views.department(request, dept="6")
+        self.assertEqual(200, response.status_code)
+        courses = self.response_json(response)
+        self.assertEqual(["6.00", "6.0001", "6.0002"],
+                         [course[CourseFields.subject_id] for course in courses])
+        self.assertIn(CourseFields.is_half_class, courses[0])
+
+    def test_list_all_not_modified(self):
+        request = self.factory.get("/courses/all/")
+        response = views.list_all(request)
+        self.assertEqual(200, response.status_code)
+        etag = response["ETag"]
+
+        request = self.factory.get("/courses/all/", HTTP_IF_NONE_MATCH=etag)
+        response = views.list_all(request)
+        self.assertEqual(304, response.status_code)
+
+        # The full variant has a different tag
+        request = self.factory.get("/courses/all/", {"full": "true"}, HTTP_IF_NONE_MATCH=etag)
+        response = views.list_all(request)
+        self.assertEqual(200, response.status_code)
+
+    def test_list_all_gzip(self):
+        request = self.factory.get("/courses/all/", HTTP_ACCEPT_ENCODING="gzip")
+        response = views.list_all(request)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("gzip", response["Content-Encoding"])
+        content = gzip.GzipFile(fileobj=io.BytesIO(response.content)).read()
+        self.assertEqual(10, len(json.loads(content)))
+
+    def test_lookup_many(self):
+        request = self.factory.get("/courses/lookup_many/", {"ids": "2.001,8.01,foo,2.001"})
+        response = views.lookup_many(request)
+        self.assertEqual(200, response.status_code)
+        result = self.response_json(response)
+        self.assertEqual({"2.001", "8.01"}, set(result["courses"].keys()))
+        self.assertEqual(u"Physics", result["courses"]["8.01"][CourseFields.title])
+        self.assertEqual(["foo"], result["unknown"])
+
+    def test_lookup_many_post(self):
+        request = self.factory.post("/courses/lookup_many/", json.dumps(["21M.030", "6.00"]),
+                                    content_type="application/json")
+        response = views.lookup_many(request)
+        self.assertEqual(200, response.status_code)
+        result = self.response_json(response)
+        self.assertEqual({"21M.030", "6.00"}, set(result["courses"].keys()))
+        self.assertEqual([], result["unknown"])
+
+    def test_lookup_many_routing(self):
+        self.assertEqual(views.lookup_many, resolve("/courses/lookup_many/").func)
+        self.assertEqual(views.search, resolve("/courses/search/lookup_many").func)
+
+    def test_lookup_many_no_ids(self):
+        request = self.factory.get("/courses/lookup_many/")
+        response = views.lookup_many(request)
+        self.assertEqual(400, response.status_code)
+
+    def test_search_keywords(self):
+        request = self.factory.get("/courses/search/", {"type": "keywords"})
+        response = views.search(request, search_term="zimmer")
+        self.assertEqual(200, response.status_code)
+        results = self.response_json(response)
+        self.assertEqual(["21M.030"], [course[CourseFields.subject_id] for course in results])
+
+        response = views.search(request, search_term="test desc")
+        results = self.response_json(response)
+        self.assertEqual(["21M.030"], [course[CourseFields.subject_id] for course in results])
+
+    def test_search_keywords_ranking(self):
+        request = self.factory.get("/courses/search/", {"type": "keywords"})
+        response = views.search(request, search_term="6.00")
+        self.assertEqual(200, response.status_code)
+        results = self.response_json(response)
+        self.assertEqual(["6.00", "6.0001", "6.0002"], [course[CourseFields.subject_id] for course in results])
+
+    def test_search_invalid_type(self):
+        request = self.factory.get("/courses/search/", {"type": "foo"})
+        response = views.search(request, search_term="physics")
+        self.assertEqual(400, response.status_code)
+
+    def test_filter_courses(self):
+        request = self.factory.get("/courses/filter/", {"gir": "phy1"})
+        response = views.filter_courses(request)
+        self.assertEqual(200, response.status_code)
+        results = self.response_json(response)
+        self.assertEqual(["8.01"], [course[CourseFields.subject_id] for course in results])
+
+    def test_filter_courses_combined(self):
+        request = self.factory.get("/courses/filter/", {"hass": "a", "ci": "cih"})
+        response = views.filter_courses(request)
+        self.assertEqual(200, response.status_code)
+        results = self.response_json(response)
+        self.assertEqual(["21M.030"], [course[CourseFields.subject_id] for course in results])
+
+    def test_search_streamed(self):
+        request = self.factory.get("/courses/search/", {"full": "y"})
+        response = views.search(request, search_term="2.00")
+        self.assertTrue(response.streaming)
+        self.assertEqual(get_snapshot().json_list(["2.001", "2.002", "2.003"], full=True),
+                         b"".join(response.streaming_content))
+
+    def test_iter_json_list_chunks(self):
+        items = [json.dumps({"id": i}) for i in range(5)]
+        for chunk_size in range(1, 7):
+            self.assertEqual(json.dumps([{"id": i} for i in range(5)]),
+                             "".join(iter_json_list(items, chunk_size=chunk_size)))
+        self.assertEqual("[]", "".join(iter_json_list([], chunk_size=2)))
+
+    def test_list_all_fields(self):
+        request = self.factory.get("/courses/all/", {"fields": "subject_id,title"})
+        courses = self.response_json(views.list_all(request))
+        self.assertEqual(10, len(courses))
+        self.assertEqual({"subject_id": "2.001", "title": "Foo"}, courses[0])
+
+        request = self.factory.get("/courses/all/", {"fields": "subject_id,nonexistent"})
+        self.assertEqual(400, views.list_all(request).status_code)
+
+    def test_list_all_pages(self):
+        subject_ids = []
+        after = None
+        while True:
+            params = {"limit": "4", "fields": "subject_id"}
+            if after is not None:
+                params["after"] = after
+            result = self.response_json(views.list_all(self.factory.get("/courses/all/", params)))
+            self.assertTrue(len(result["courses"]) <= 4)
+            subject_ids += [course["subject_id"] for course in result["courses"]]
+            after = result["next"]
+            if after is None:
+                break
+        self.assertEqual(get_snapshot().subject_ids, subject_ids)
+        self.assertEqual(400, views.list_all(self.factory.get("/courses/all/", {"limit": "0"})).status_code)
+
+    def test_search_pages(self):
+        request = self.factory.get("/courses/search/", {"limit": "2", "after": "2.001", "fields": "subject_id"})
+        result = self.response_json(views.search(request, search_term="2.00"))
+        self.assertEqual({"courses": [{"subject_id": "2.002"}, {"subject_id": "2.003"}], "next": None}, result)
+
+        request = self.factory.get("/courses/search/", {"limit": "1", "type": "keywords"})
+        result = self.response_json(views.search(request, search_term="physics"))
+        self.assertEqual("8.01", result["courses"][0]["subject_id"])
+        request = self.factory.get("/courses/search/", {"after": "2.001", "type": "keywords"})
+        self.assertEqual(400, views.search(request, search_term="physics").status_code)
+
+    def test_autocomplete(self):
+        Course.objects.filter(subject_id="6.0001").update(enrollment_number=300.0, rating=4.0)
+        Course.objects.filter(subject_id="6.0002").update(enrollment_number=100.0, rating=6.0)
+        Course.objects.filter(subject_id="6.00").update(enrollment_number=200.0, rating=5.0)
+        invalidate()
+
+        def suggest(params):
+            request = self.factory.get("/courses/autocomplete/", params)
+            return [course[CourseFields.subject_id] for course in self.response_json(views.autocomplete(request))]
+
+        self.assertEqual(["6.0001", "6.00", "6.0002"], suggest({"q": "6.0"}))
+        self.assertEqual(["6.0002", "6.00", "6.0001"], suggest({"q": "intro", "sort": "rating"}))
+        self.assertEqual(["6.0001"], suggest({"q": "intro", "limit": "1"}))
+        self.assertEqual(["6.00", "6.0002"], suggest({"q": "Intro SCI"}))
+        self.assertEqual(["21M.030"], suggest({"q": "21m.8"}))
+        self.assertEqual(["2.001", "2.003"], suggest({"q": "fo"}))
+        self.assertEqual([], suggest({"q": "zzz"}))
+        self.assertEqual([], suggest({"q": ""}))
+        self.assertEqual(400, views.autocomplete(self.factory.get("/courses/autocomplete/", {"q": "6", "limit": "50"})).status_code)
+
+    def test_autocomplete_routing(self):
+        self.assertEqual(views.autocomplete, resolve("/courses/autocomplete/").func)
+        # Searching for the term "autocomplete" is still a search
+        match = resolve("/courses/search/autocomplete")
+        self.assertEqual(views.search, match.func)
+        self.assertEqual("autocomplete", match.kwargs["search_term"])
+
+    def test_decode_schedule(self):
+        sections = decode_schedule("Lecture,10-250/MWF/0/10,4-231/TR/0/1-2.30;Recitation,34-302/M/1/7-9 PM,TBA")
+        self.assertEqual(["Lecture", "Recitation"], [section.section_type for section in sections])
+        self.assertEqual(ScheduleOption("10-250", (ScheduleTime(0b10101, 20, 22),)), sections[0].options[0])
+        self.assertEqual(ScheduleOption("4-231", (ScheduleTime(0b01010, 26, 29),)), sections[0].options[1])
+        self.assertEqual(ScheduleOption("34-302", (ScheduleTime(0b00001, 38, 42),)), sections[1].options[0])
+        self.assertEqual(ScheduleOption(None, ()), sections[1].options[1])
+        self.assertEqual(2, len(lecture_masks(sections)))
+        self.assertEqual([], decode_schedule(None))
+
+    def test_schedule_slots(self):
+        course = Course.objects.get(subject_id="21M.030")
+        course.schedule = "Lecture,4-364/MW/0/9.30-11,4-364/MW/0/11-12.30;Recitation,TBA"
+        course.save()
+        self.assertEqual(3, ScheduleSlot.objects.filter(course=course).count())
+        self.assertEqual(decode_schedule(course.schedule), get_snapshot().schedules["21M.030"])
+
+        # Editing the schedule rewrites the slots
+        edited = Course.objects.get(subject_id="21M.030")
+        edited.schedule = "Lecture,1-190/F/0/3"
+        edited.save()
+        self.assertEqual(1, ScheduleSlot.objects.filter(course=course).count())
+        self.assertEqual(decode_schedule(edited.schedule), get_snapshot().schedules["21M.030"])
+        edited.schedule = course.schedule
+        edited.save()
+
+        response = views.schedule(self.factory.get("/courses/schedule/"), subject_id="21M.030")
+        result = self.response_json(response)
+        self.assertEqual("21M.030", result["subject_id"])
+        self.assertEqual(["Lecture", "Recitation"], [section["type"] for section in result["sections"]])
+        self.assertEqual({"days": "MW", "start": "9:30", "end": "11:00", "start_slot": 19, "end_slot": 22},
+                         result["sections"][0]["options"][0]["times"][0])
+        self.assertEqual([{"location": None, "times": []}], result["sections"][1]["options"])
+
+        response = views.schedule(self.factory.get("/courses/schedule/"), subject_id="2.001")
+        self.assertEqual([], self.response_json(response)["sections"])
+        self.assertEqual(404, views.schedule(self.factory.get("/courses/schedule/"), subject_id="9.999").status_code)
+
+    def test_schedule_routing(self):
+        self.assertEqual(views.schedule, resolve("/courses/schedule/2.001").func)
+        self.assertEqual(views.search, resolve("/courses/search/schedule/6").func)
+
+    def test_search_conflicts_with(self):
+        Course.objects.create(subject_id="2.004", title="Foo Baz", public=True,
+                              schedule="Lecture,1-190/MW/0/11").save()
+        Course.objects.create(subject_id="2.005", title="Foo Qux", public=True,
+                              schedule="Lecture,1-190/TR/0/11").save()
+        Course.objects.filter(subject_id="2.001").update(schedule="Lecture,1-390/W/0/12-1")
+        invalidate()
+
+        def search(conflicts_with):
+            request = self.factory.get("/courses/search/", {"conflicts_with": conflicts_with})
+            return [course[CourseFields.subject_id] for course in self.response_json(views.search(request, search_term="Foo"))]
+
+        self.assertEqual(["2.001", "2.003", "2.005"], search("2.004"))
+        # 21M.030 has lectures at 9.30-11 and 11-12.30 on MW, so either could be
+        # chosen unless the section is specified
+        self.assertEqual(["2.001", "2.003", "2.004", "2.005"], search("21M.030"))
+        self.assertEqual(["2.003", "2.005"], search("21M.030:1"))
+        self.assertEqual(["2.001", "2.003", "2.004", "2.005"], search("unknown"))
+        request = self.factory.get("/courses/search/", {"conflicts_with": "21M.030:2"})
+        self.assertEqual(400, views.search(request, search_term="Foo").status_code)
+
+    def test_filter_courses_invalid(self):
+        request = self.factory.get("/courses/filter/", {"gir": "foo"})
+        response = views.filter_courses(request)
+        self.assertEqual(400, response.status_code)
@@ -3,8 +3,12 @@ from django.conf.urls import url
 from . import views
 
 urlpatterns = [
+    url(r'^lookup_many/?$', views.lookup_many, name='lookup_many'),
+    url(r'^autocomplete/?$', views.autocomplete, name='autocomplete'),
     url(r'lookup/(?P<subject_id>[A-z0-9.]+)', views.lookup, name='lookup'),
     url(r'search/(?P<search_term>[^?]+)', views.search, name='search'),
+    url(r'^schedule/(?P<subject_id>[A-z0-9.]+)', views.schedule, name='schedule'),
     url(r'dept/(?P<dept>[A-z0-9.]+)', views.department, name='department'),
+    url(r'filter', views.filter_courses, name='filter_courses'),
     url(r'all', views.list_all, name='list_all')
 ]
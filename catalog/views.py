@@ -1,14 +1,30 @@
 from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
 from django.core.exceptions import ObjectDoesNotExist
 import os
 import json
-from .models import Course
-from django.db.models import Q
+import itertools
+from .models import Course, CourseFields
+from .snapshot import get_snapshot, join_json_list
+from .attribute_index import GIR_VALUES, HASS_VALUES
+from .autocomplete import MAX_SUGGESTIONS, RANKINGS
+from .schedule import schedule_json_object
+from common.responses import payload_response
 
 # Create your views here.
 TRUE_SET = {"true", "yes", "y", "t", "1"}
 
+# Maximum number of subject IDs that can be requested from lookup_many at once
+MAX_LOOKUP_COUNT = 500
+
+# Default and maximum number of courses in each page of a paginated response
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Names of the fields that can be requested with the "fields" parameter
+PROJECTABLE_FIELDS = set(value for key, value in vars(CourseFields).items() if not key.startswith("_"))
+
 def lookup(request, subject_id=None):
     """
     Provides a full JSON description of the course specified by the given subject
@@ -16,11 +32,137 @@ def lookup(request, subject_id=None):
     """
     if subject_id is None:
         return HttpResponseBadRequest("Provide a subject ID to look up a course.")
-    try:
-        c = Course.public_courses().get(subject_id=subject_id)
-        return HttpResponse(json.dumps(c.to_json_object()), content_type="application/json")
-    except ObjectDoesNotExist:
+    course_json = get_snapshot().course_json(subject_id, full=True)
+    if course_json is None:
+        return HttpResponseNotFound("No subject found with the given ID")
+    return HttpResponse(course_json, content_type="application/json")
+
+def schedule(request, subject_id=None):
+    """
+    Provides the decoded schedule of the course with the given subject ID, as
+    a dictionary with the subject ID and a list of the schedule's sections.
+    Each section has a type (such as "Lecture") and a list of options, each
+    of which has a location and a list of meeting times.
+    """
+    if subject_id is None:
+        return HttpResponseBadRequest("Provide a subject ID to look up a schedule.")
+    snapshot = get_snapshot()
+    if subject_id not in snapshot.courses:
         return HttpResponseNotFound("No subject found with the given ID")
+    sections = snapshot.schedules.get(subject_id, [])
+    return HttpResponse(json.dumps({"subject_id": subject_id, "sections": schedule_json_object(sections)}),
+                        content_type="application/json")
+
+def read_lookup_ids(request):
+    """Reads the list of subject IDs for lookup_many from the request, either
+    from a comma-separated "ids" GET parameter or from a POST body containing
+    a JSON list (or a dictionary with an "ids" list). Raises a ValueError if
+    the IDs are badly formatted."""
+    if request.method == 'POST':
+        body = json.loads(request.body)
+        if isinstance(body, dict):
+            body = body.get("ids")
+        if not isinstance(body, list) or not all(isinstance(s, basestring) for s in body):
+            raise ValueError
+        subject_ids = body
+    else:
+        subject_ids = request.GET.get("ids", "").split(",")
+
+    # Remove duplicates and empty IDs while keeping the requested order
+    result = []
+    seen = set()
+    for subject_id in subject_ids:
+        subject_id = subject_id.strip()
+        if len(subject_id) == 0 or subject_id in seen:
+            continue
+        seen.add(subject_id)
+        result.append(subject_id)
+    return result
+
+@csrf_exempt
+def lookup_many(request):
+    """
+    Provides JSON descriptions of several courses at once. The subject IDs can
+    be given as a comma-separated "ids" GET parameter, or as a JSON list in the
+    POST body. The response is a dictionary with two keys: "courses", which
+    maps each subject ID that was found to its JSON description, and "unknown",
+    a list of the subject IDs that are not in the catalog. If a boolean GET
+    parameter for "full" is specified, it will indicate whether the full JSON
+    description is included (as in lookup, the default is true).
+    """
+    try:
+        subject_ids = read_lookup_ids(request)
+    except ValueError:
+        return HttpResponseBadRequest("Provide a JSON list of subject IDs.")
+    if len(subject_ids) == 0:
+        return HttpResponseBadRequest("Provide one or more subject IDs to look up.")
+    if len(subject_ids) > MAX_LOOKUP_COUNT:
+        return HttpResponseBadRequest("Can't look up more than {} subjects at once.".format(MAX_LOOKUP_COUNT))
+
+    if "full" in request.GET:
+        full = request.GET["full"].lower() in TRUE_SET
+    else:
+        full = True
+
+    snapshot = get_snapshot()
+    found = []
+    unknown = []
+    for subject_id in subject_ids:
+        course_json = snapshot.course_json(subject_id, full=full)
+        if course_json is None:
+            unknown.append(subject_id)
+        else:
+            found.append(json.dumps(subject_id) + ": " + course_json)
+    body = '{"courses": {' + ", ".join(found) + '}, "unknown": ' + json.dumps(unknown) + '}'
+    return HttpResponse(body, content_type="application/json")
+
+def json_list_response(snapshot, subject_ids, full=False, fields=None):
+    """Returns a response that streams the JSON list of the given subjects
+    from the catalog snapshot in chunks, rather than building the whole body
+    in memory first."""
+    return StreamingHttpResponse(snapshot.iter_json_list(subject_ids, full=full, fields=fields), content_type="application/json")
+
+def read_fields(request):
+    """Returns the list of field names in the request's comma-separated
+    "fields" GET parameter, or None if it is not given. Raises a ValueError if
+    any field name is invalid."""
+    if "fields" not in request.GET:
+        return None
+    fields = []
+    for field in request.GET["fields"].split(","):
+        field = field.strip()
+        if field not in PROJECTABLE_FIELDS:
+            raise ValueError
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+def read_page(request):
+    """Returns a tuple (limit, after) read from the request's "limit" and
+    "after" GET parameters, or None if neither is given. after is the subject
+    ID after which the page starts, or None to start from the beginning.
+    Raises a ValueError if the limit is not a number between 1 and
+    MAX_PAGE_SIZE."""
+    if "limit" not in request.GET and "after" not in request.GET:
+        return None
+    limit = int(request.GET.get("limit", DEFAULT_PAGE_SIZE))
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError
+    return (limit, request.GET.get("after") or None)
+
+def page_response(snapshot, subject_ids, limit, full=False, fields=None, has_cursor=True):
+    """Returns a response containing a page of at most limit of the given
+    subjects, as a dictionary with the list of courses under "courses" and the
+    cursor for the next page under "next" (or null if this is the last page).
+    If has_cursor is False, "next" is always null."""
+    page = list(itertools.islice(subject_ids, limit + 1))
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        if has_cursor:
+            next_cursor = page[-1]
+    body = '{"courses": ' + join_json_list(snapshot.json_items(page, full=full, fields=fields)) + ', "next": ' + json.dumps(next_cursor) + '}'
+    return HttpResponse(body, content_type="application/json")
 
 def department(request, dept=None):
     """
@@ -34,157 +176,268 @@ def department(request, dept=None):
         full = request.GET["full"].lower() in TRUE_SET
     else:
         full = False
-    courses = Course.public_courses().filter(subject_id__startswith=dept + ".").order_by("subject_id")
-    return HttpResponse(json.dumps([c.to_json_object(full=full) for c in courses]), content_type="application/json")
+    snapshot = get_snapshot()
+    subject_ids = snapshot.department_subject_ids(dept)
+    return json_list_response(snapshot, subject_ids, full=full)
 
 def list_all(request):
     """
     Provides a list of JSON descriptions of all courses in the database. If a
     boolean GET parameter for "full" is specified, it will indicate whether the
     full JSON description is included.
+
+    The response is precomputed once per catalog generation, is compressed
+    with gzip or brotli if the client accepts it, and carries an ETag so that
+    clients with an up-to-date copy receive a 304 response.
+
+    The "fields" parameter, a comma-separated list of field names, limits
+    each course to those fields. Specifying a "limit" and/or "after" (a
+    subject ID) returns a page of courses in subject ID order instead (see
+    page_response). Neither kind of response is precomputed.
     """
     if "full" in request.GET:
         full = request.GET["full"].lower() in TRUE_SET
     else:
         full = False
-    return HttpResponse(json.dumps([c.to_json_object(full=full) for c in Course.public_courses().order_by("subject_id")]), content_type="application/json")
+    try:
+        fields = read_fields(request)
+        page = read_page(request)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid fields or page parameters")
+
+    snapshot = get_snapshot()
+    if page is not None:
+        limit, after = page
+        start = snapshot.ordinal_after(after) if after is not None else 0
+        return page_response(snapshot, itertools.islice(snapshot.subject_ids, start, None), limit, full=full, fields=fields)
+    elif fields is not None:
+        return json_list_response(snapshot, snapshot.subject_ids, fields=fields)
+    return payload_response(request, snapshot.all_payload(full=full))
+
+def autocomplete(request):
+    """
+    Suggests courses for a partially typed query, given as the "q" GET
+    parameter. Each word of the query is matched against the beginnings of
+    the subject ID, joint subject IDs and title words of each course. The
+    following GET parameters are also available:
+
+    sort: How to rank the suggestions. Possible values: "enrollment"
+        (default), "rating"
+    limit: The maximum number of suggestions, at most MAX_SUGGESTIONS
+        (default 10)
+    fields: Comma-separated list of the fields to return for each course
+        (by default, the basic course description is returned)
+    """
+    ranking = request.GET.get("sort", "enrollment")
+    if ranking not in RANKINGS:
+        return HttpResponseBadRequest("Invalid sort value")
+    try:
+        limit = int(request.GET.get("limit", 10))
+        fields = read_fields(request)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid limit or fields")
+    if limit < 1 or limit > MAX_SUGGESTIONS:
+        return HttpResponseBadRequest("Limit must be between 1 and {}".format(MAX_SUGGESTIONS))
 
-def offered_filter(offered_value):
-    """Constructs a Q filter based on the given offered value, or throws a
-    ValueError if the value is inappropriate."""
+    snapshot = get_snapshot()
+    ordinals = snapshot.autocomplete_index.suggest(request.GET.get("q", ""), ranking=ranking, limit=limit)
+    items = snapshot.json_items((snapshot.subject_ids[i] for i in ordinals), fields=fields)
+    return HttpResponse(join_json_list(items), content_type="application/json")
+
+def offered_filter(index, offered_value):
+    """Returns the bitmap of courses in the given attribute index that pass the
+    given offered value, None if the filter is off, or throws a ValueError if
+    the value is inappropriate."""
     offered_value = offered_value.lower()
     if offered_value == "off":
         return None
-    elif offered_value == "fall":
-        return Q(offered_fall=True)
-    elif offered_value == "spring":
-        return Q(offered_spring=True)
-    elif offered_value == "iap":
-        return Q(offered_IAP=True)
-    elif offered_value == "summer":
-        return Q(offered_summer=True)
+    elif offered_value in {"fall", "spring", "iap", "summer"}:
+        return index.bitmap("offered", offered_value)
     else:
         raise ValueError
 
-def level_filter(level_value):
-    """Constructs a Q filter based on the given level value, or throws a
-    ValueError if the value is inappropriate."""
+def level_filter(index, level_value):
+    """Returns the bitmap of courses in the given attribute index that pass the
+    given level value, None if the filter is off, or throws a ValueError if the
+    value is inappropriate."""
     level_value = level_value.lower()
     if level_value == "off":
         return None
-    elif level_value == "undergrad":
-        return Q(level="U")
-    elif level_value == "grad":
-        return Q(level="G")
+    elif level_value in {"undergrad", "grad"}:
+        return index.bitmap("level", level_value)
     else:
         raise ValueError
 
-def ci_filter(ci_value):
-    """Constructs a Q filter based on the given CI value, or throws a
-    ValueError if the value is inappropriate."""
+def ci_filter(index, ci_value):
+    """Returns the bitmap of courses in the given attribute index that pass the
+    given CI value, None if the filter is off, or throws a ValueError if the
+    value is inappropriate."""
     ci_value = ci_value.lower()
     if ci_value == "off":
         return None
-    elif ci_value == "cih":
-        return Q(communication_requirement="CI-H")
-    elif ci_value == "cihw":
-        return Q(communication_requirement="CI-HW")
-    elif ci_value == "not-ci":
-        return Q(communication_requirement__isnull=True) | Q(communication_requirement="")
+    elif ci_value in {"cih", "cihw", "not-ci"}:
+        return index.bitmap("ci", ci_value)
     else:
         raise ValueError
 
-def hass_filter(hass_value):
-    """Constructs a Q filter based on the given HASS value, or throws a
-    ValueError if the value is inappropriate."""
+def hass_filter(index, hass_value):
+    """Returns the bitmap of courses in the given attribute index that pass the
+    given HASS value, None if the filter is off, or throws a ValueError if the
+    value is inappropriate."""
     hass_value = hass_value.lower()
     if hass_value == "off":
         return None
-    elif hass_value == "any":
-        return ~Q(hass_attribute="")
-    elif hass_value in {"a", "s", "h"}:
-        return Q(hass_attribute__icontains="HASS-" + hass_value.upper())
+    elif hass_value == "any" or hass_value in HASS_VALUES:
+        return index.bitmap("hass", hass_value)
     else:
         raise ValueError
 
-def gir_filter(gir_value):
-    """Constructs a Q filter based on the given GIR value, or throws a
-    ValueError if the value is inappropriate."""
+def gir_filter(index, gir_value):
+    """Returns the bitmap of courses in the given attribute index that pass the
+    given GIR value, None if the filter is off, or throws a ValueError if the
+    value is inappropriate."""
     gir_value = gir_value.lower()
     if gir_value == "off":
         return None
-    elif gir_value == "any":
-        return ~Q(gir_attribute="")
-    elif gir_value in {"lab", "rest"}:
-        return Q(gir_attribute=gir_value.upper())
+    elif gir_value == "any" or gir_value in GIR_VALUES:
+        return index.bitmap("gir", gir_value)
     else:
         raise ValueError
 
-def construct_search_query(search_term, type):
-    """Constructs a Q filter based on the given search term, using the given
-    search type (contains, matches, etc.)."""
-    if type == "contains":
-        return Q(subject_id__icontains=search_term) | Q(title__icontains=search_term)
-    elif type == "matches":
-        return Q(subject_id__iexact=search_term) | Q(title__iexact=search_term)
-    elif type == "starts":
-        return Q(subject_id__istartswith=search_term) | Q(title__istartswith=search_term)
-    elif type == "ends":
-        return Q(subject_id__iendswith=search_term) | Q(title__iendswith=search_term)
-    else:
-        raise ValueError
+def conflicts_filter(index, conflicts_value):
+    """Returns the bitmap of courses in the given attribute index that have a
+    lecture time that does not conflict with the given comma-separated list
+    of subject IDs, or None if the list is empty. A subject ID may be followed
+    by a colon and the index of one of the subject's lecture options, to
+    specify the lecture section that the student has selected. Throws a
+    ValueError if a lecture option is invalid."""
+    busy = 0
+    for item in conflicts_value.split(","):
+        comps = item.strip().split(":")
+        if len(comps) > 2 or len(comps[0]) == 0:
+            continue
+        busy |= index.busy_mask(comps[0], int(comps[1]) if len(comps) == 2 else None)
+    if busy == 0:
+        return None
+    return index.conflict_free_bitmap(busy)
 
+SEARCH_FILTERS = [
+    ("offered", offered_filter),
+    ("level", level_filter),
+    ("gir", gir_filter),
+    ("hass", hass_filter),
+    ("ci", ci_filter),
+    ("conflicts_with", conflicts_filter)
+]
+
+def filter_bitmap(request, index):
+    """Combines the filters given in the request's GET parameters into a single
+    bitmap over the given attribute index, or returns None if no filters are
+    active. Throws a ValueError if any filter value is inappropriate."""
+    result = None
+    for name, filter_func in SEARCH_FILTERS:
+        if name not in request.GET:
+            continue
+        bitmap = filter_func(index, request.GET[name])
+        if bitmap is None:
+            continue
+        result = bitmap if result is None else result & bitmap
+    return result
+
+def filter_courses(request):
+    """
+    Provides a list of JSON descriptions of the courses that pass the filters
+    given as GET parameters, in subject ID order. The filters are the same as
+    for search (gir, hass, ci, offered, level and conflicts_with), and no search term is
+    needed. If a boolean GET parameter for "full" is specified, it will
+    indicate whether the full JSON description is included.
+    """
+    snapshot = get_snapshot()
+    index = snapshot.attribute_index
+    try:
+        bitmap = filter_bitmap(request, index)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid filter value")
+    if bitmap is None:
+        bitmap = index.all_bits
+
+    if "full" in request.GET:
+        full = request.GET["full"].lower() in TRUE_SET
+    else:
+        full = False
+    subject_ids = (snapshot.subject_ids[i] for i in index.ordinals(bitmap))
+    return json_list_response(snapshot, subject_ids, full=full)
 
 def search(request, search_term=None):
     """
-    Searches the catalog database for courses matching the given search term.
+    Searches the catalog for courses matching the given search term.
     The following case-insensitive GET parameter options are available:
 
     type: The match type to use with the search term. Possible values: "contains"
-        (default), "matches", "starts", "ends"
-    gir: Whether to filter by GIR. Possible values: "off" (default), "any", "lab",
-        "rest"
+        (default), "matches", "starts", "ends", "keywords". The keywords type
+        matches each word of the search term against the beginnings of words
+        in the subject ID, joint and equivalent subjects, title, instructors
+        and description, and sorts the results by relevance.
+    gir: Whether to filter by GIR. Possible values: "off" (default), "any", or
+        a GIR code such as "lab", "rest", "phy1", "cal2"
     hass: Whether to filter by HASS fulfillment. Possible values: "off" (default),
-        "any", "a", "s", "h"
+        "any", "a", "s", "h", "e"
     ci: Whether to filter by CI fulfillment. Possible values: "off" (default),
         "cih", "cihw", "not-ci"
     offered: Which semester the course is offered. Possible values: "off"
         (default), "fall", "spring", "IAP", "summer"
     level: The level of the course. Possible values: "off" (default), "undergrad",
         "grad"
+    conflicts_with: Comma-separated list of subject IDs whose lectures the
+        results must not conflict with. A subject ID can be followed by a
+        colon and the index of a lecture option (e.g. "6.0001:1") to use only
+        that lecture section. Courses whose lecture options all overlap these
+        lectures are excluded.
     full: Boolean indicating whether to return the full course description.
         Possible values: "n" (default), "y"
-
-    TODO: search fields, schedule conflicts
+    fields: Comma-separated list of the fields to return for each course,
+        overriding full.
+    limit, after: Return a page of at most limit results, starting after the
+        subject ID given by after (see page_response). Keyword searches are
+        sorted by relevance rather than subject ID, so they only support limit.
     """
     if search_term is None:
         return HttpResponseBadRequest("Must provide a search term.")
 
+    snapshot = get_snapshot()
+    index = snapshot.search_index
     try:
-        # Construct query
-        query = construct_search_query(search_term, request.GET.get("type", "contains"))
-        if "offered" in request.GET:
-            filter = offered_filter(request.GET["offered"])
-            if filter is not None: query &= filter
-        if "level" in request.GET:
-            filter = level_filter(request.GET["level"])
-            if filter is not None: query &= filter
-        if "gir" in request.GET:
-            filter = gir_filter(request.GET["gir"])
-            if filter is not None: query &= filter
-        if "hass" in request.GET:
-            filter = hass_filter(request.GET["hass"])
-            if filter is not None: query &= filter
-        if "ci" in request.GET:
-            filter = ci_filter(request.GET["ci"])
-            if filter is not None: query &= filter
+        bitmap = filter_bitmap(request, snapshot.attribute_index)
     except ValueError:
         return HttpResponseBadRequest("Invalid filter value")
+    candidates = snapshot.attribute_index.ordinals(bitmap) if bitmap is not None else None
+
+    search_type = request.GET.get("type", "contains")
+    try:
+        fields = read_fields(request)
+        page = read_page(request)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid fields or page parameters")
+    if page is not None and page[1] is not None:
+        if search_type == "keywords":
+            return HttpResponseBadRequest("Keyword searches can't be paginated with a cursor")
+        # Only consider the courses after the cursor
+        start = snapshot.ordinal_after(page[1])
+        candidates = [i for i in candidates if i >= start] if candidates is not None else range(start, len(snapshot.subject_ids))
+
+    try:
+        if search_type == "keywords":
+            results = index.keyword_search(search_term, set(candidates) if candidates is not None else None)
+        else:
+            results = index.match_search(search_term, search_type, candidates)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid search type")
 
-    # Search by query
-    results = Course.public_courses().filter(query)
     if "full" in request.GET:
         full = request.GET["full"].lower() in TRUE_SET
     else:
         full = False
-    return HttpResponse(json.dumps([c.to_json_object(full=full) for c in results]), content_type="application/json")
+    subject_ids = (index.subject_ids[i] for i in results)
+    if page is not None:
+        return page_response(snapshot, subject_ids, page[0], full=full, fields=fields, has_cursor=(search_type != "keywords"))
+    return json_list_response(snapshot, subject_ids, full=full, fields=fields)
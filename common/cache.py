@@ -0,0 +1,69 @@
+"""
+A small in-process cache with a bounded size and per-item expiry, for values
+that are expensive to compute but only need to live in one server process.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache(object):
+    """A thread-safe dictionary that holds at most max_size items, evicting the
+    least recently used item when it is full. Each item expires ttl seconds
+    after it is set (or never, if ttl is None).
+
+    hits, misses: the number of calls to get() that found and did not find an
+    unexpired item, respectively.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the unexpired value for the given key, or default."""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None or (item[0] is not None and item[0] <= time.time()):
+                self.misses += 1
+                return default
+            # Reinsert the item to mark it as the most recently used
+            self._items[key] = item
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        """Stores the value for the given key. If ttl is not None, the item
+        expires after the smaller of ttl and the cache's ttl."""
+        if ttl is None or (self.ttl is not None and self.ttl < ttl):
+            ttl = self.ttl
+        expiry = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (expiry, value)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """Returns a dictionary describing the cache's size and hit rate."""
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
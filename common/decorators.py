@@ -1,7 +1,7 @@
 import base64
 
 from django.http import HttpResponse
-from django.contrib.auth import authenticate, login
+from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from django.shortcuts import render, redirect
 from django.conf import settings
@@ -11,6 +11,8 @@ from .models import Student, APIClient
 import json
 from .token_gen import *
 
+# If True, requests must authenticate with an Authorization header even if
+# they have a logged-in session
 ALWAYS_LOGIN = False
 
 def user_has_student(user):
@@ -28,42 +30,44 @@ def view_or_basicauth(view, request, test_func, realm = "", *args, **kwargs):
     and returning the view if all goes well, otherwise responding with a 401.
     """
 
-    if request.user is None or not request.user.is_authenticated() or not user_has_student(request.user) or ALWAYS_LOGIN:
-        key = 'HTTP_AUTHORIZATION'
-        if key not in request.META:
-            key = 'REDIRECT_HTTP_AUTHORIZATION'
-        if key not in request.META:
-            key = 'HTTP_X_AUTHORIZATION'
-        if key in request.META:
-            auth = request.META[key].split()
-            if len(auth) == 2:
-                if auth[0].lower() == "basic":
-                    # Basic authentication - this is not an API client
-                    uname, passwd = base64.b64decode(auth[1]).split(':')
-                    user = authenticate(username=uname, password=passwd)
-                    permissions = APIClient.universal_permission_flag()
-                elif auth[0].lower() == "bearer":
-                    # The client bears a FireRoad-issued token
-                    user, permissions, error = extract_token_info(request, auth[1])
-                    if error is not None:
-                        return HttpResponse(json.dumps(error), status=401, content_type="application/json")
-                    user.backend = 'django.contrib.auth.backends.ModelBackend'
-                else:
-                    raise PermissionDenied
+    # API clients authenticate with a header on every request, so check it
+    # before the session, which is only needed for browser logins
+    key = 'HTTP_AUTHORIZATION'
+    if key not in request.META:
+        key = 'REDIRECT_HTTP_AUTHORIZATION'
+    if key not in request.META:
+        key = 'HTTP_X_AUTHORIZATION'
+    if key in request.META:
+        auth = request.META[key].split()
+        if len(auth) == 2:
+            if auth[0].lower() == "basic":
+                # Basic authentication - this is not an API client
+                uname, passwd = base64.b64decode(auth[1]).split(':')
+                user = authenticate(username=uname, password=passwd)
+                permissions = APIClient.universal_permission_flag()
+            elif auth[0].lower() == "bearer":
+                # The client bears a FireRoad-issued token
+                user, permissions, error = verify_token(request, auth[1])
+                if error is not None:
+                    return HttpResponse(json.dumps(error), status=401, content_type="application/json")
+            else:
+                raise PermissionDenied
 
-                request.session['permissions'] = permissions
-                if user is not None:
-                    if user.is_active:
-                        login(request, user)
-                        request.user = user
-                        return view(request, *args, **kwargs)
+            # The credentials are checked on every request, so there is no
+            # need to log in and store the user and permissions in the session
+            if user is not None and user.is_active:
+                request.user = user
+                request.permissions = APIClient.from_permissions_flag(permissions)
+                return view(request, *args, **kwargs)
+        raise PermissionDenied
+
+    if ALWAYS_LOGIN or request.user is None or not request.user.is_authenticated() or not user_has_student(request.user):
         raise PermissionDenied
         #return redirect('login')
-    else:
-        if 'permissions' not in request.session:
-            print("Setting universal permission flag - this should only occur in dev or from FireRoad-internal login.")
-            request.session['permissions'] = APIClient.universal_permission_flag()
-        return view(request, *args, **kwargs)
+
+    # Browser logins are made through the FireRoad site, so they have every permission
+    request.permissions = APIClient.from_permissions_flag(request.session.get('permissions', APIClient.universal_permission_flag()))
+    return view(request, *args, **kwargs)
 
 #############################################################################
 #
@@ -129,18 +133,18 @@ def has_perm_or_basicauth(perm, realm = ""):
     return view_decorator
 
 def require_token_permissions(*permission_names):
-    """Decorator that makes sure that the request has a permissions flag that permits the
-    given permission names."""
+    """Decorator that makes sure that the request has permissions (an APIClient
+    object set by logged_in_or_basicauth) that permit the given permission names."""
     def view_decorator(view_func):
         def wrapper(request, *args, **kwargs):
             # Passthrough for dev server and local testing
             if not settings.RESTRICT_AUTH_REDIRECTS and settings.DEBUG:
                 return view_func(request, *args, **kwargs)
 
-            if not request.session["permissions"]:
-                print("Session object has no permissions set")
+            permissions = getattr(request, "permissions", None)
+            if permissions is None:
+                print("Request has no permissions set")
                 raise PermissionDenied
-            permissions = APIClient.from_permissions_flag(request.session["permissions"])
             for p_name in permission_names:
                 try:
                     if not getattr(permissions, p_name):
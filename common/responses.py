@@ -0,0 +1,95 @@
+"""
+Helpers for serving response bodies that are computed ahead of time, such as
+the full course catalog. Each body is compressed once when it is built, and
+carries a strong entity tag so that clients that already have the current
+version get a 304 Not Modified response.
+"""
+
+import gzip
+import hashlib
+import io
+
+from django.http import HttpResponse, HttpResponseNotModified
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODING_IDENTITY = "identity"
+ENCODING_GZIP = "gzip"
+ENCODING_BROTLI = "br"
+
+# Encodings to use when the client accepts several, most preferred first
+PREFERRED_ENCODINGS = [ENCODING_BROTLI, ENCODING_GZIP]
+
+def gzip_compress(content):
+    """Compresses the given bytes with gzip, using a fixed modification time so
+    that the output only depends on the content."""
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9, mtime=0) as file:
+        file.write(content)
+    return buf.getvalue()
+
+class EncodedPayload(object):
+    """A serialized response body along with its compressed versions and an
+    entity tag for each encoding.
+
+    The entity tags are derived from the given version string and a digest of
+    the content, so they change whenever either does."""
+
+    def __init__(self, content, version):
+        if isinstance(content, unicode):
+            content = content.encode("utf-8")
+        self.encodings = {
+            ENCODING_IDENTITY: content,
+            ENCODING_GZIP: gzip_compress(content)
+        }
+        if brotli is not None:
+            self.encodings[ENCODING_BROTLI] = brotli.compress(content)
+
+        digest = hashlib.sha1(content).hexdigest()[:16]
+        self.etags = {encoding: '"{}-{}-{}"'.format(version, digest, encoding) for encoding in self.encodings}
+
+    def matches(self, if_none_match):
+        """Returns whether the given If-None-Match header value refers to any
+        encoding of this payload."""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        tags = set(tag.strip() for tag in if_none_match.split(","))
+        tags = set(tag[2:] if tag.startswith("W/") else tag for tag in tags)
+        return any(etag in tags for etag in self.etags.values())
+
+def accepted_encoding(request, available):
+    """Returns the most preferred encoding in available that is acceptable
+    according to the request's Accept-Encoding header."""
+    accepted = set()
+    for item in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        comps = [comp.strip() for comp in item.split(";")]
+        if not comps[0]:
+            continue
+        if any(param.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000") for param in comps[1:]):
+            continue
+        accepted.add(comps[0].lower())
+    for encoding in PREFERRED_ENCODINGS:
+        if encoding in available and encoding in accepted:
+            return encoding
+    return ENCODING_IDENTITY
+
+def payload_response(request, payload, content_type="application/json"):
+    """Returns a response for the given EncodedPayload, choosing an encoding
+    the client accepts, or a 304 response if the client's If-None-Match header
+    matches the payload."""
+    encoding = accepted_encoding(request, payload.encodings)
+    etag = payload.etags[encoding]
+    if payload.matches(request.META.get("HTTP_IF_NONE_MATCH")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(payload.encodings[encoding], content_type=content_type)
+        if encoding != ENCODING_IDENTITY:
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    response["Vary"] = "Accept-Encoding"
+    return response
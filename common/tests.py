@@ -1,3 +1,69 @@
 from django.test import TestCase
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from .models import Student, APIClient
+from . import decorators
+from .token_gen import generate_token, verified_tokens
+import base64
+import json
 
-# Create your tests here.
+
+class TokenAuthTest(TestCase):
+    """Tests authentication with bearer tokens, basic authentication and sessions."""
+
+    def setUp(self):
+        verified_tokens.clear()
+        self.user = User.objects.create_user(username="testuser", password="password")
+        Student.objects.create(user=self.user, academic_id="test@mit.edu", current_semester="3", name="Test User")
+
+    def bearer_get(self, path, token):
+        return self.client.get(path, HTTP_AUTHORIZATION="Bearer " + token)
+
+    def test_bearer_is_stateless(self):
+        token = generate_token(None, self.user, 60 * 60)
+        hits = verified_tokens.hits
+        for i in range(2):
+            response = self.bearer_get("/user_info/", token)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content)["academic_id"], "test@mit.edu")
+        self.assertEqual(verified_tokens.hits, hits + 1)
+        self.assertEqual(Session.objects.count(), 0)
+
+    def test_bearer_permissions(self):
+        client = APIClient(name="Test", can_view_student_info=True)
+        token = generate_token(None, self.user, 60 * 60, api_client=client)
+        self.assertEqual(self.bearer_get("/user_info/", token).status_code, 403)
+
+    def test_bearer_invalid(self):
+        token = generate_token(None, self.user, -60)
+        response = self.bearer_get("/user_info/", token)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.content)["error"], "expired")
+
+        token = generate_token(None, self.user, 60 * 60)
+        self.assertEqual(self.bearer_get("/user_info/", token).status_code, 200)
+        self.user.delete()
+        response = self.bearer_get("/user_info/", token)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.content)["error"], "invalid_user")
+
+    def test_basic_and_session_auth(self):
+        credentials = base64.b64encode("testuser:password")
+        response = self.client.get("/user_info/", HTTP_AUTHORIZATION="Basic " + credentials)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Session.objects.count(), 0)
+
+        # Browser logins have every permission, without storing them in the session
+        self.client.login(username="testuser", password="password")
+        session = Session.objects.get().get_decoded()
+        self.assertEqual(self.client.get("/user_info/").status_code, 200)
+        self.assertEqual(Session.objects.get().get_decoded(), session)
+
+        # ALWAYS_LOGIN requires the header even with a session
+        decorators.ALWAYS_LOGIN = True
+        try:
+            self.assertEqual(self.client.get("/user_info/").status_code, 403)
+            response = self.client.get("/user_info/", HTTP_AUTHORIZATION="Basic " + credentials)
+            self.assertEqual(response.status_code, 200)
+        finally:
+            decorators.ALWAYS_LOGIN = False
@@ -1,6 +1,7 @@
 import jwt
 import json
 import os
+import hashlib
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.utils.dateparse import parse_datetime
@@ -10,9 +11,20 @@ import datetime
 from oauth_client import generate_random_string, LOGIN_TIMEOUT
 from .models import TemporaryCode, APIClient
 from django.core.exceptions import PermissionDenied
+from common.cache import LRUCache
 
 FIREROAD_ISSUER = 'com.base12innovations.fireroad-server'
 
+# Maximum number of verified tokens to remember in each process
+MAX_VERIFIED_TOKENS = 10000
+
+# Maximum number of seconds to remember each verified token (tokens are also
+# forgotten when they expire)
+VERIFIED_TOKEN_TIMEOUT = 10 * 60
+
+# Maps the digest of each verified token to a tuple (user pk, permissions flag)
+verified_tokens = LRUCache(MAX_VERIFIED_TOKENS, ttl=VERIFIED_TOKEN_TIMEOUT)
+
 def get_aware_datetime(date_str):
     ret = parse_datetime(date_str)
     if not is_aware(ret):
@@ -36,31 +48,68 @@ def generate_token(request, user, expire_time, api_client=None):
     encoded = jwt.encode(payload, settings.SECRET_KEY, algorithm='HS256')
     return encoded
 
-def extract_token_info(request, token):
+def decode_token(token):
     """Decodes the given JWT token and determines if it is valid. If so, returns
-    the user associated with that token, an integer flag representing the permissions granted,
-    and an error object of None. If not, returns None, None, and a dictionary explaining the error."""
+    the username associated with that token, an integer flag representing the
+    permissions granted, the expiry date of the token, and an error object of
+    None. If not, returns None, None, None, and a dictionary explaining the error."""
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
     except:
-        return None, None, {'error': 'decode_error', 'error_description': 'The token could not be decoded'}
+        return None, None, None, {'error': 'decode_error', 'error_description': 'The token could not be decoded'}
     try:
         if payload['iss'] != FIREROAD_ISSUER:
-            return None, None, {'error': 'invalid_issuer', 'error_description': 'The issuer of this token does not have the correct value'}
+            return None, None, None, {'error': 'invalid_issuer', 'error_description': 'The issuer of this token does not have the correct value'}
         date = get_aware_datetime(payload['expires'])
         if date < timezone.now():
-            return None, None, {'error': 'expired', 'error_description': 'The token has expired'}
+            return None, None, None, {'error': 'expired', 'error_description': 'The token has expired'}
         username = payload['username']
 
         permissions = payload['permissions']
     except KeyError:
-        return None, None, {'error': 'incomplete_token', 'error_description': 'The token is missing one or more keys'}
+        return None, None, None, {'error': 'incomplete_token', 'error_description': 'The token is missing one or more keys'}
+
+    return username, permissions, date, None
+
+INVALID_USER_ERROR = {'error': 'invalid_user', 'error_description': 'The token represents a non-existent user'}
+
+def extract_token_info(request, token):
+    """Decodes the given JWT token and determines if it is valid. If so, returns
+    the user associated with that token, an integer flag representing the permissions granted,
+    and an error object of None. If not, returns None, None, and a dictionary explaining the error."""
+    username, permissions, expiry, error = decode_token(token)
+    if error is not None:
+        return None, None, error
 
     try:
         user = User.objects.get(username=username)
     except:
-        return None, None, {'error': 'invalid_user', 'error_description': 'The token represents a non-existent user'}
+        return None, None, INVALID_USER_ERROR
+
+    return user, permissions, None
 
+def verify_token(request, token):
+    """Behaves like extract_token_info, but remembers tokens that have been
+    verified (until they expire) so that they do not need to be decoded
+    again."""
+    key = hashlib.sha256(token).hexdigest()
+    cached = verified_tokens.get(key)
+    if cached is not None:
+        user_pk, permissions = cached
+        try:
+            return User.objects.get(pk=user_pk), permissions, None
+        except User.DoesNotExist:
+            verified_tokens.delete(key)
+            return None, None, INVALID_USER_ERROR
+
+    username, permissions, expiry, error = decode_token(token)
+    if error is not None:
+        return None, None, error
+    try:
+        user = User.objects.get(username=username)
+    except:
+        return None, None, INVALID_USER_ERROR
+    verified_tokens.set(key, (user.pk, permissions), ttl=(expiry - timezone.now()).total_seconds())
     return user, permissions, None
 
 def save_temporary_code(access_info):
@@ -26,6 +26,14 @@ with open(os.path.join(os.path.dirname(__file__), 'secret.txt')) as f:
 
 DEBUG = True
 
+# If True, request analytics are written to the database in batches by a
+# background thread. Otherwise they are only written when
+# analytics.request_counter.request_log.flush() is called. The test runner
+# below turns this off.
+ANALYTICS_BACKGROUND_WRITER = True
+
+TEST_RUNNER = 'fireroad.test_runner.TestRunner'
+
 # Constructing URLs
 
 ALLOWED_HOSTS = ['localhost', 'lvh.me']
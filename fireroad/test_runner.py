@@ -0,0 +1,20 @@
+"""
+The test runner for the FireRoad server.
+"""
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+class TestRunner(DiscoverRunner):
+    """Runs the tests with the request analytics written only when a test
+    flushes them, since a background writer thread would write to the test
+    database outside of each test's transaction."""
+
+    def setup_test_environment(self, **kwargs):
+        super(TestRunner, self).setup_test_environment(**kwargs)
+        self._analytics_background_writer = settings.ANALYTICS_BACKGROUND_WRITER
+        settings.ANALYTICS_BACKGROUND_WRITER = False
+
+    def teardown_test_environment(self, **kwargs):
+        settings.ANALYTICS_BACKGROUND_WRITER = self._analytics_background_writer
+        super(TestRunner, self).teardown_test_environment(**kwargs)
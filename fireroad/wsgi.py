@@ -7,6 +7,7 @@ For more information on this file, see
 https://docs.djangoproject.com/en/2.0/howto/deployment/wsgi/
 """
 
+import logging
 import os
 import sys
 
@@ -18,3 +19,13 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fireroad.settings")
 
 application = get_wsgi_application()
+
+# Load the catalog snapshot and requirements lists before the first request comes in
+from django.db import DatabaseError
+from catalog.snapshot import get_snapshot
+from requirements.compiled import get_compiled_requirements
+try:
+    get_snapshot()
+    get_compiled_requirements()
+except DatabaseError:
+    logging.getLogger(__name__).exception("Couldn't load the catalog snapshot or requirements lists at startup - they will be loaded on the first request.")
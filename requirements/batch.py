@@ -0,0 +1,468 @@
+"""
+Vectorized evaluation of one requirements list against many roads.
+
+RequirementsProgress evaluates a single road by recursing over an object per
+statement. For dashboards and analytics that evaluate a list against
+thousands of roads, a BatchEvaluator flattens the compiled list into an array
+of nodes in topological order (children before their parents) and evaluates
+each node for every road at once with NumPy, from a roads x courses incidence
+matrix counting how many times each course appears in each road.
+
+The results match RequirementsProgress.compute on the same roads, with each
+road's subjects in the given order as in requirements.views, including
+thresholds, distinct thresholds and manual progress overrides. Overrides
+must be integers. The order of a road matters for requirements that need
+only one course, whose units come from the first satisfying course in the
+road, so the position of each course in each road is tracked alongside the
+incidence matrix.
+"""
+
+import numpy as np
+
+from catalog.models import Course
+from catalog.snapshot import get_snapshot
+from .reqlist import *
+from .compiled import CompiledStatement, compile_statement
+from .progress import SatisfierMap, resolve_courses
+
+# Position of a course that is not in a road
+NO_POSITION = np.iinfo(np.int64).max
+
+def ceiling(progress, maximum):
+    """Vectorized version of progress.ceiling_thresh, returning the clipped
+    progress."""
+    effective_progress = np.maximum(progress, 0)
+    return np.where(maximum > 0, np.minimum(effective_progress, maximum), effective_progress)
+
+def is_satisfied_by(threshold, subject_progress, unit_progress):
+    """Vectorized version of Threshold.is_satisfied_by."""
+    progress = unit_progress if threshold.criterion == CRITERION_UNITS else subject_progress
+    actual_cutoff = threshold.get_actual_cutoff()
+    if threshold.type == THRESHOLD_TYPE_LT or threshold.type == THRESHOLD_TYPE_LTE:
+        return progress <= actual_cutoff
+    elif threshold.type == THRESHOLD_TYPE_GT or threshold.type == THRESHOLD_TYPE_GTE:
+        return progress >= actual_cutoff
+    return np.zeros(progress.shape, dtype=bool)
+
+class BatchNode(object):
+    """A statement in the flattened requirements list.
+
+    statement: the CompiledStatement for this node.
+    list_path: the statement's path, as used by progress overrides.
+    children: the indexes of the child nodes, which precede this node.
+    """
+
+    __slots__ = ("statement", "list_path", "children", "threshold", "distinct_threshold")
+
+    def __init__(self, statement, list_path, children):
+        self.statement = statement
+        self.list_path = list_path
+        self.children = children
+        self.threshold = statement.get_threshold()
+        self.distinct_threshold = statement.get_distinct_threshold()
+
+    @property
+    def is_manual(self):
+        """Whether progress overrides can apply to this node."""
+        return self.statement.requirement is not None and self.statement.is_plain_string and self.threshold is not None
+
+class NodeResult(object):
+    """The evaluated state of one node for every road, as arrays indexed by
+    road. member is a boolean roads x courses matrix of the courses in the
+    node's set of satisfied courses, and dummies is the number of placeholder
+    courses from progress overrides in that set. count, units and max_units
+    describe the node's list of satisfied courses, which for leaves may
+    contain a course more than once."""
+
+    __slots__ = ("fulfilled", "subject_progress", "subject_max", "unit_progress", "unit_max",
+                 "progress", "progress_max", "member", "dummies", "count", "units", "max_units")
+
+    def fraction_key(self):
+        """Returns the key by which RequirementsProgress sorts statements by
+        fraction fulfilled. A fraction of "N/A" sorts above every number."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.progress_max > 0, self.progress / self.progress_max.astype(float), np.inf)
+
+class BatchProgress(object):
+    """The progress of many roads on a requirements list.
+
+    paths: the list path of each node, in the order of the node columns.
+    fulfilled, progress, max, subject_progress, subject_max, unit_progress,
+        unit_max: roads x nodes arrays containing the values that
+        RequirementsProgress computes for each statement.
+    """
+
+    def __init__(self, paths, columns):
+        self.paths = paths
+        self._indexes = {path: i for i, path in enumerate(paths)}
+        self.fulfilled = columns["fulfilled"]
+        self.progress = columns["progress"]
+        self.max = columns["progress_max"]
+        self.subject_progress = columns["subject_progress"]
+        self.subject_max = columns["subject_max"]
+        self.unit_progress = columns["unit_progress"]
+        self.unit_max = columns["unit_max"]
+
+    def index(self, list_path):
+        """Returns the column of the node with the given list path."""
+        return self._indexes[list_path]
+
+class BatchEvaluator(object):
+    """Evaluates a requirements list against many roads at once.
+
+    nodes: the BatchNodes of the list in topological order. The root
+        statement is the last node.
+    """
+
+    OUTPUT_FIELDS = ("fulfilled", "subject_progress", "subject_max", "unit_progress", "unit_max",
+                     "progress", "progress_max")
+
+    def __init__(self, statement, list_path):
+        if not isinstance(statement, CompiledStatement):
+            statement = compile_statement(statement)
+        self.nodes = []
+        self._add_node(statement, list_path)
+
+    def _add_node(self, statement, list_path):
+        children = [self._add_node(child, list_path + "." + str(index))
+                    for index, child in enumerate(statement.requirements)] if statement.requirement is None else []
+        node = BatchNode(statement, list_path, children)
+        if statement.requirement is None:
+            if not children:
+                raise ValueError("{}: statement has no requirement or child requirements".format(list_path))
+            if node.threshold is None and node.distinct_threshold is not None and \
+                    len(range(len(children))[:node.distinct_threshold.get_actual_cutoff()]) == 0:
+                raise ValueError("{}: distinct threshold selects no child requirements".format(list_path))
+        self.nodes.append(node)
+        return len(self.nodes) - 1
+
+    def evaluate(self, roads, progress_overrides=None):
+        """Evaluates the requirements list for each road, given as a list of
+        subject IDs. If progress_overrides is not None, it should be a list
+        containing a dictionary of manual progress values for each road.
+        Returns a BatchProgress."""
+        num_roads = len(roads)
+        road_courses = [resolve_courses(road) for road in roads]
+        leaves = [node for node in self.nodes if node.statement.requirement is not None]
+
+        # Only the courses that can satisfy some leaf need columns. Columns
+        # are sorted by the subject ID each course was resolved from, so that
+        # they do not depend on the order of the roads.
+        catalog_courses = get_snapshot().courses
+        resolvable = {}
+        def is_resolvable(subject_id):
+            if subject_id not in resolvable:
+                try:
+                    resolvable[subject_id] = subject_id in catalog_courses or Course.generic_attribute(subject_id) is not None
+                except ValueError:
+                    resolvable[subject_id] = False
+            return resolvable[subject_id]
+
+        sort_keys = {}
+        courses_by_key = {}
+        for road, courses in zip(roads, road_courses):
+            subject_ids = [subject_id for subject_id in road if is_resolvable(subject_id)]
+            for subject_id, course in zip(subject_ids, courses):
+                courses_by_key.setdefault(course.pk, course)
+                sort_keys[course.pk] = min(sort_keys.get(course.pk, subject_id), subject_id)
+        candidates = sorted(courses_by_key.values(), key=lambda c: (sort_keys[c.pk], unicode(c.pk)))
+        candidate_map = SatisfierMap(candidates)
+        parent_children = get_snapshot().relationships.children
+
+        leaf_columns = {}
+        relevant = set()
+        for node in leaves:
+            static, parents = self._satisfying_columns(node.statement.requirement, candidates, candidate_map, parent_children)
+            leaf_columns[id(node)] = (static, parents)
+            relevant.update(static)
+            relevant.update(index for index, parent in parents)
+        relevant = sorted(relevant)
+        column_of = {candidate_index: column for column, candidate_index in enumerate(relevant)}
+        columns = [candidates[index] for index in relevant]
+        units = np.array([course.total_units for course in columns], dtype=np.int64)
+        half = np.array([bool(course.is_half_class) for course in columns], dtype=bool)
+
+        # Incidence matrix of the number of times each course is in each
+        # road, and the position of its first occurrence in the road
+        incidence = np.zeros((num_roads, len(columns)), dtype=np.int64)
+        position = np.full((num_roads, len(columns)), NO_POSITION, dtype=np.int64)
+        key_column = {columns[column].pk: column for column in range(len(columns))}
+        road_subject_ids = []
+        for road_index, courses in enumerate(road_courses):
+            road_subject_ids.append(set(course.subject_id for course in courses))
+            for course_index, course in enumerate(courses):
+                column = key_column.get(course.pk)
+                if column is not None:
+                    if incidence[road_index, column] == 0:
+                        position[road_index, column] = course_index
+                    incidence[road_index, column] += 1
+
+        results = [None] * len(self.nodes)
+        for index, node in enumerate(self.nodes):
+            if node.statement.requirement is not None:
+                static, parents = leaf_columns[id(node)]
+                overrides = None
+                if node.is_manual and progress_overrides is not None:
+                    overrides = np.array([int(road_overrides.get(node.list_path, 0)) for road_overrides in progress_overrides], dtype=np.int64)
+                results[index] = self._evaluate_leaf(node, incidence, position, units, half,
+                                                     [column_of[i] for i in static],
+                                                     [(column_of[i], parent) for i, parent in parents],
+                                                     road_subject_ids, parent_children, overrides)
+            else:
+                results[index] = self._evaluate_compound(node, [self.nodes[child] for child in node.children],
+                                                         [results[child] for child in node.children], units)
+                # The children's course sets are no longer needed
+                for child in node.children:
+                    results[child].member = None
+
+        output = {field: np.column_stack([getattr(result, field) for result in results]) if num_roads > 0
+                  else np.zeros((0, len(results))) for field in self.OUTPUT_FIELDS}
+        return BatchProgress([node.list_path for node in self.nodes], output)
+
+    @staticmethod
+    def _satisfying_columns(requirement, candidates, candidate_map, parent_children):
+        """Returns the indexes of the candidate courses that always satisfy
+        the given requirement, and (index, parent) tuples for the courses
+        that satisfy it when every child of the parent is in the road."""
+        static = set()
+        parents = []
+        for name, key in SatisfierMap.requirement_keys(requirement):
+            if name == "parents":
+                for index, course in enumerate(candidates):
+                    if course.parent == key and parent_children.get(course.parent) is not None:
+                        parents.append((index, course.parent))
+            else:
+                static.update(getattr(candidate_map, name).get(key, []))
+        return static, parents
+
+    @staticmethod
+    def _evaluate_leaf(node, incidence, position, units, half, static, parents, road_subject_ids, parent_children, overrides):
+        num_roads, num_columns = incidence.shape
+        requirement = node.statement.requirement
+        threshold = node.threshold
+
+        satisfies = np.zeros((num_roads, num_columns), dtype=bool)
+        satisfies[:, static] = True
+        for column, parent in parents:
+            children = parent_children[parent]
+            satisfies[:, column] |= np.array([all((child in subject_ids) for child in children)
+                                              for subject_ids in road_subject_ids], dtype=bool)
+        counts = incidence * satisfies
+
+        if "GIR:" in requirement or "HASS" in requirement or "CI-" in requirement:
+            whole = counts * ~half
+            half_counts = counts * half
+        else:
+            whole = counts
+            half_counts = np.zeros(counts.shape, dtype=np.int64)
+        num_whole = whole.sum(axis=1)
+        num_half = half_counts.sum(axis=1)
+
+        result = NodeResult()
+        result.count = num_whole + num_half
+        result.units = counts.dot(units) if num_columns > 0 else np.zeros(num_roads, dtype=np.int64)
+        result.member = counts > 0
+        result.max_units = (result.member * units).max(axis=1) if num_columns > 0 else np.zeros(num_roads, dtype=np.int64)
+        result.dummies = np.zeros(num_roads, dtype=np.int64)
+
+        if threshold is not None:
+            subject_max = threshold.cutoff_for_criterion(CRITERION_SUBJECTS)
+            unit_max = threshold.cutoff_for_criterion(CRITERION_UNITS)
+            subject_progress = ceiling(num_whole + num_half // 2, subject_max)
+            unit_progress = ceiling(result.units, unit_max)
+            fulfilled = is_satisfied_by(threshold, subject_progress, unit_progress)
+        else:
+            # Only one is needed, and the first satisfying course gives the units
+            subject_max = 1
+            unit_max = DEFAULT_UNIT_COUNT
+            subject_progress = ceiling(np.minimum(result.count, 1), subject_max)
+            fulfilled = result.count > 0
+            first_units = np.zeros(num_roads, dtype=np.int64)
+            if num_columns > 0:
+                first_whole = units[np.argmin(np.where(whole > 0, position, NO_POSITION), axis=1)]
+                first_half = units[np.argmin(np.where(half_counts > 0, position, NO_POSITION), axis=1)]
+                first_units = np.where(num_whole > 0, first_whole, np.where(num_half > 0, first_half, 0))
+            unit_progress = ceiling(first_units, unit_max)
+        subject_max = np.full(num_roads, subject_max, dtype=np.int64)
+        unit_max = np.full(num_roads, unit_max, dtype=np.int64)
+
+        if overrides is not None and np.any(overrides != 0):
+            manual = overrides != 0
+            if threshold.criterion == CRITERION_UNITS:
+                manual_units = overrides
+                manual_subjects = overrides // DEFAULT_UNIT_COUNT
+            else:
+                manual_units = overrides * DEFAULT_UNIT_COUNT
+                manual_subjects = overrides
+            manual_subject_progress = ceiling(manual_subjects, subject_max)
+            fulfilled = np.where(manual, overrides >= threshold.get_actual_cutoff(), fulfilled)
+            subject_progress = np.where(manual, manual_subject_progress, subject_progress)
+            unit_progress = np.where(manual, ceiling(manual_units, unit_max), unit_progress)
+            # The satisfied courses are replaced by one placeholder course per subject
+            result.dummies = np.where(manual, manual_subject_progress, 0)
+            result.count = np.where(manual, result.dummies, result.count)
+            result.units = np.where(manual, 0, result.units)
+            result.max_units = np.where(manual, 0, result.max_units)
+            result.member = result.member & ~manual[:, np.newaxis]
+
+        BatchEvaluator._finish(result, node, fulfilled, subject_progress, subject_max, unit_progress, unit_max)
+        return result
+
+    @staticmethod
+    def _evaluate_compound(node, child_nodes, children, units):
+        num_roads = len(children[0].fulfilled)
+        num_children = len(children)
+        statement = node.statement
+        threshold = node.threshold
+        distinct_threshold = node.distinct_threshold
+
+        def stack(field):
+            return np.column_stack([getattr(child, field) for child in children])
+
+        fulfilled = stack("fulfilled")
+        count = stack("count")
+        child_satisfied = fulfilled & (count > 0)
+        num_reqs_satisfied = child_satisfied.sum(axis=1)
+
+        # Children that are "all" statements count as a single course
+        counts_as_one = np.array([children_node.statement.connection_type == CONNECTION_TYPE_ALL and len(children_node.children) > 0
+                                  for children_node in child_nodes], dtype=bool)
+        num_courses_satisfied = np.where(counts_as_one, child_satisfied, count).sum(axis=1)
+
+        # Indexes of the children sorted by decreasing fraction fulfilled
+        keys = np.column_stack([child.fraction_key() for child in children])
+        order = np.argsort(-keys, axis=1, kind="mergesort")
+        rows = np.arange(num_roads)[:, np.newaxis]
+
+        def sorted_field(field):
+            return stack(field)[rows, order]
+
+        members = [child.member for child in children]
+        def union(selected):
+            """Returns the union of the course sets of the children for which
+            selected (a roads x children boolean matrix) is True."""
+            member = np.zeros(members[0].shape, dtype=bool)
+            dummies = np.zeros(num_roads, dtype=np.int64)
+            for i, child in enumerate(children):
+                member |= members[i] & selected[:, i:i + 1]
+                dummies += np.where(selected[:, i], child.dummies, 0)
+            return member, dummies
+
+        member, dummies = union(np.ones((num_roads, num_children), dtype=bool))
+
+        if threshold is None and distinct_threshold is None:
+            fulfilled_result = num_reqs_satisfied > 0
+            if statement.connection_type == CONNECTION_TYPE_ANY:
+                first = order[:, 0]
+                subject_progress = stack("subject_progress")[np.arange(num_roads), first]
+                subject_max = stack("subject_max")[np.arange(num_roads), first]
+                unit_progress = stack("unit_progress")[np.arange(num_roads), first]
+                unit_max = stack("unit_max")[np.arange(num_roads), first]
+            else:
+                subject_progress = stack("subject_progress").sum(axis=1)
+                subject_max = stack("subject_max").sum(axis=1)
+                unit_progress = stack("unit_progress").sum(axis=1)
+                unit_max = stack("unit_max").sum(axis=1)
+        else:
+            if distinct_threshold is not None:
+                # Clip the children to the ones the road is closest to completing
+                num_to_count = min(distinct_threshold.get_actual_cutoff(), num_children)
+                num_sorted = len(range(num_children)[:num_to_count])
+                num_counted = max(num_to_count, 0)
+                ranks = np.arange(num_children)
+                selected = np.zeros((num_roads, num_children), dtype=bool)
+                selected[rows, order] = ranks[np.newaxis, :] < num_counted
+                member, dummies = union(selected)
+
+                sorted_count = sorted_field("count")
+                num_courses_satisfied = np.zeros(num_roads, dtype=np.int64)
+                for i in range(num_counted):
+                    # The statement type comes from the unsorted children, as
+                    # in RequirementsProgress.compute
+                    if child_nodes[i].statement.connection_type == CONNECTION_TYPE_ALL:
+                        num_courses_satisfied += child_satisfied[:, i]
+                    else:
+                        num_courses_satisfied += sorted_count[:, i]
+
+            if threshold is None and distinct_threshold is not None:
+                if distinct_threshold.type == THRESHOLD_TYPE_GT:
+                    fulfilled_result = num_reqs_satisfied >= distinct_threshold.get_actual_cutoff()
+                else:
+                    fulfilled_result = np.ones(num_roads, dtype=bool)
+
+                subject_progress = sorted_field("subject_progress")[:, :num_sorted].sum(axis=1)
+                unit_progress = sorted_field("unit_progress")[:, :num_sorted].sum(axis=1)
+                sorted_subject_max = sorted_field("subject_max")[:, :num_sorted]
+                sorted_unit_max = sorted_field("unit_max")[:, :num_sorted]
+                subject_max = sorted_subject_max[:, 0] + np.maximum(sorted_subject_max[:, 1:], 1).sum(axis=1)
+                unit_max = sorted_unit_max[:, 0] + np.where(sorted_unit_max[:, 1:] == 0, DEFAULT_UNIT_COUNT, sorted_unit_max[:, 1:]).sum(axis=1)
+            else:
+                subject_progress = num_courses_satisfied
+                subject_max = np.full(num_roads, threshold.cutoff_for_criterion(CRITERION_SUBJECTS), dtype=np.int64)
+                unit_progress = member.dot(units) if member.shape[1] > 0 else np.zeros(num_roads, dtype=np.int64)
+                unit_max = np.full(num_roads, threshold.cutoff_for_criterion(CRITERION_UNITS), dtype=np.int64)
+
+                if distinct_threshold is not None and (distinct_threshold.type == THRESHOLD_TYPE_GT or distinct_threshold.type == THRESHOLD_TYPE_GTE):
+                    actual_cutoff = distinct_threshold.get_actual_cutoff()
+                    fulfilled_result = is_satisfied_by(threshold, subject_progress, unit_progress) & (num_reqs_satisfied >= actual_cutoff)
+                    unfill = num_reqs_satisfied < actual_cutoff
+                    if np.any(unfill):
+                        forced_subjects, forced_units = BatchEvaluator._force_unfill(
+                            sorted_field("count")[:, :num_sorted], sorted_field("units")[:, :num_sorted],
+                            sorted_field("max_units")[:, :num_sorted], distinct_threshold, threshold)
+                        subject_progress = np.where(unfill, forced_subjects, subject_progress)
+                        unit_progress = np.where(unfill, forced_units, unit_progress)
+                else:
+                    fulfilled_result = is_satisfied_by(threshold, subject_progress, unit_progress)
+
+        if statement.connection_type == CONNECTION_TYPE_ALL:
+            # "All" statement - make above progresses more stringent
+            fulfilled_result = fulfilled_result & (num_reqs_satisfied == num_children)
+            missing = num_children - num_reqs_satisfied
+            adjust = (subject_progress == subject_max) & (missing > 0)
+            subject_max = subject_max + np.where(adjust, missing, 0)
+            unit_max = unit_max + np.where(adjust, missing * DEFAULT_UNIT_COUNT, 0)
+
+        result = NodeResult()
+        result.member = member
+        result.dummies = dummies
+        result.count = member.sum(axis=1) + dummies
+        result.units = member.dot(units) if member.shape[1] > 0 else np.zeros(num_roads, dtype=np.int64)
+        result.max_units = (member * units).max(axis=1) if member.shape[1] > 0 else np.zeros(num_roads, dtype=np.int64)
+        BatchEvaluator._finish(result, node, fulfilled_result, ceiling(subject_progress, subject_max), subject_max,
+                               ceiling(unit_progress, unit_max), unit_max)
+        return result
+
+    @staticmethod
+    def _force_unfill(counts, units, max_units, distinct_threshold, threshold):
+        """Vectorized version of progress.force_unfill_progresses, given the
+        number of courses, total units and maximum course units of each
+        category. Returns the subject and unit progress."""
+        subject_cutoff = threshold.cutoff_for_criterion(CRITERION_SUBJECTS)
+        unit_cutoff = threshold.cutoff_for_criterion(CRITERION_UNITS)
+        nonempty = counts > 0
+
+        # One course with the most units is fixed from each category
+        fixed_subject_progress = nonempty.sum(axis=1)
+        fixed_subject_max = distinct_threshold.get_actual_cutoff()
+        fixed_unit_progress = np.where(nonempty, max_units, 0).sum(axis=1)
+        fixed_unit_max = np.where(nonempty, max_units, DEFAULT_UNIT_COUNT).sum(axis=1)
+
+        # The remaining courses are free
+        free_subjects = np.where(nonempty, counts - 1, 0).sum(axis=1)
+        free_units = np.where(nonempty, units - max_units, 0).sum(axis=1)
+        subject_progress = fixed_subject_progress + np.minimum(free_subjects, subject_cutoff - fixed_subject_max)
+        unit_progress = fixed_unit_progress + np.minimum(free_units, unit_cutoff - fixed_unit_max)
+        return subject_progress, unit_progress
+
+    @staticmethod
+    def _finish(result, node, fulfilled, subject_progress, subject_max, unit_progress, unit_max):
+        result.fulfilled = np.asarray(fulfilled, dtype=bool)
+        result.subject_progress = subject_progress
+        result.subject_max = subject_max
+        result.unit_progress = unit_progress
+        result.unit_max = unit_max
+        if node.threshold is not None and node.threshold.criterion == CRITERION_UNITS:
+            result.progress, result.progress_max = unit_progress, unit_max
+        else:
+            result.progress, result.progress_max = subject_progress, subject_max
@@ -0,0 +1,234 @@
+"""
+Compiled, in-memory requirements lists.
+
+Requirements lists only change when update_db.update_requirements reloads
+them, but walking a RequirementsStatement tree through the ORM costs one query
+per node. Instead, every list is compiled once per process into a tree of
+immutable CompiledStatement objects, loaded with two queries. The compiled
+lists are rebuilt when a new RequirementsGeneration is recorded, or when a
+requirements statement is saved or deleted in this process (except for the
+temporary lists that the editor parses, see temporary_lists).
+"""
+
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db.models.signals import post_save, post_delete
+from .reqlist import JSONConstants, RequirementsStatement, StatementThresholdMixin
+from .models import RequirementsList, RequirementsGeneration
+
+# Number of seconds between checks for a new requirements generation
+GENERATION_CHECK_INTERVAL = 60.0
+
+STATEMENT_FIELDS = (
+    "title", "description", "requirement", "is_plain_string", "connection_type",
+    "threshold_type", "threshold_cutoff", "threshold_criterion",
+    "distinct_threshold_type", "distinct_threshold_cutoff", "distinct_threshold_criterion"
+)
+
+LIST_FIELDS = ("list_id", "short_title", "medium_title", "title_no_degree", "catalog_url")
+
+class CompiledStatement(StatementThresholdMixin):
+    """An immutable copy of a RequirementsStatement and its children, which
+    supports the parts of the RequirementsStatement interface used to compute
+    progress and produce JSON.
+
+    requirements: tuple of the child CompiledStatements, in database order.
+    """
+
+    __slots__ = STATEMENT_FIELDS + ("requirements", "_description", "_base_json")
+
+    def __init__(self, statement, children):
+        for field in STATEMENT_FIELDS:
+            setattr(self, field, getattr(statement, field))
+        self.requirements = tuple(children)
+        self._description = StatementThresholdMixin.threshold_description(self)
+        self._base_json = self._make_base_json()
+
+    def num_requirements(self):
+        return len(self.requirements)
+
+    def threshold_description(self):
+        return self._description
+
+    def _make_base_json(self):
+        base = {}
+        if self.title is not None and len(self.title) > 0:
+            base[JSONConstants.title] = self.title
+        if self.description is not None and len(self.description) > 0:
+            base[JSONConstants.description] = self.description
+
+        if self.threshold_type is not None:
+            base[JSONConstants.threshold] = {
+                JSONConstants.thresh_type: self.threshold_type,
+                JSONConstants.thresh_cutoff: self.threshold_cutoff,
+                JSONConstants.thresh_criterion: self.threshold_criterion,
+            }
+        if self.distinct_threshold_type is not None:
+            base[JSONConstants.distinct_threshold] = {
+                JSONConstants.thresh_type: self.distinct_threshold_type,
+                JSONConstants.thresh_cutoff: self.distinct_threshold_cutoff,
+                JSONConstants.thresh_criterion: self.distinct_threshold_criterion,
+            }
+
+        if len(self._description) > 0:
+            base[JSONConstants.thresh_description] = self._description
+        if self.is_plain_string:
+            base[JSONConstants.is_plain_string] = self.is_plain_string
+        if self.requirement is not None:
+            base[JSONConstants.requirement] = self.requirement
+        return base
+
+    def to_json_object(self, full=True, child_fn=None):
+        """Returns a new dictionary identical to the one produced by
+        RequirementsStatement.to_json_object()."""
+        base = dict(self._base_json)
+        if self.requirement is None and full and self.requirements:
+            base[JSONConstants.requirements] = [(child_fn(r) if child_fn is not None else r.to_json_object()) for r in self.requirements]
+            base[JSONConstants.connection_type] = self.connection_type
+        return base
+
+class CompiledRequirementsList(CompiledStatement):
+    """An immutable copy of a RequirementsList and its statements."""
+
+    __slots__ = LIST_FIELDS
+
+    def __init__(self, req_list, children):
+        for field in LIST_FIELDS:
+            setattr(self, field, getattr(req_list, field))
+        super(CompiledRequirementsList, self).__init__(req_list, children)
+
+    def to_json_object(self, full=True, child_fn=None):
+        """Returns a new dictionary identical to the one produced by
+        RequirementsList.to_json_object()."""
+        base = {
+            JSONConstants.list_id: self.list_id,
+            JSONConstants.short_title: self.short_title,
+            JSONConstants.medium_title: self.medium_title,
+            JSONConstants.title: self.title,
+            JSONConstants.title_no_degree: self.title_no_degree
+        }
+        if full:
+            if self.requirements:
+                base[JSONConstants.requirements] = [child_fn(r) if child_fn is not None else r.to_json_object() for r in self.requirements]
+            base[JSONConstants.description] = self.description if self.description is not None else ""
+            if self.catalog_url is not None and len(self.catalog_url) > 0:
+                base[JSONConstants.catalog_url] = self.catalog_url
+        return base
+
+def compile_statement(statement):
+    """Compiles the given RequirementsStatement (or RequirementsList) and its
+    descendants by walking the tree in the database. Used for statements that
+    are not part of a compiled requirements list."""
+    children = [compile_statement(child) for child in statement.requirements.order_by("pk")]
+    if isinstance(statement, RequirementsList):
+        return CompiledRequirementsList(statement, children)
+    return CompiledStatement(statement, children)
+
+# Counts the compiled requirements loaded in this process
+_load_count = itertools.count(1)
+
+class CompiledRequirements(object):
+    """Every requirements list compiled at a given generation.
+
+    version: a string that is different for every CompiledRequirements loaded
+        in this process, for use in cache keys.
+    edited: True if the lists were recompiled because a deployed list or
+        statement was saved in this process since the generation was
+        recorded, in which case they may differ from the lists rendered for
+        the generation. Temporary lists (see temporary_lists) never set it.
+
+    lists: dictionary of list IDs (including the .reql extension) to
+        CompiledRequirementsList objects, which are shared by all requests in
+        the process.
+    """
+
+    def __init__(self, generation, req_lists, statements, edited=False):
+        self.generation = generation
+        self.version = "{}.{}".format(generation, next(_load_count))
+        self.edited = edited
+
+        children_by_parent = {}
+        for statement in statements:
+            if statement.parent_id is not None:
+                children_by_parent.setdefault(statement.parent_id, []).append(statement)
+
+        def compile_children(pk):
+            return [CompiledStatement(child, compile_children(child.pk)) for child in children_by_parent.get(pk, [])]
+
+        self.lists = {}
+        for req_list in req_lists:
+            self.lists[req_list.list_id] = CompiledRequirementsList(req_list, compile_children(req_list.pk))
+
+    @staticmethod
+    def load(generation, edited=False):
+        """Compiles the requirements lists currently in the database."""
+        return CompiledRequirements(generation,
+                                    RequirementsList.objects.order_by("pk").iterator(),
+                                    RequirementsStatement.objects.order_by("pk").iterator(),
+                                    edited=edited)
+
+    def get(self, list_id):
+        """Returns the compiled requirements list with the given ID (including
+        the .reql extension), or None if it does not exist."""
+        return self.lists.get(list_id)
+
+_lock = threading.Lock()
+_compiled = None
+_last_check = 0.0
+_is_stale = True
+
+def get_compiled_requirements():
+    """Returns the current compiled requirements lists. The requirements
+    generation is checked at most every GENERATION_CHECK_INTERVAL seconds, and
+    the lists are recompiled if the generation has changed."""
+    global _compiled, _last_check, _is_stale
+
+    compiled = _compiled
+    if compiled is not None and not _is_stale and time.time() - _last_check < GENERATION_CHECK_INTERVAL:
+        return compiled
+
+    with _lock:
+        if _compiled is None or _is_stale or time.time() - _last_check >= GENERATION_CHECK_INTERVAL:
+            generation = RequirementsGeneration.current()
+            if _compiled is None or _is_stale or _compiled.generation != generation:
+                # Lists recompiled without a new generation include edits
+                # that the rendered payloads for the generation do not
+                edited = _compiled is not None and _compiled.generation == generation
+                # Clear the flag first so that saves during the load mark the
+                # new lists as stale too
+                _is_stale = False
+                _compiled = CompiledRequirements.load(generation, edited=edited)
+            _last_check = time.time()
+        return _compiled
+
+def invalidate():
+    """Marks the compiled requirements lists as stale, so that they are
+    recompiled on the next call to get_compiled_requirements()."""
+    global _is_stale
+    _is_stale = True
+
+# Tracks the temporary_lists contexts entered on each thread
+_temporary = threading.local()
+
+@contextmanager
+def temporary_lists():
+    """Within this context, saving or deleting requirements lists and
+    statements on the calling thread does not invalidate the compiled lists.
+    This is for lists that are only parsed to be displayed and then deleted,
+    such as editor previews, which would otherwise force a recompile."""
+    _temporary.depth = getattr(_temporary, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        _temporary.depth -= 1
+
+def _statement_changed(sender, **kwargs):
+    if getattr(_temporary, "depth", 0) == 0:
+        invalidate()
+
+for _model in (RequirementsStatement, RequirementsList):
+    post_save.connect(_statement_changed, sender=_model, dispatch_uid="compiled_requirements_save_" + _model.__name__)
+    post_delete.connect(_statement_changed, sender=_model, dispatch_uid="compiled_requirements_delete_" + _model.__name__)
@@ -19,6 +19,7 @@ from reqlist import *
 from views import REQUIREMENTS_EXT
 from django.http import Http404
 from .diff import build_diff
+from .compiled import temporary_lists
 
 NEW_DOC_ID = "new_doc"
 NEW_DOC_NAME = "new requirements list"
@@ -162,14 +163,15 @@ def preview(request):
         return HttpResponseBadRequest("Must use POST")
 
     req_contents = request.body.decode('utf-8')
-    req_list = RequirementsList.objects.create()
-    try:
-        req_list.parse(req_contents, full=True)
-        html = build_presentation_items(req_list)
-        req_list.delete()
-    except:
-        req_list.delete()
-        return HttpResponse("<p>An error occurred while generating the preview. Please double-check your syntax!</p>")
+    with temporary_lists():
+        req_list = RequirementsList.objects.create()
+        try:
+            req_list.parse(req_contents, full=True)
+            html = build_presentation_items(req_list)
+            req_list.delete()
+        except:
+            req_list.delete()
+            return HttpResponse("<p>An error occurred while generating the preview. Please double-check your syntax!</p>")
     return HttpResponse(html)
 
 def show_in_row(requirement):
@@ -288,14 +290,15 @@ def review(request, edit_req):
     params['edit_req'] = edit_request
     params['action'] = "Review"
 
-    req_list = RequirementsList.objects.create()
-    try:
-        req_list.parse(edit_request.contents, full=False)
-        params['medium_title'] = req_list.medium_title
-        req_list.delete()
-    except:
-        req_list.delete()
-        params['medium_title'] = '<could not parse>'
+    with temporary_lists():
+        req_list = RequirementsList.objects.create()
+        try:
+            req_list.parse(edit_request.contents, full=False)
+            params['medium_title'] = req_list.medium_title
+            req_list.delete()
+        except:
+            req_list.delete()
+            params['medium_title'] = '<could not parse>'
 
     if edit_request.type == REQUEST_TYPE_EDIT:
         try:
@@ -0,0 +1,133 @@
+"""
+Incremental progress recomputation for road edits.
+
+Each progress tree computed through the progress_delta endpoint is cached as a
+ProgressState under a random revision string, which is returned to the client.
+When the client later sends that revision along with the subjects it added to
+or removed from the road, only the leaf requirements those subjects can
+satisfy (and their ancestors) are recomputed, starting from the cached tree.
+Cached states are only reused while the requirements list and catalog they
+were computed with are still current.
+"""
+
+import uuid
+
+from common.cache import LRUCache
+from catalog.snapshot import get_snapshot
+from .progress import RequirementsProgress, SatisfierMap, resolve_courses
+
+# Maximum number of progress states to keep in each process
+MAX_CACHED_STATES = 1000
+
+# Number of seconds to keep each progress state
+STATE_TIMEOUT = 30 * 60
+
+progress_states = LRUCache(MAX_CACHED_STATES, ttl=STATE_TIMEOUT)
+
+def dirty_progresses(root, changed_keys, changed_paths):
+    """Returns the set of progress objects in the tree rooted at root that
+    need to be recomputed: the leaves whose requirement is satisfied by any of
+    the given SatisfierMap keys, the statements whose list path is in
+    changed_paths, and all of their ancestors."""
+    dirty = set()
+    def visit(progress):
+        is_dirty = progress.list_path in changed_paths
+        if progress.statement.requirement is not None:
+            is_dirty = is_dirty or any(key in changed_keys for key in SatisfierMap.requirement_keys(progress.statement.requirement))
+        for child in progress.children:
+            is_dirty = visit(child) or is_dirty
+        if is_dirty:
+            dirty.add(progress)
+        return is_dirty
+    visit(root)
+    return dirty
+
+class ProgressState(object):
+    """A computed progress tree for a requirements list, along with the
+    inputs it was computed from. ProgressStates are never modified once they
+    are created, so they can be shared between requests.
+
+    req: the CompiledRequirementsList the progress was computed for.
+    snapshot: the catalog snapshot the courses were resolved from.
+    courses: the list of Course objects in the road.
+    progress_overrides: the road's dictionary of manual progress values.
+    satisfier_map: the SatisfierMap built from courses.
+    progress: the computed RequirementsProgress tree.
+    next_generic_id: the next unique ID to give to generic courses.
+    """
+
+    def __init__(self, list_id, req, courses, progress_overrides, satisfier_map, progress, next_generic_id):
+        self.list_id = list_id
+        self.req = req
+        self.snapshot = get_snapshot()
+        self.courses = courses
+        self.progress_overrides = progress_overrides
+        self.satisfier_map = satisfier_map
+        self.progress = progress
+        self.next_generic_id = next_generic_id
+
+    @staticmethod
+    def compute(list_id, req, subject_ids, progress_overrides):
+        """Computes the progress on the given compiled requirements list from
+        scratch."""
+        courses = resolve_courses(subject_ids)
+        satisfier_map = SatisfierMap(courses)
+        progress = RequirementsProgress(req, list_id)
+        progress.compute(courses, progress_overrides, satisfier_map)
+        return ProgressState(list_id, req, courses, progress_overrides, satisfier_map, progress, len(courses))
+
+    def is_current(self, list_id, req):
+        """Returns whether this state can be used as the base for the given
+        list and compiled requirements list."""
+        return self.list_id == list_id and self.req is req and self.snapshot is get_snapshot()
+
+    def apply_delta(self, added, removed, progress_overrides=None):
+        """Returns a new ProgressState for the road with the given subject IDs
+        added and removed. Added subjects are placed at the end of the road,
+        and each removed subject ID removes its last occurrence in the road.
+        If progress_overrides is not None, it replaces the road's manual
+        progress values."""
+        courses = list(self.courses)
+        removed_courses = []
+        for subject_id in removed:
+            for index in range(len(courses) - 1, -1, -1):
+                if courses[index].subject_id == subject_id:
+                    removed_courses.append(courses.pop(index))
+                    break
+        added_courses = resolve_courses(added, first_generic_id=self.next_generic_id)
+        courses += added_courses
+        satisfier_map = SatisfierMap(courses)
+
+        # Collect the keys under which each changed course was indexed
+        changed_keys = set()
+        old_indexes = {id(course): index for index, course in enumerate(self.courses)}
+        for course in removed_courses:
+            changed_keys.update(self.satisfier_map.course_keys[old_indexes[id(course)]])
+        for index in range(len(courses) - len(added_courses), len(courses)):
+            changed_keys.update(satisfier_map.course_keys[index])
+
+        if progress_overrides is None:
+            progress_overrides = self.progress_overrides
+        changed_paths = set(path for path in set(progress_overrides) | set(self.progress_overrides)
+                            if progress_overrides.get(path) != self.progress_overrides.get(path))
+
+        dirty = dirty_progresses(self.progress, changed_keys, changed_paths)
+        progress = self.progress.recomputed(courses, progress_overrides, satisfier_map, dirty)
+        return ProgressState(self.list_id, self.req, courses, progress_overrides, satisfier_map, progress,
+                             self.next_generic_id + len(added_courses))
+
+def get_state(revision, list_id, req):
+    """Returns the cached ProgressState with the given revision if it can be
+    used as the base for the given list, or None otherwise."""
+    if not revision:
+        return None
+    state = progress_states.get(revision)
+    if state is None or not state.is_current(list_id, req):
+        return None
+    return state
+
+def store_state(state):
+    """Caches the given ProgressState and returns its new revision string."""
+    revision = uuid.uuid4().hex
+    progress_states.set(revision, state)
+    return revision
@@ -167,6 +167,22 @@ class RequirementsList(RequirementsStatement):
             req.parent = self
             req.substitute_variables(variables)
 
+class RequirementsGeneration(models.Model):
+    """Records each reload of the requirements lists by
+    update_db.update_requirements, so that running server processes can tell
+    when their compiled requirements trees are out of date."""
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return u"Requirements generation {} at {}".format(self.pk, self.timestamp)
+
+    @staticmethod
+    def current():
+        """Returns the ID of the most recent requirements generation, or 0 if
+        the requirements lists have never been reloaded."""
+        latest = RequirementsGeneration.objects.order_by("-pk").values_list("pk", flat=True).first()
+        return latest if latest is not None else 0
+
 # Deployment
 
 REQUEST_TYPE_EDIT = "Edit"
@@ -0,0 +1,134 @@
+"""
+Precomputed JSON responses for the requirements list endpoints.
+
+The JSON for each requirements list (served by get_json) and the manifest of
+all lists (served by list_reqs) is rendered once after
+update_db.update_requirements reloads the lists, and written to disk. Server
+processes load these files into a RequirementsPayloads object, which holds
+each response body along with its compressed encodings and entity tags. If
+the files on disk don't match the current requirements generation, or the
+lists have been edited in this process since the generation was recorded,
+the bodies are rendered from the compiled requirements lists instead.
+"""
+
+import io
+import json
+import os
+import threading
+
+from django.conf import settings
+from common.responses import EncodedPayload
+from .reqlist import JSONConstants
+from .compiled import get_compiled_requirements
+
+REQUIREMENTS_EXT = ".reql"
+
+# Directory within the catalog base directory that holds the rendered JSON
+PAYLOADS_DIR = "requirements_json"
+MANIFEST_FILE = "manifest.json"
+GENERATION_FILE = "generation.txt"
+
+def payloads_directory():
+    return os.path.join(settings.CATALOG_BASE_DIR, PAYLOADS_DIR)
+
+def render_list(compiled_list):
+    """Returns the serialized JSON for the given compiled requirements list."""
+    # to pretty-print, use these keyword arguments to json.dumps:
+    # sort_keys=True, indent=4, separators=(',', ': ')
+    return json.dumps(compiled_list.to_json_object(full=True))
+
+def render_manifest(compiled):
+    """Returns the serialized JSON dictionary of list IDs to the metadata of
+    each requirements list."""
+    list_ids = {}
+    for req in compiled.lists.values():
+        req_metadata = req.to_json_object(full=False)
+        del req_metadata[JSONConstants.list_id]
+        list_ids[req.list_id.replace(REQUIREMENTS_EXT, "")] = req_metadata
+    return json.dumps(list_ids)
+
+def _write_file(path, content):
+    """Writes the given bytes to path, replacing any existing file atomically."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(content)
+    os.rename(temp_path, path)
+
+def write_payloads(compiled, directory=None):
+    """Renders the JSON for every list in the given CompiledRequirements, as
+    well as the manifest, and writes them to the given directory (by default
+    the payloads directory). The generation file is written last, so readers
+    only use the files once they are all present."""
+    directory = directory or payloads_directory()
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    generation_path = os.path.join(directory, GENERATION_FILE)
+    if os.path.exists(generation_path):
+        os.remove(generation_path)
+    for list_id, compiled_list in compiled.lists.items():
+        _write_file(os.path.join(directory, list_id.replace(REQUIREMENTS_EXT, "") + ".json"),
+                    render_list(compiled_list).encode("utf-8"))
+    _write_file(os.path.join(directory, MANIFEST_FILE), render_manifest(compiled).encode("utf-8"))
+    _write_file(generation_path, str(compiled.generation).encode("utf-8"))
+
+def _read_file(path):
+    with io.open(path, "rb") as file:
+        return file.read()
+
+class RequirementsPayloads(object):
+    """The get_json and list_reqs response bodies for a CompiledRequirements.
+
+    compiled: the CompiledRequirements these payloads were built from.
+    lists: dictionary of list IDs (without the .reql extension) to
+        EncodedPayloads containing the JSON for each list.
+    manifest: an EncodedPayload containing the JSON for list_reqs.
+    """
+
+    def __init__(self, compiled, list_contents, manifest_content):
+        self.compiled = compiled
+        # Edited lists are only known to this process
+        version = compiled.version if compiled.edited else "{}".format(compiled.generation)
+        self.lists = {list_id: EncodedPayload(content, "{}-{}".format(version, list_id))
+                      for list_id, content in list_contents.items()}
+        self.manifest = EncodedPayload(manifest_content, "{}-manifest".format(version))
+
+    @staticmethod
+    def load(compiled, directory=None):
+        """Loads the payloads for the given CompiledRequirements from disk if
+        they were written for its generation and the lists have not been edited
+        since, or renders them otherwise."""
+        directory = directory or payloads_directory()
+        list_ids = [list_id.replace(REQUIREMENTS_EXT, "") for list_id in compiled.lists]
+        try:
+            if compiled.generation > 0 and not compiled.edited and _read_file(os.path.join(directory, GENERATION_FILE)).strip() == str(compiled.generation):
+                list_contents = {list_id: _read_file(os.path.join(directory, list_id + ".json")) for list_id in list_ids}
+                return RequirementsPayloads(compiled, list_contents, _read_file(os.path.join(directory, MANIFEST_FILE)))
+        except (IOError, OSError):
+            pass
+
+        list_contents = {list_id.replace(REQUIREMENTS_EXT, ""): render_list(compiled_list)
+                         for list_id, compiled_list in compiled.lists.items()}
+        return RequirementsPayloads(compiled, list_contents, render_manifest(compiled))
+
+    def get(self, list_id):
+        """Returns the EncodedPayload for the given list ID (without the .reql
+        extension), or None if the list does not exist."""
+        return self.lists.get(list_id)
+
+_lock = threading.Lock()
+_payloads = None
+
+def get_payloads():
+    """Returns the RequirementsPayloads for the current compiled requirements
+    lists, loading them again whenever the lists are recompiled."""
+    global _payloads
+    compiled = get_compiled_requirements()
+    payloads = _payloads
+    if payloads is not None and payloads.compiled is compiled:
+        return payloads
+
+    with _lock:
+        if _payloads is None or _payloads.compiled is not compiled:
+            _payloads = RequirementsPayloads.load(compiled)
+        return _payloads
@@ -1,6 +1,8 @@
 from reqlist import *
-import random
+import copy
 from catalog.models import Course
+from catalog.snapshot import get_snapshot
+from compiled import CompiledStatement, compile_statement
 
 def ceiling_thresh(progress, maximum):
     """Creates a progress object
@@ -31,7 +33,11 @@ def sum_progresses(progresses, criterion_type, maxFunc):
         mapfunc = lambda p: p.subject_fulfillment
     elif criterion_type == CRITERION_UNITS:
         mapfunc = lambda p: p.unit_fulfillment
-    sum_progress = reduce(lambda p1, p2: p1.combine(p2, maxFunc), map(mapfunc, progresses))
+    progresses = map(mapfunc, progresses)
+    # Start from a copy of the first progress, so that the result can be
+    # modified without affecting the child progresses
+    first = Progress(progresses[0].progress, progresses[0].max)
+    sum_progress = reduce(lambda p1, p2: p1.combine(p2, maxFunc), progresses[1:], first)
     return sum_progress
 
 
@@ -85,6 +91,146 @@ def force_unfill_progresses(satisfied_by_category, current_distinct_threshold, c
     return (subject_progress, unit_progress)
 
 
+class SatisfierMap(object):
+    """An index from requirement strings to the courses in a road that satisfy
+    them, built once per progress computation so that each leaf requirement
+    can be resolved with dictionary lookups instead of calling Course.satisfies
+    on every course. The semantics match Course.satisfies(req, all_courses=courses).
+
+    Each index is a dictionary from keys to lists of course indexes. The keys
+    under which each course is indexed are kept in course_keys, as (index name,
+    key) tuples, so that the requirements a course can satisfy are known (see
+    requirement_keys)."""
+
+    def __init__(self, courses):
+        self.courses = courses
+        self.gir = {}
+        self.hass = {}
+        self.ci = {}
+        self.ids = {}
+        self.parents = {}
+        self.course_keys = [set() for course in courses]
+
+        subject_ids = set(c.subject_id for c in courses)
+        parent_children = get_snapshot().relationships.children
+        for index, course in enumerate(courses):
+            if course.gir_attribute is not None and len(course.gir_attribute) > 0:
+                self._add("gir", course.gir_attribute, index)
+
+            hasses = course.get_hass_attributes()
+            for hass in hasses:
+                self._add("hass", hass, index)
+            if hasses:
+                self._add("hass", "HASS", index)
+
+            if course.communication_requirement is not None and len(course.communication_requirement) > 0:
+                self._add("ci", course.communication_requirement, index)
+
+            self._add("ids", course.subject_id, index)
+            for field in (course.joint_subjects, course.equivalent_subjects, course.children):
+                if field is not None:
+                    for subject_id in field.split(","):
+                        self._add("ids", subject_id, index)
+
+            # For example: 6.0001 and 6.0002 together satisfy the 6.00 requirement
+            if course.parent is not None:
+                children = parent_children.get(course.parent)
+                if children is not None and all((child in subject_ids) for child in children):
+                    self._add("parents", course.parent, index)
+
+    def _add(self, name, key, index):
+        indexes = getattr(self, name).setdefault(key, [])
+        if not indexes or indexes[-1] != index:
+            indexes.append(index)
+        self.course_keys[index].add((name, key))
+
+    @staticmethod
+    def requirement_keys(requirement):
+        """Returns the (index name, key) tuples whose courses satisfy the given
+        requirement string."""
+        req = requirement.replace("GIR:", "")
+        keys = [("ids", req), ("parents", req)]
+        if "GIR:" in requirement:
+            keys.append(("gir", req))
+        if "HASS" in req:
+            keys.append(("hass", req))
+        if "CI-" in req:
+            keys.append(("ci", req))
+        return keys
+
+    def satisfying_courses(self, requirement):
+        """Returns the courses that satisfy the given requirement string, in
+        the order they appear in the road."""
+        indexes = set()
+        for name, key in self.requirement_keys(requirement):
+            indexes.update(getattr(self, name).get(key, []))
+        return [self.courses[index] for index in sorted(indexes)]
+
+
+def resolve_courses(course_list, first_generic_id=0):
+    """Returns a list of Course objects for the given subject IDs, using
+    generic courses for subject IDs that are not in the catalog. Catalog
+    courses come from the catalog snapshot, and the attributes for each
+    distinct generic subject ID are only built once. Generic courses that can
+    count more than once are given unique IDs starting at first_generic_id."""
+    catalog_courses = get_snapshot().courses
+    generic_attributes = {}
+    course_objs = []
+    #required to give generic courses unique id's so muliple can count towards requirement
+    unique_generic_id = first_generic_id
+    for subject_id in course_list:
+        course = catalog_courses.get(subject_id)
+        if course is not None:
+            course_objs.append(course)
+            continue
+
+        if subject_id not in generic_attributes:
+            try:
+                generic_attributes[subject_id] = Course.generic_attribute(subject_id)
+            except ValueError:
+                generic_attributes[subject_id] = None
+        generic_attribute = generic_attributes[subject_id]
+        if generic_attribute is None:
+            print("Warning: course {} does not exist in the catalog".format(subject_id))
+            continue
+
+        generic_course = copy.copy(generic_attribute.course)
+        if generic_attribute.needs_unique_id:
+            generic_course.id = generic_attribute.course.id + str(unique_generic_id)
+        course_objs.append(generic_course)
+        unique_generic_id += 1
+    return course_objs
+
+
+class PlaceholderCourse(object):
+    """A generated course counted toward a requirement in place of the
+    subjects in a manual progress override. Placeholders are not Course
+    models; they only support the attributes used to compute progress. The
+    IDs are derived from the statement's list path and the placeholder's
+    index, so they are the same every time the progress is computed."""
+
+    __slots__ = ("id", "subject_id")
+
+    total_units = 0
+    is_half_class = False
+
+    def __init__(self, list_path, index):
+        self.id = "{}_{}".format(list_path, index)
+        self.subject_id = "gen_course_" + self.id
+
+    def __eq__(self, other):
+        return isinstance(other, PlaceholderCourse) and self.id == other.id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((PlaceholderCourse, self.id))
+
+    def __repr__(self):
+        return "<PlaceholderCourse: {}>".format(self.subject_id)
+
+
 class JSONProgressConstants:
     """Each of these keys will be filled in a RequirementsStatement JSON
     representation decorated by a RequirementsProgress object."""
@@ -94,6 +240,7 @@ class JSONProgressConstants:
     progress_max = "max"
     percent_fulfilled = "percent_fulfilled"
     satisfied_courses = "sat_courses"
+    manual_progress = "manual_progress"
 
 
 class Progress(object):
@@ -140,45 +287,76 @@ class RequirementsProgress(object):
     information specific to a user's request is transient.
     """
     def __init__(self, statement, list_path):
-        """Initializes a progress object with the given requirements statement."""
+        """Initializes a progress object with the given requirements statement,
+        which should be a CompiledStatement. A RequirementsStatement from the
+        database is compiled first."""
+        if not isinstance(statement, CompiledStatement):
+            statement = compile_statement(statement)
         self.statement = statement
         self.threshold = self.statement.get_threshold()
         self.distinct_threshold = self.statement.get_distinct_threshold()
         self.list_path = list_path
         self.children = []
         if self.statement.requirement is None:
-            for index, child in enumerate(self.statement.requirements.iterator()):
+            for index, child in enumerate(self.statement.requirements):
                 self.children.append(RequirementsProgress(child, list_path + "." + str(index)))
 
-    def courses_satisfying_req(self, courses):
+    def courses_satisfying_req(self, courses, satisfier_map=None):
         """
         Returns the whole courses and the half courses satisfying this requirement
-        separately.
+        separately. If satisfier_map is not None, it should be a SatisfierMap
+        built from courses.
         """
         if self.statement.requirement is not None:
             req = self.statement.requirement
+            if satisfier_map is None:
+                satisfier_map = SatisfierMap(courses)
+            satisfying = satisfier_map.satisfying_courses(req)
             if "GIR:" in req or "HASS" in req or "CI-" in req:
                 # Separate whole and half courses
                 whole_courses = []
                 half_courses = []
-                for c in courses:
-                    if not c.satisfies(req, courses):
-                        continue
+                for c in satisfying:
                     if c.is_half_class:
                         half_courses.append(c)
                     else:
                         whole_courses.append(c)
                 return whole_courses, half_courses
             else:
-                return [c for c in courses if c.satisfies(req, courses)], []
+                return satisfying, []
 
         return [], []
 
-    def compute(self, courses, progress_overrides):
+    def compute(self, courses, progress_overrides, satisfier_map=None):
         """Computes and stores the status of the requirements statement using the
-        given list of Course objects."""
+        given list of Course objects. The satisfier_map is built from courses if
+        it is not provided, and shared with the child requirements."""
+        if satisfier_map is None:
+            satisfier_map = SatisfierMap(courses)
+        for child in self.children:
+            child.compute(courses, progress_overrides, satisfier_map)
+        self.compute_statement(courses, progress_overrides, satisfier_map)
+
+    def recomputed(self, courses, progress_overrides, satisfier_map, dirty):
+        """Returns a computed progress tree for the given courses, assuming
+        that this tree has already been computed and only the progress objects
+        in dirty can have changed. Every ancestor of a dirty progress object
+        must be dirty as well. The statements that are dirty are copied and
+        recomputed, and the rest are shared with this tree, which is left
+        unchanged."""
+        if self not in dirty:
+            return self
+        other = copy.copy(self)
+        other.children = [child.recomputed(courses, progress_overrides, satisfier_map, dirty) for child in self.children]
+        other.compute_statement(courses, progress_overrides, satisfier_map)
+        return other
+
+    def compute_statement(self, courses, progress_overrides, satisfier_map):
+        """Computes and stores the status of this statement, assuming that the
+        child requirements have already been computed."""
         # Compute status of children and then self, adapted from mobile apps' computeRequirementsStatus method
         satisfied_courses = set()
+        is_manual = False
 
         if self.list_path in progress_overrides:
             manual_progress = progress_overrides[self.list_path]
@@ -189,6 +367,7 @@ class RequirementsProgress(object):
             #it is a basic requirement
             if self.statement.is_plain_string and not manual_progress == 0 and self.threshold is not None:
                 #use manual progress
+                is_manual = True
                 is_fulfilled = manual_progress >= self.threshold.get_actual_cutoff()
                 subjects = 0
                 units = 0
@@ -202,16 +381,12 @@ class RequirementsProgress(object):
 
                 subject_progress = ceiling_thresh(subjects, self.threshold.cutoff_for_criterion(CRITERION_SUBJECTS))
                 unit_progress = ceiling_thresh(units, self.threshold.cutoff_for_criterion(CRITERION_UNITS))
-                #fill with dummy courses
-                random_ids = random.sample(range(1000, max(10000, subject_progress.progress + 1000)), subject_progress.progress)
-
-                for rand_id in random_ids:
-                    dummy_course = Course(id = self.list_path + "_" + str(rand_id), subject_id = "gen_course_" + self.list_path + "_" + str(rand_id), title = "Generated Course " + self.list_path + " " + str(rand_id))
-                    satisfied_courses.add(dummy_course)
+                #fill with placeholder courses
+                satisfied_courses = [PlaceholderCourse(self.list_path, index) for index in range(subject_progress.progress)]
 
             else:
                 #Example: requirement CI-H, we want to show how many have been fulfilled
-                whole_courses, half_courses = self.courses_satisfying_req(courses)
+                whole_courses, half_courses = self.courses_satisfying_req(courses, satisfier_map)
                 satisfied_courses = whole_courses + half_courses
 
                 if not self.threshold is None:
@@ -241,7 +416,6 @@ class RequirementsProgress(object):
             num_courses_satisfied = 0
 
             for req_progress in self.children:
-                req_progress.compute(courses, progress_overrides)
                 req_satisfied_courses = req_progress.satisfied_courses
 
                 if req_progress.is_fulfilled and len(req_progress.satisfied_courses) > 0:
@@ -329,6 +503,7 @@ class RequirementsProgress(object):
             progress = unit_progress if self.threshold is not None and self.threshold.criterion == CRITERION_UNITS else subject_progress
 
         self.is_fulfilled = is_fulfilled
+        self.is_manual = is_manual
         self.subject_fulfillment = subject_progress
         self.subject_progress = subject_progress.progress
         self.subject_max = subject_progress.max
@@ -352,6 +527,8 @@ class RequirementsProgress(object):
         stmt_json[JSONProgressConstants.progress_max] = self.progress_max
         stmt_json[JSONProgressConstants.percent_fulfilled] = self.percent_fulfilled
         stmt_json[JSONProgressConstants.satisfied_courses] = map(lambda c: c.subject_id, self.satisfied_courses)
+        if self.is_manual:
+            stmt_json[JSONProgressConstants.manual_progress] = True
 
         if full:
             if self.children:
@@ -0,0 +1,33 @@
+"""
+Cache of serialized progress results.
+
+Many students on the same requirements list have identical course sets, so
+the serialized progress JSON is cached under a fingerprint of everything it
+depends on: the list, the versions of the compiled requirements and catalog
+snapshot, the subject IDs in the road and the progress overrides. The order of
+the road is part of the key, because it determines which course counts toward
+a requirement that needs only one course, and the order of generic course IDs.
+"""
+
+import hashlib
+import json
+
+from common.cache import LRUCache
+
+# Maximum number of progress results to keep in each process
+MAX_CACHED_RESULTS = 5000
+
+# Number of seconds to keep each progress result
+RESULT_TIMEOUT = 60 * 60
+
+progress_results = LRUCache(MAX_CACHED_RESULTS, ttl=RESULT_TIMEOUT)
+
+def fingerprint(value):
+    """Returns a digest of the given JSON-serializable value."""
+    return hashlib.sha1(json.dumps(value, sort_keys=True)).hexdigest()
+
+def progress_key(list_id, compiled, snapshot, subject_ids, progress_overrides):
+    """Returns the cache key for the progress on the given list, using the
+    given CompiledRequirements and CatalogSnapshot."""
+    return (list_id, compiled.version, snapshot.version,
+            fingerprint(list(subject_ids)), fingerprint(progress_overrides))
@@ -136,49 +136,12 @@ class JSONConstants:
     thresh_cutoff = "cutoff"
     thresh_criterion = "criterion"
 
-class RequirementsStatement(models.Model):
-    """Represents a single requirements statement, encompassing a series of
-    subjects or other requirements statements connected by AND or OR."""
-
-    #list = models.ForeignKey("RequirementsList", on_delete=models.CASCADE, related_name="requirements", null=True)
+class StatementThresholdMixin(object):
+    """Threshold accessors and descriptions shared by RequirementsStatement and
+    the compiled in-memory statements in requirements.compiled. Subclasses
+    provide the statement's fields and a num_requirements() method."""
 
-    title = models.CharField(max_length=250, null=True)
-    description = models.TextField(null=True)
-    requirement = models.CharField(max_length=100, null=True)
-    parent = models.ForeignKey("self", null=True, related_name="requirements", on_delete=models.CASCADE)
-    is_plain_string = models.BooleanField(default=False)
-
-    connection_type = models.CharField(max_length=10, choices=(
-        (CONNECTION_TYPE_ALL, "all"),
-        (CONNECTION_TYPE_ANY, "any"),
-        (CONNECTION_TYPE_NONE, "none")
-    ), default=CONNECTION_TYPE_ALL)
-
-    # Threshold
-    threshold_type = models.CharField(max_length=4, choices=(
-        (THRESHOLD_TYPE_LT, "less than"),
-        (THRESHOLD_TYPE_LTE, "at most"),
-        (THRESHOLD_TYPE_GT, "greater than"),
-        (THRESHOLD_TYPE_GTE, "at least")
-    ), null=True)
-    threshold_cutoff = models.IntegerField(default=0, null=False)
-    threshold_criterion = models.CharField(max_length=10, choices=(
-        (CRITERION_SUBJECTS, "subjects"),
-        (CRITERION_UNITS, "units")
-    ), default=CRITERION_SUBJECTS)
-
-    # Distinct threshold
-    distinct_threshold_type = models.CharField(max_length=4, choices=(
-        (THRESHOLD_TYPE_LT, "less than"),
-        (THRESHOLD_TYPE_LTE, "at most"),
-        (THRESHOLD_TYPE_GT, "greater than"),
-        (THRESHOLD_TYPE_GTE, "at least")
-    ), null=True)
-    distinct_threshold_cutoff = models.IntegerField(default=0, null=False)
-    distinct_threshold_criterion = models.CharField(max_length=10, choices=(
-        (CRITERION_SUBJECTS, "subjects"),
-        (CRITERION_UNITS, "units")
-    ), default=CRITERION_SUBJECTS)
+    __slots__ = ()
 
     def get_threshold(self):
         if self.threshold_type is not None:
@@ -218,7 +181,7 @@ class RequirementsStatement(models.Model):
         elif self.connection_type == CONNECTION_TYPE_ALL:
             ret = "select all"
         elif self.connection_type == CONNECTION_TYPE_ANY:
-            if self.requirements.all().exists() and len(self.requirements.all()) == 2:
+            if self.num_requirements() == 2:
                 ret = "select either"
             else:
                 ret = "select any"
@@ -239,6 +202,54 @@ class RequirementsStatement(models.Model):
 
         return ret
 
+class RequirementsStatement(StatementThresholdMixin, models.Model):
+    """Represents a single requirements statement, encompassing a series of
+    subjects or other requirements statements connected by AND or OR."""
+
+    #list = models.ForeignKey("RequirementsList", on_delete=models.CASCADE, related_name="requirements", null=True)
+
+    title = models.CharField(max_length=250, null=True)
+    description = models.TextField(null=True)
+    requirement = models.CharField(max_length=100, null=True)
+    parent = models.ForeignKey("self", null=True, related_name="requirements", on_delete=models.CASCADE)
+    is_plain_string = models.BooleanField(default=False)
+
+    connection_type = models.CharField(max_length=10, choices=(
+        (CONNECTION_TYPE_ALL, "all"),
+        (CONNECTION_TYPE_ANY, "any"),
+        (CONNECTION_TYPE_NONE, "none")
+    ), default=CONNECTION_TYPE_ALL)
+
+    # Threshold
+    threshold_type = models.CharField(max_length=4, choices=(
+        (THRESHOLD_TYPE_LT, "less than"),
+        (THRESHOLD_TYPE_LTE, "at most"),
+        (THRESHOLD_TYPE_GT, "greater than"),
+        (THRESHOLD_TYPE_GTE, "at least")
+    ), null=True)
+    threshold_cutoff = models.IntegerField(default=0, null=False)
+    threshold_criterion = models.CharField(max_length=10, choices=(
+        (CRITERION_SUBJECTS, "subjects"),
+        (CRITERION_UNITS, "units")
+    ), default=CRITERION_SUBJECTS)
+
+    # Distinct threshold
+    distinct_threshold_type = models.CharField(max_length=4, choices=(
+        (THRESHOLD_TYPE_LT, "less than"),
+        (THRESHOLD_TYPE_LTE, "at most"),
+        (THRESHOLD_TYPE_GT, "greater than"),
+        (THRESHOLD_TYPE_GTE, "at least")
+    ), null=True)
+    distinct_threshold_cutoff = models.IntegerField(default=0, null=False)
+    distinct_threshold_criterion = models.CharField(max_length=10, choices=(
+        (CRITERION_SUBJECTS, "subjects"),
+        (CRITERION_UNITS, "units")
+    ), default=CRITERION_SUBJECTS)
+
+    def num_requirements(self):
+        """Returns the number of child requirements of this statement."""
+        return self.requirements.count()
+
     def __str__(self):
         thresh_desc = self.threshold_description()
         if self.requirement is not None:
@@ -1,6 +1,18 @@
 from django.test import TestCase
+import json
+import os
+import random
+import shutil
+import tempfile
 from .models import *
 from .progress import *
+from .compiled import get_compiled_requirements, CompiledRequirements
+from . import compiled as compiled_module
+from .payloads import RequirementsPayloads, write_payloads
+from .incremental import dirty_progresses
+from .progress_cache import progress_results, progress_key
+from .batch import BatchEvaluator
+from catalog.snapshot import get_snapshot
 from catalog.models import Course
 
 # Create your tests here.
@@ -201,8 +213,14 @@ class RequirementsProgressTest(TestCase):
         progress.compute(courses, manual)
         self.assertFalse(progress.is_fulfilled)
         self.assert_basic_progress(1, 2, progress)
-        # Computation should generate a dummy course
+        # Computation should generate a placeholder course
         self.assertEqual(1, len(progress.satisfied_courses))
+        self.assertEqual(["gen_course_0_0"], progress.to_json_object()["sat_courses"])
+        self.assertTrue(progress.to_json_object()["manual_progress"])
+
+        progress.compute(courses, {})
+        self.assertEqual([], progress.to_json_object()["sat_courses"])
+        self.assertNotIn("manual_progress", progress.to_json_object())
 
     def test_progress_manual_units(self):
         statement = RequirementsStatement.from_string('""24 units""{>=24u}')
@@ -247,3 +265,381 @@ class RequirementsProgressTest(TestCase):
         self.assertTrue(progress.is_fulfilled)
         self.assert_basic_progress(2, 2, progress)
         self.assertEqual(courses, progress.satisfied_courses)
+
+    def test_satisfier_map_matches_satisfies(self):
+        Course.objects.create(subject_id="6.00", title="Intro", public=True, children="6.0001,6.0002").save()
+        Course.objects.create(subject_id="6.0001", title="Intro 1", public=True, parent="6.00").save()
+        Course.objects.create(subject_id="6.0002", title="Intro 2", public=True, parent="6.00").save()
+        courses = list(Course.objects.all().order_by("subject_id"))
+        courses.append(Course.make_generic("HASS-H", 0))
+        courses.append(Course.make_generic("PHY2", 1))
+        satisfier_map = SatisfierMap(courses)
+        for req in ["2.001", "GIR:PHY1", "GIR:PHY2", "PHY2", "HASS", "HASS-A", "HASS-H", "HASS-S",
+                    "CI-H", "CI-HW", "6.00", "6.0001", "21M.030"]:
+            self.assertEqual([c for c in courses if c.satisfies(req, courses)],
+                             satisfier_map.satisfying_courses(req))
+
+
+SAMPLE_LIST = """Major 2#,#Mechanical Engineering#,#Mechanical Engineering#,#Bachelor of Science in Mechanical Engineering
+Some description
+
+core
+Core subjects
+electives
+Electives
+
+core := 2.001, 2.003
+electives := (2.001/2.002/2.003){>=2}, GIR:PHY1
+"""
+
+CHOICE_LIST = """Choice#,#Choice#,#Choice#,#Choice
+Some description
+
+choice
+Either subject
+
+choice := GIR:PHY1
+"""
+
+MANUAL_LIST = """Manual#,#Manual#,#Manual#,#Manual
+Some description
+
+courses
+Courses
+manual
+Manual
+
+courses := 2.001, 2.003
+manual := ""two subjects""{>=2}
+"""
+
+class CompiledRequirementsTest(TestCase):
+
+    def setUp(self):
+        for subject_id in ["2.001", "2.002", "2.003"]:
+            Course.objects.create(subject_id=subject_id, title="Foo", public=True, total_units=12).save()
+        self.req_list = RequirementsList.objects.create(list_id="major2.reql")
+        self.req_list.parse(SAMPLE_LIST)
+        self.req_list.save()
+
+    def test_compiled_json_matches_model(self):
+        compiled = get_compiled_requirements().get("major2.reql")
+        self.assertEqual(2, len(compiled.requirements))
+        self.assertEqual(self.req_list.to_json_object(full=True), compiled.to_json_object(full=True))
+        self.assertEqual(self.req_list.to_json_object(full=False), compiled.to_json_object(full=False))
+
+    def test_compiled_progress_without_queries(self):
+        compiled = get_compiled_requirements().get("major2.reql")
+        courses = list(Course.objects.filter(subject_id__in=["2.001", "2.003"]).order_by("subject_id"))
+        expected = RequirementsProgress(self.req_list, "major2")
+        expected.compute(courses, {})
+        get_snapshot()
+        with self.assertNumQueries(0):
+            progress = RequirementsProgress(compiled, "major2")
+            progress.compute(courses, {})
+            result = progress.to_json_object(True)
+        self.assertEqual(expected.to_json_object(True), result)
+
+    def test_compiled_invalidated_on_save(self):
+        compiled = get_compiled_requirements()
+        self.assertIsNone(compiled.get("minor1.reql"))
+        RequirementsList.objects.create(list_id="minor1.reql", short_title="Minor 1").save()
+        self.assertEqual("Minor 1", get_compiled_requirements().get("minor1.reql").short_title)
+
+    def test_editor_preview_keeps_compiled(self):
+        compiled = get_compiled_requirements()
+        response = self.client.post("/requirements/preview/", SAMPLE_LIST, content_type="text/plain")
+        self.assertEqual(200, response.status_code)
+        self.assertIs(compiled, get_compiled_requirements())
+        # Saves of deployed lists still invalidate the compiled lists
+        self.req_list.save()
+        self.assertIsNot(compiled, get_compiled_requirements())
+
+    def test_get_json_precomputed(self):
+        response = self.client.get("/requirements/get_json/major2/")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.req_list.to_json_object(full=True), json.loads(response.content))
+        response = self.client.get("/requirements/get_json/major2/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(304, response.status_code)
+        response = self.client.get("/requirements/get_json/major3/")
+        self.assertEqual(400, response.status_code)
+
+    def test_list_reqs_precomputed(self):
+        response = self.client.get("/requirements/list_reqs/")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("Major 2", json.loads(response.content)["major2"][JSONConstants.short_title])
+
+    def test_payloads_written_to_disk(self):
+        directory = tempfile.mkdtemp()
+        try:
+            compiled = CompiledRequirements.load(5)
+            write_payloads(compiled, directory)
+            with open(os.path.join(directory, "major2.json"), "rb") as file:
+                self.assertEqual(self.req_list.to_json_object(full=True), json.loads(file.read()))
+            # Payloads are only read from disk if the generation matches
+            with open(os.path.join(directory, "major2.json"), "wb") as file:
+                file.write(b'{"on-disk": true}')
+            payloads = RequirementsPayloads.load(compiled, directory)
+            self.assertEqual({"on-disk": True}, json.loads(payloads.get("major2").encodings["identity"]))
+            payloads = RequirementsPayloads.load(CompiledRequirements.load(6), directory)
+            self.assertEqual(self.req_list.to_json_object(full=True), json.loads(payloads.get("major2").encodings["identity"]))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_get_json_after_edit(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with self.settings(CATALOG_BASE_DIR=directory):
+                generation = RequirementsGeneration.objects.create()
+                write_payloads(CompiledRequirements.load(generation.pk))
+                # Start from the lists of a freshly started process
+                compiled_module._compiled = None
+                response = self.client.get("/requirements/get_json/major2/")
+                self.assertEqual("Major 2", json.loads(response.content)[JSONConstants.short_title])
+                self.assertFalse(get_compiled_requirements().edited)
+
+                self.req_list.short_title = "Edited Major"
+                self.req_list.save()
+                edited = self.client.get("/requirements/get_json/major2/")
+                self.assertEqual("Edited Major", json.loads(edited.content)[JSONConstants.short_title])
+                self.assertNotEqual(response["ETag"], edited["ETag"])
+                response = self.client.get("/requirements/list_reqs/")
+                self.assertEqual("Edited Major", json.loads(response.content)["major2"][JSONConstants.short_title])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_editor_preview_keeps_payloads(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with self.settings(CATALOG_BASE_DIR=directory):
+                generation = RequirementsGeneration.objects.create()
+                write_payloads(CompiledRequirements.load(generation.pk))
+                compiled_module._compiled = None
+                response = self.client.get("/requirements/get_json/major2/")
+                key = progress_key("major2.reql", get_compiled_requirements(), get_snapshot(), ["2.001"], {})
+
+                self.client.post("/requirements/preview/", SAMPLE_LIST, content_type="text/plain")
+                self.assertFalse(get_compiled_requirements().edited)
+                cached = self.client.get("/requirements/get_json/major2/", HTTP_IF_NONE_MATCH=response["ETag"])
+                self.assertEqual(304, cached.status_code)
+                self.assertEqual(key, progress_key("major2.reql", get_compiled_requirements(), get_snapshot(), ["2.001"], {}))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_progress_many(self):
+        road = {"coursesOfStudy": ["major2", "minor9"],
+                "selectedSubjects": [{"subject_id": "2.001"}, {"id": "2.003"}]}
+        response = self.client.post("/requirements/progress_many/", json.dumps(road), content_type="application/json")
+        self.assertEqual(200, response.status_code)
+        result = json.loads(response.content)
+        self.assertEqual(["minor9"], result["unknown"])
+        single = self.client.post("/requirements/progress/major2/", json.dumps(road), content_type="application/json")
+        self.assertEqual(json.loads(single.content), result["progress"]["major2"])
+
+        response = self.client.post("/requirements/progress_many/?lists=minor9", json.dumps(road), content_type="application/json")
+        self.assertEqual({"progress": {}, "unknown": ["minor9"]}, json.loads(response.content))
+        self.assertEqual(400, self.client.get("/requirements/progress_many/").status_code)
+
+    def test_resolve_courses(self):
+        get_snapshot()
+        with self.assertNumQueries(0):
+            courses = resolve_courses(["2.001", "HASS-H", "HASS-H", "CAL1", "CAL1", "XYZ", "9.99"])
+        self.assertEqual(["2.001", "HASS-H", "HASS-H", "CAL1", "CAL1"], [c.subject_id for c in courses])
+        self.assertEqual(Course.objects.get(subject_id="2.001"), courses[0])
+        # Repeated generic courses are distinct only if they can count more than once
+        self.assertEqual(["HASS-H0", "HASS-H1", "CAL1", "CAL1"], [c.id for c in courses[1:]])
+        self.assertEqual("HASS-H", courses[1].hass_attribute)
+        self.assertEqual([c.id for c in courses[1:]],
+                         [Course.make_generic(c.subject_id, i).id for i, c in enumerate(courses[1:])])
+
+    def post_delta(self, body, list_id="major2"):
+        response = self.client.post("/requirements/progress_delta/{}/".format(list_id), json.dumps(body), content_type="application/json")
+        return response.status_code, json.loads(response.content) if response.status_code == 200 else None
+
+    def test_progress_delta(self):
+        status, result = self.post_delta({"road": {"selectedSubjects": [{"subject_id": "2.001"}]}})
+        self.assertEqual(200, status)
+        self.assertFalse(result["incremental"])
+
+        status, result = self.post_delta({"base": result["revision"], "added": ["2.003", "2.002"], "removed": []})
+        self.assertTrue(result["incremental"])
+        expected = self.client.get("/requirements/progress/major2/2.001,2.003,2.002")
+        self.assertEqual(json.loads(expected.content), result["progress"])
+
+        status, result = self.post_delta({"base": result["revision"], "added": ["PHY1"], "removed": ["2.003"]})
+        self.assertTrue(result["incremental"])
+        expected = self.client.get("/requirements/progress/major2/2.001,2.002,PHY1")
+        self.assertEqual(json.loads(expected.content), result["progress"])
+
+        # Unknown revisions need the full road
+        status, result = self.post_delta({"base": "abc", "added": ["2.003"]})
+        self.assertEqual(400, status)
+
+    def test_progress_delta_overrides(self):
+        req_list = RequirementsList.objects.create(list_id="manual.reql")
+        req_list.parse(MANUAL_LIST)
+        req_list.save()
+        road = {"selectedSubjects": [{"subject_id": "2.001"}], "progressOverrides": {"manual.1": 1}}
+        overrides = {"manual.1": 2}
+        expected = RequirementsProgress(get_compiled_requirements().get("manual.reql"), "manual")
+        expected.compute(resolve_courses(["2.001", "2.003"]), overrides)
+        expected = expected.to_json_object(True)
+        self.assertTrue(expected["reqs"][1]["fulfilled"])
+
+        # The top-level overrides replace the road's, whether or not the base
+        # revision is available
+        status, base = self.post_delta({"road": road}, "manual")
+        status, result = self.post_delta({"base": base["revision"], "added": ["2.003"], "progressOverrides": overrides}, "manual")
+        self.assertTrue(result["incremental"])
+        self.assertEqual(expected, result["progress"])
+        road["selectedSubjects"].append({"subject_id": "2.003"})
+        status, result = self.post_delta({"base": "abc", "road": road, "progressOverrides": overrides}, "manual")
+        self.assertFalse(result["incremental"])
+        self.assertEqual(expected, result["progress"])
+
+    def test_recomputed_shares_clean_statements(self):
+        courses = resolve_courses(["2.001"])
+        progress = RequirementsProgress(get_compiled_requirements().get("major2.reql"), "major2")
+        progress.compute(courses, {})
+        new_courses = courses + resolve_courses(["PHY1"])
+        satisfier_map = SatisfierMap(new_courses)
+        dirty = dirty_progresses(progress, satisfier_map.course_keys[1], set())
+        new_progress = progress.recomputed(new_courses, {}, satisfier_map, dirty)
+        # Only the electives section can be satisfied by PHY1
+        self.assertIs(progress.children[0], new_progress.children[0])
+        self.assertIsNot(progress.children[1], new_progress.children[1])
+        self.assertEqual([], progress.children[1].children[1].satisfied_courses)
+        self.assertEqual(["PHY1"], [c.subject_id for c in new_progress.children[1].children[1].satisfied_courses])
+
+    def test_progress_result_cache(self):
+        progress_results.clear()
+        hits, misses = progress_results.hits, progress_results.misses
+        first = self.client.get("/requirements/progress/major2/2.003,2.001")
+        self.assertEqual((hits, misses + 1), (progress_results.hits, progress_results.misses))
+        second = self.client.get("/requirements/progress/major2/2.003,2.001")
+        self.assertEqual((hits + 1, misses + 1), (progress_results.hits, progress_results.misses))
+        self.assertEqual(first.content, second.content)
+        # The order of the road is part of the key
+        self.client.get("/requirements/progress/major2/2.001,2.003")
+        self.assertEqual(misses + 2, progress_results.misses)
+
+        # Progress overrides are part of the key
+        road = {"selectedSubjects": [{"id": "2.001"}, {"id": "2.003"}], "progressOverrides": {"major2.0": 1}}
+        self.client.post("/requirements/progress/major2/", json.dumps(road), content_type="application/json")
+        self.assertEqual(misses + 3, progress_results.misses)
+
+        # Reloading the requirements lists invalidates the results
+        self.req_list.save()
+        self.client.get("/requirements/progress/major2/2.001,2.003")
+        self.assertEqual(misses + 4, progress_results.misses)
+
+    def test_progress_depends_on_road_order(self):
+        Course.objects.create(subject_id="8.01", title="Physics", public=True, total_units=12, gir_attribute="PHY1").save()
+        Course.objects.create(subject_id="8.01L", title="Physics", public=True, total_units=6, gir_attribute="PHY1").save()
+        req_list = RequirementsList.objects.create(list_id="choice.reql")
+        req_list.parse(CHOICE_LIST)
+        req_list.save()
+        progress_results.clear()
+
+        results = []
+        for order, units in [(["8.01", "8.01L"], 12), (["8.01L", "8.01"], 6)]:
+            progress = RequirementsProgress(req_list, "choice")
+            progress.compute(resolve_courses(order), {})
+            # The first satisfying course in the road determines the units
+            self.assertEqual(units, progress.children[0].unit_fulfillment.progress)
+            expected = progress.to_json_object(True)
+            self.assertEqual(order, expected["reqs"][0]["sat_courses"])
+            response = self.client.get("/requirements/progress/choice/" + ",".join(order))
+            self.assertEqual(expected, json.loads(response.content))
+            road = {"coursesOfStudy": ["choice"], "selectedSubjects": [{"id": subject_id} for subject_id in order]}
+            response = self.client.post("/requirements/progress_many/", json.dumps(road), content_type="application/json")
+            self.assertEqual(expected, json.loads(response.content)["progress"]["choice"])
+            results.append(expected)
+        self.assertNotEqual(results[0], results[1])
+
+    def test_cache_stats_requires_staff(self):
+        self.assertEqual(302, self.client.get("/requirements/cache_stats/").status_code)
+
+
+BATCH_LIST = """Batch#,#Batch#,#Batch#,#Batch
+Description
+
+core
+Core
+choice
+Choice
+thresh
+Threshold
+units
+Units
+categories
+Categories
+closest
+Closest
+manual
+Manual
+manual_units
+Manual units
+girs
+GIRs
+intro
+Intro
+
+core := 2.001, 2.003
+choice := 2.001/2.002/(2.003, 2.004)
+thresh := 2.001/2.002/2.003/2.004/GIR:PHY1{>=2}
+units := 2.001/2.002/2.003/21M.421/HASS{>=30u}
+categories := (2.001/2.002), (2.003/2.004), HASS, CI-H{>=3|>=2}
+closest := (2.001, 2.002)/2.003/(CI-H, HASS){|>1}
+manual := ""two subjects""{>=2}
+manual_units := ""some units""{>=24u}
+girs := GIR:PHY1{>=2}, HASS{>=2}
+intro := 6.00/(6.0001/6.0002{>=2|>=2})
+"""
+
+class BatchEvaluatorTest(TestCase):
+
+    def setUp(self):
+        for subject_id, units in [("2.001", 12), ("2.002", 9), ("2.003", 6), ("2.004", 15)]:
+            Course.objects.create(subject_id=subject_id, title="Foo", public=True, total_units=units).save()
+        Course.objects.create(subject_id="8.01", title="Physics", public=True, total_units=12, gir_attribute="PHY1").save()
+        Course.objects.create(subject_id="8.01L", title="Physics", public=True, total_units=6, gir_attribute="PHY1",
+                              is_half_class=True).save()
+        Course.objects.create(subject_id="21M.421", title="MITSO", public=True, total_units=6, hass_attribute="HASS-A").save()
+        Course.objects.create(subject_id="21M.030", title="World Music", public=True, total_units=12, hass_attribute="HASS-A",
+                              communication_requirement="CI-H").save()
+        Course.objects.create(subject_id="21H.001", title="History", public=True, total_units=6, hass_attribute="HASS-H",
+                              is_half_class=True).save()
+        Course.objects.create(subject_id="6.00", title="Intro", public=True, total_units=12, children="6.0001,6.0002").save()
+        Course.objects.create(subject_id="6.0001", title="Intro 1", public=True, total_units=6, parent="6.00").save()
+        Course.objects.create(subject_id="6.0002", title="Intro 2", public=True, total_units=6, parent="6.00").save()
+        req_list = RequirementsList.objects.create(list_id="batch.reql")
+        req_list.parse(BATCH_LIST)
+        req_list.save()
+
+    def test_batch_matches_progress(self):
+        subject_ids = ["2.001", "2.002", "2.003", "2.004", "8.01", "8.01L", "21M.421", "21M.030",
+                       "21H.001", "6.0001", "6.0002", "PHY1", "HASS-S", "CI-H", "nonexistent"]
+        rng = random.Random(4)
+        # The first satisfying course gives the units of the HASS requirement
+        roads = [[], ["2.001", "2.001", "2.003"], ["21M.030", "21M.421"], ["21M.421", "21M.030"]]
+        overrides = [{}, {"batch.6": 3}, {}, {}]
+        for i in range(60):
+            roads.append([rng.choice(subject_ids) for j in range(rng.randint(0, 10))])
+            overrides.append({"batch.6": rng.randint(-1, 3), "batch.7": rng.choice([0, 6, 12, 30])} if i % 3 == 0 else {})
+
+        req = get_compiled_requirements().get("batch.reql")
+        result = BatchEvaluator(req, "batch").evaluate(roads, overrides)
+        for road_index, road in enumerate(roads):
+            progress = RequirementsProgress(req, "batch")
+            progress.compute(resolve_courses(road), overrides[road_index])
+            stack = [progress]
+            while stack:
+                node = stack.pop()
+                stack.extend(node.children)
+                column = result.index(node.list_path)
+                message = "road {} at {}".format(road, node.list_path)
+                self.assertEqual(node.is_fulfilled, result.fulfilled[road_index, column], message)
+                for field in ("progress", "subject_progress", "subject_max", "unit_progress", "unit_max"):
+                    self.assertEqual(getattr(node, field), getattr(result, field)[road_index, column], message)
+                self.assertEqual(node.progress_max, result.max[road_index, column], message)
@@ -17,7 +17,10 @@ urlpatterns = [
     url(r'^uncommit/(?P<edit_req>\d+)', editor.uncommit, name='uncommit'),
     url(r'^commit/(?P<edit_req>\d+)', editor.commit, name='commit'),
     url(r'^list_reqs/', views.list_reqs, name='list_reqs'),
+    url(r'^cache_stats/', views.cache_stats, name='cache_stats'),
     url(r'^get_json/(?P<list_id>.{1,50})/', views.get_json, name='get_json'),
+    url(r'^progress_many/', views.progress_many, name='progress_many'),
+    url(r'^progress_delta/(?P<list_id>.{1,50})/', views.progress_delta, name='progress_delta'),
     url(r'^progress/(?P<list_id>.{1,50})/(?P<courses>.+)', views.progress, name='progress'),
     url(r'^progress/(?P<list_id>.{1,50})/', views.road_progress, name='road_progress'),
     url(r'^$', editor.index, name='requirements_index'),
@@ -5,14 +5,21 @@ from .models import *
 from django.contrib.auth import login, authenticate, logout
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
 from common.decorators import logged_in_or_basicauth
+from django.contrib.admin.views.decorators import staff_member_required
 import json
 import os
 import requests
 from courseupdater.views import *
 from sync.models import Road
 import re
-from progress import RequirementsProgress
+from progress import RequirementsProgress, SatisfierMap, resolve_courses
+from compiled import get_compiled_requirements
+from incremental import ProgressState, get_state, store_state, progress_states
+from progress_cache import progress_results, progress_key
+from payloads import get_payloads
+from common.responses import payload_response
 from catalog.models import Course, Attribute, HASSAttribute, GIRAttribute, CommunicationAttribute
+from catalog.snapshot import get_snapshot
 import logging
 
 REQUIREMENTS_EXT = ".reql"
@@ -22,68 +29,98 @@ SUBJECT_ID_ALT_KEY = "id"
 
 def get_json(request, list_id):
     """Returns the raw JSON for a given requirements list, without user
-    course progress."""
+    course progress. The JSON is rendered ahead of time (see
+    requirements.payloads)."""
 
-    try:
-        req = RequirementsList.objects.get(list_id=list_id + REQUIREMENTS_EXT)
+    payload = get_payloads().get(list_id)
+    if payload is None:
+        return HttpResponseBadRequest("the requirements list {} does not exist".format(list_id))
+    return payload_response(request, payload)
+
+def progress_json_object(req, list_id, course_objs, progress_overrides, satisfier_map=None):
+    """Computes the progress on the given compiled requirements list and
+    returns its JSON representation. If satisfier_map is not None, it should
+    be a SatisfierMap built from course_objs."""
+    prog = RequirementsProgress(req, list_id)
+    prog.compute(course_objs, progress_overrides, satisfier_map)
+    return prog.to_json_object(True)
+
+class ResolvedRoad(object):
+    """The courses in a road, in road order, along with their SatisfierMap.
+    Both are only built when they are first needed, so that they can be shared
+    by several progress computations and skipped if every result is cached."""
+
+    def __init__(self, subject_ids):
+        self.subject_ids = list(subject_ids)
+        self._courses = None
+        self._satisfier_map = None
+
+    @property
+    def courses(self):
+        if self._courses is None:
+            self._courses = resolve_courses(self.subject_ids)
+        return self._courses
+
+    @property
+    def satisfier_map(self):
+        if self._satisfier_map is None:
+            self._satisfier_map = SatisfierMap(self.courses)
+        return self._satisfier_map
+
+def progress_content(compiled, list_id, road, progress_overrides):
+    """Returns the serialized progress JSON on the given list, which must be in
+    the given CompiledRequirements, for the given ResolvedRoad. The result is
+    taken from the progress cache if possible (see requirements.progress_cache)."""
+    key = progress_key(list_id, compiled, get_snapshot(), road.subject_ids, progress_overrides)
+    content = progress_results.get(key)
+    if content is None:
+        req = compiled.get(list_id + REQUIREMENTS_EXT)
         # to pretty-print, use these keyword arguments to json.dumps:
         # sort_keys=True, indent=4, separators=(',', ': ')
-        return HttpResponse(json.dumps(req.to_json_object(full=True)), content_type="application/json")
-    except ObjectDoesNotExist:
-        return HttpResponseBadRequest("the requirements list {} does not exist".format(list_id))
+        content = json.dumps(progress_json_object(req, list_id, road.courses, progress_overrides, road.satisfier_map))
+        progress_results.set(key, content)
+    return content
 
 def compute_progress(request, list_id, course_list, progress_overrides):
     """Utility function for road_progress and progress that computes and returns
     the progress on the given requirements list."""
-    try:
-        req = RequirementsList.objects.get(list_id=list_id + REQUIREMENTS_EXT)
-    except ObjectDoesNotExist:
+    compiled = get_compiled_requirements()
+    if compiled.get(list_id + REQUIREMENTS_EXT) is None:
         return HttpResponseBadRequest("the requirements list {} does not exist".format(list_id))
 
-    # Get Course objects
-    course_objs = []
-    #required to give generic courses unique id's so muliple can count towards requirement
-    unique_generic_id = 0
-    for subject_id in course_list:
-        try:
-            course_objs.append(Course.public_courses().get(subject_id=subject_id))
-        except ObjectDoesNotExist:
-            try:
-                course_objs.append(Course.make_generic(subject_id,unique_generic_id))
-                unique_generic_id += 1
-            except ValueError:
-                print("Warning: course {} does not exist in the catalog".format(subject_id))
+    content = progress_content(compiled, list_id, ResolvedRoad(course_list), progress_overrides)
+    return HttpResponse(content, content_type="application/json")
 
-
-    # Create a progress object for the requirements list
-    prog = RequirementsProgress(req, list_id)
-    prog.compute(course_objs, progress_overrides)
-    # to pretty-print, use these keyword arguments to json.dumps:
-    # sort_keys=True, indent=4, separators=(',', ': ')
-    return HttpResponse(json.dumps(prog.to_json_object(True)), content_type="application/json")
-
-@logged_in_or_basicauth
-def road_progress_get(request, list_id):
-    """Returns the raw JSON for a given requirements list including user
-    progress. A 'road' query parameter should be passed that indicates the ID
-    number of the road that is being checked."""
+def read_road(request):
+    """Reads the contents of the road whose ID is given in the 'road' query
+    parameter, which must belong to the logged-in user. Returns a tuple
+    containing the road JSON and None, or None and an error response."""
     road_id = request.GET.get("road", "")
     if road_id is None or len(road_id) == 0:
-        return HttpResponseBadRequest("need a road ID")
+        return None, HttpResponseBadRequest("need a road ID")
     try:
         road_id = int(road_id)
     except:
-        return HttpResponseBadRequest("road ID must be an integer")
+        return None, HttpResponseBadRequest("road ID must be an integer")
 
     try:
         road = Road.objects.get(user=request.user, pk=road_id)
     except ObjectDoesNotExist:
-        return HttpResponseBadRequest("the road does not exist on the server")
+        return None, HttpResponseBadRequest("the road does not exist on the server")
 
     try:
-        contents = json.loads(Road.expand(road.contents))
+        return json.loads(Road.expand(road.contents)), None
     except:
-        return HttpResponseBadRequest("badly formatted road contents")
+        return None, HttpResponseBadRequest("badly formatted road contents")
+
+@logged_in_or_basicauth
+def road_progress_get(request, list_id):
+    """Returns the raw JSON for a given requirements list including user
+    progress. A 'road' query parameter should be passed that indicates the ID
+    number of the road that is being checked."""
+    contents, error = read_road(request)
+    if error is not None:
+        return error
 
     progress_overrides = contents.get("progressOverrides", {})
 
@@ -133,12 +170,141 @@ def progress(request, list_id, courses):
     in courses as a comma-separated list of subject IDs."""
     return compute_progress(request, list_id, [c for c in courses.split(",") if len(c)], {})
 
+MAX_PROGRESS_LISTS = 20
+COURSES_OF_STUDY_KEY = "coursesOfStudy"
+
+def compute_progress_many(contents, list_ids):
+    """Computes the progress on each of the given requirements lists using the
+    given road JSON, resolving the road's courses only once. Returns a response
+    containing a dictionary of list IDs to progress JSON, and the list IDs that
+    do not exist."""
+    if list_ids is None:
+        list_ids = [list_id for list_id in contents.get(COURSES_OF_STUDY_KEY, []) if isinstance(list_id, basestring)]
+    if len(list_ids) > MAX_PROGRESS_LISTS:
+        return HttpResponseBadRequest("can't compute progress for more than {} lists at once".format(MAX_PROGRESS_LISTS))
+
+    progress_overrides = contents.get("progressOverrides", {})
+    road = ResolvedRoad(read_subjects(contents))
+
+    compiled = get_compiled_requirements()
+    results = []
+    unknown = []
+    for list_id in list_ids:
+        if compiled.get(list_id + REQUIREMENTS_EXT) is None:
+            unknown.append(list_id)
+            continue
+        results.append(json.dumps(list_id) + ": " + progress_content(compiled, list_id, road, progress_overrides))
+    # Splice the serialized progress for each list into the response
+    content = '{{"progress": {{{}}}, "unknown": {}}}'.format(", ".join(results), json.dumps(unknown))
+    return HttpResponse(content, content_type="application/json")
+
+def read_list_ids(request):
+    """Returns the list IDs in the comma-separated 'lists' query parameter, or
+    None if it is not present."""
+    if "lists" not in request.GET:
+        return None
+    list_ids = []
+    for list_id in request.GET["lists"].split(","):
+        list_id = list_id.strip()
+        if len(list_id) > 0 and list_id not in list_ids:
+            list_ids.append(list_id)
+    return list_ids
+
+@logged_in_or_basicauth
+def progress_many_get(request):
+    """Returns the progress on several requirements lists for the road whose
+    ID is given in the 'road' query parameter."""
+    contents, error = read_road(request)
+    if error is not None:
+        return error
+    return compute_progress_many(contents, read_list_ids(request))
+
+@csrf_exempt
+def progress_many(request):
+    """Returns the progress on several requirements lists at once. If the
+    method is POST, expects the road contents in the request body. If it is
+    GET, expects an authorization token and a 'road' query parameter
+    containing the ID number of the road to check. The lists are given as a
+    comma-separated 'lists' query parameter, and default to the road's
+    courses of study."""
+    if request.method == 'POST':
+        try:
+            contents = json.loads(request.body)
+        except:
+            return HttpResponseBadRequest("badly formatted road contents")
+        if not isinstance(contents, dict):
+            return HttpResponseBadRequest("badly formatted road contents")
+        return compute_progress_many(contents, read_list_ids(request))
+    elif 'road' in request.GET:
+        return progress_many_get(request)
+    return HttpResponseBadRequest("need a road ID or road contents")
+
+def read_subject_ids(value):
+    """Returns the given JSON value if it is a list of subject IDs, or None."""
+    if not isinstance(value, list) or not all(isinstance(subject_id, basestring) for subject_id in value):
+        return None
+    return value
+
+@csrf_exempt
+def progress_delta(request, list_id):
+    """Returns the progress on the given requirements list after a change to a
+    road, recomputing only the requirements affected by the change. The POST
+    body should be a JSON dictionary with the revision returned by a previous
+    call in 'base', and lists of subject IDs in 'added' and 'removed'. The
+    full road can be passed in 'road', and is used if the base revision is
+    missing or no longer available. If 'progressOverrides' is given, it
+    replaces the road's manual progress values in either case."""
+    if request.method != 'POST':
+        return HttpResponseBadRequest("expected a POST request")
+    try:
+        body = json.loads(request.body)
+    except:
+        return HttpResponseBadRequest("badly formatted request body")
+    if not isinstance(body, dict):
+        return HttpResponseBadRequest("badly formatted request body")
+
+    req = get_compiled_requirements().get(list_id + REQUIREMENTS_EXT)
+    if req is None:
+        return HttpResponseBadRequest("the requirements list {} does not exist".format(list_id))
+
+    progress_overrides = body.get("progressOverrides")
+    if progress_overrides is not None and not isinstance(progress_overrides, dict):
+        return HttpResponseBadRequest("badly formatted progress overrides")
+
+    state = get_state(body.get("base"), list_id, req)
+    if state is not None:
+        added = read_subject_ids(body.get("added", []))
+        removed = read_subject_ids(body.get("removed", []))
+        if added is None or removed is None:
+            return HttpResponseBadRequest("added and removed should be lists of subject IDs")
+        state = state.apply_delta(added, removed, progress_overrides)
+        incremental = True
+    elif isinstance(body.get("road"), dict):
+        contents = body["road"]
+        if progress_overrides is None:
+            progress_overrides = contents.get("progressOverrides", {})
+        state = ProgressState.compute(list_id, req, read_subjects(contents), progress_overrides)
+        incremental = False
+    else:
+        return HttpResponseBadRequest("the base revision is not available - send the full road")
+
+    result = {
+        "revision": store_state(state),
+        "incremental": incremental,
+        "progress": state.progress.to_json_object(True)
+    }
+    return HttpResponse(json.dumps(result), content_type="application/json")
+
+@staff_member_required
+def cache_stats(request):
+    """Returns the sizes and hit counts of the progress caches, for monitoring."""
+    stats = {
+        "progress_results": progress_results.stats(),
+        "progress_states": progress_states.stats()
+    }
+    return HttpResponse(json.dumps(stats), content_type="application/json")
+
 def list_reqs(request):
     """Return a JSON dictionary of all available requirements lists, with the
     basic metadata for those lists."""
-    list_ids = { }
-    for req in RequirementsList.objects.all():
-        req_metadata = req.to_json_object(full=False)
-        del req_metadata[JSONConstants.list_id]
-        list_ids[req.list_id.replace(REQUIREMENTS_EXT, "")] = req_metadata
-    return HttpResponse(json.dumps(list_ids), content_type="application/json")
+    return payload_response(request, get_payloads().manifest)
@@ -9,7 +9,10 @@ from courseupdater.views import *
 from courseupdater.models import CatalogUpdate
 import catalog_parse as cp
 from requirements.models import *
+from requirements.compiled import CompiledRequirements
+from requirements.payloads import write_payloads
 from catalog.models import *
+from catalog.snapshot import batch_course_changes
 from sync.models import *
 from django.db import DatabaseError, transaction
 from django import db
@@ -72,6 +75,7 @@ def update_catalog_with_file(path, semester):
                     if key not in CSV_HEADERS: continue
                     prop, converter = CSV_HEADERS[key]
                     setattr(course, prop, converter(val.decode('utf-8')))
+                # Saving the course also updates its schedule slots
                 course.save()
 
 def parse_related_file(path):
@@ -88,23 +92,26 @@ def parse_related_file(path):
 
 def update_catalog():
     """Parses all files in the current semester catalog, replacing the existing Course objects."""
-    Course.public_courses().delete()
-
     semester = list_semesters()[-1]
     catalog_files = compute_semester_delta(semester.split("-"), 0, 0)[CATALOG_FILES_INFO_KEY]
 
-    related_path = None
-    for path in catalog_files:
-        filename = os.path.basename(path)
-        if any(f in filename for f in EXCLUDED_FILENAMES): continue
-        print(filename)
-        if "related" in filename:
-            # Save this for last
-            related_path = path
-        else:
-            update_catalog_with_file(os.path.join(settings.CATALOG_BASE_DIR, path), semester)
-    if related_path is not None:
-        parse_related_file(os.path.join(settings.CATALOG_BASE_DIR, related_path))
+    # Signal running server processes to reload their catalog snapshots once,
+    # after every course has been saved
+    with batch_course_changes(semester):
+        Course.public_courses().delete()
+
+        related_path = None
+        for path in catalog_files:
+            filename = os.path.basename(path)
+            if any(f in filename for f in EXCLUDED_FILENAMES): continue
+            print(filename)
+            if "related" in filename:
+                # Save this for last
+                related_path = path
+            else:
+                update_catalog_with_file(os.path.join(settings.CATALOG_BASE_DIR, path), semester)
+        if related_path is not None:
+            parse_related_file(os.path.join(settings.CATALOG_BASE_DIR, related_path))
 
 ### REQUIREMENTS UPDATE
 
@@ -173,6 +180,10 @@ def update_requirements():
             new_req.parse(file.read().decode('utf-8'))
         new_req.save()
 
+    # Render the JSON for each list, then tell running server processes to
+    # recompile their requirements lists and load the new JSON
+    generation = RequirementsGeneration.objects.create()
+    write_payloads(CompiledRequirements.load(generation.pk))
     print("The database was successfully updated with {} requirements files.".format(len(req_urls[REQUIREMENTS_INFO_KEY])))
 
 ### EDIT REQUESTS